@@ -0,0 +1,13 @@
+################################################################################
+#    @author: Greg Kramida (github id: Algomorph)
+# @copyright: (2015-2016) Gregory Kramida
+#   @license: Apache V2
+#            [That means (basically): feel free to modify, sell,
+#             whatever, just do not remove the original author's credits/notice
+#             from the files. For details, see LICENSE file.]
+################################################################################
+# This package contains the benchmarks for the spider's parsing code and the
+# database helpers, along with generators of synthetic pages and notices.
+#
+# Run from root directory (top-level fbo_scraper folder) like this:
+#     python -m benchmarks.run_benchmarks
@@ -0,0 +1,241 @@
+################################################################################
+#    @author: Greg Kramida (github id: Algomorph)
+# @copyright: (2015-2016) Gregory Kramida
+#   @license: Apache V2
+#            [That means (basically): feel free to modify, sell,
+#             whatever, just do not remove the original author's credits/notice
+#             from the files. For details, see LICENSE file.]
+################################################################################
+'''
+End-to-end load test: runs FboDarpaSpider, with the project's middlewares & pipelines, against
+the local mock of fbo.gov & darpa.mil (see mock_server.py), in a temporary directory, and reports
+notices per second, download concurrency & pipeline lag.
+
+Run from root directory (top-level fbo_scraper folder) like this:
+    python -m benchmarks.loadtest --notices 10000 --concurrency 16 --latency 0.05 --error_rate 0.01
+'''
+import os
+import sys
+import json
+import time
+import shutil
+import tempfile
+import argparse
+
+# with "python -m", the root directory is on the path as "" (the working directory), while the load
+# test runs in a temporary directory & scrapy imports the middlewares & pipelines by name
+if sys.path and sys.path[0] == "":
+    sys.path[0] = os.getcwd()
+
+from twisted.internet import reactor, task
+from scrapy import signals
+from scrapy.crawler import CrawlerRunner
+from scrapy.settings import Settings
+from scrapy.utils.log import configure_logging
+
+from fbo_scraper.spiders.fbo_darpa_spider import FboDarpaSpider
+from fbo_scraper.pipelines import FboScraperExcelPipeline
+from benchmarks import mock_server
+
+# seconds between samples of the download concurrency & the database writer queue
+sample_interval = 0.25
+
+
+def percentile(values, share):
+    if len(values) == 0:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(share * len(values)))]
+
+
+def summarize(values):
+    if len(values) == 0:
+        return {"mean": None, "p95": None, "max": None}
+    return {"mean": sum(values) / float(len(values)), "p95": percentile(values, 0.95), "max": max(values)}
+
+
+class LoadTestProbe(object):
+    '''
+    Samples the crawl through scrapy signals: notice latency (notice page received ==> item through
+    all pipelines), download concurrency & the length of the database writer queue
+    '''
+    def __init__(self, crawler):
+        self.crawler = crawler
+        # notice url ==> time its response was received
+        self.received_times = {}
+        self.item_latencies = []
+        self.concurrency_samples = []
+        self.writer_queue_samples = []
+        self.item_count = 0
+        self.open_time = self.first_item_time = self.last_item_time = self.close_time = None
+        self.looping_call = task.LoopingCall(self.sample)
+        crawler.signals.connect(self.spider_opened, signal = signals.spider_opened)
+        crawler.signals.connect(self.spider_closed, signal = signals.spider_closed)
+        crawler.signals.connect(self.response_received, signal = signals.response_received)
+        crawler.signals.connect(self.item_scraped, signal = signals.item_scraped)
+
+    def spider_opened(self, spider):
+        self.open_time = time.time()
+        self.looping_call.start(sample_interval)
+
+    def spider_closed(self, spider):
+        self.close_time = time.time()
+        if self.looping_call.running:
+            self.looping_call.stop()
+
+    def response_received(self, response, request, spider):
+        self.received_times[request.url] = time.time()
+
+    def item_scraped(self, item, response, spider):
+        now = time.time()
+        self.item_count += 1
+        if self.first_item_time is None:
+            self.first_item_time = now
+        self.last_item_time = now
+        received_time = self.received_times.pop(item["program_url"], None)
+        if received_time is not None:
+            self.item_latencies.append(now - received_time)
+
+    def writer(self):
+        for pipeline in self.crawler.engine.scraper.itemproc.middlewares:
+            if isinstance(pipeline, FboScraperExcelPipeline):
+                return pipeline.writer
+        return None
+
+    def sample(self):
+        if self.crawler.engine is None or not self.crawler.engine.running:
+            return
+        self.concurrency_samples.append(len(self.crawler.engine.downloader.active))
+        writer = self.writer()
+        if writer is not None:
+            self.writer_queue_samples.append(writer.queue_length())
+
+    def report(self):
+        crawl_seconds = (self.last_item_time or self.close_time) - self.open_time
+        return {
+            "notices": self.item_count,
+            "crawl_seconds": crawl_seconds,
+            "notices_per_second": self.item_count / crawl_seconds if crawl_seconds > 0 else None,
+            # writer drain, report & export after the last notice went through the pipelines
+            "shutdown_seconds": self.close_time - (self.last_item_time or self.close_time),
+            "download_concurrency": summarize(self.concurrency_samples),
+            "notice_latency_seconds": summarize(self.item_latencies),
+            "writer_queue_length": summarize(self.writer_queue_samples)
+        }
+
+
+def make_settings(args, address, directory):
+    settings = Settings()
+    settings.setmodule("fbo_scraper.settings", priority = "project")
+    settings.setdict({
+        "FBO_MOCK_SITES_ADDRESS": address,
+        "DOWNLOAD_HANDLERS": {"http": "benchmarks.mock_server.MockSitesDownloadHandler",
+                              "https": "benchmarks.mock_server.MockSitesDownloadHandler"},
+        "HTTPCACHE_ENABLED": False,
+        "DOWNLOAD_DELAY": args.delay,
+        "CONCURRENT_REQUESTS": args.concurrency,
+        "CONCURRENT_REQUESTS_PER_DOMAIN": args.concurrency,
+        "SPIDER_MIDDLEWARES": {"benchmarks.mock_server.LosingDarpaPagesMiddleware": 50},
+        "FBO_MOCK_LOSE_DARPA_PAGES": args.lose_darpa_pages,
+        "FBO_THROTTLE_ENABLED": args.throttle,
+        "FBO_THROTTLE_START_DELAY": args.delay,
+        "FBO_DB_BACKEND": args.backend,
+        "FBO_DB_WRITER_THREAD": not args.no_writer_thread,
+        "FBO_METRICS_FILE": os.path.join(directory, "fbo_metrics.json"),
+        "FBO_METRICS_INTERVAL": 0,
+        "TELNETCONSOLE_ENABLED": False,
+        "LOG_LEVEL": args.log_level
+    }, priority = "cmdline")
+    return settings
+
+
+def run_load_test(args):
+    '''
+    @return dictionary with the load test report
+    '''
+    directory = tempfile.mkdtemp()
+    working_directory = os.getcwd()
+    sites = mock_server.MockSites(args.notices, args.announcements, args.latency, args.error_rate)
+    listening_port = mock_server.listen(sites)
+    address = "127.0.0.1:" + str(listening_port.getHost().port)
+    # the database, report & metrics go into the temporary directory
+    os.chdir(directory)
+    stdout = sys.stdout
+    try:
+        settings = make_settings(args, address, directory)
+        configure_logging(settings)
+        runner = CrawlerRunner(settings)
+        crawler = runner.create_crawler(FboDarpaSpider)
+        probe = LoadTestProbe(crawler)
+        if not args.verbose:
+            # the spider & the database helpers are very chatty
+            sys.stdout = open(os.devnull, "w")
+        deferred = runner.crawl(crawler, date_range = "all", agencies = "darpa", checkpoint = "", offices = "")
+        deferred.addErrback(lambda failure: failure.printTraceback(stdout))
+        deferred.addBoth(lambda _: reactor.stop())
+        reactor.run()
+    finally:
+        if sys.stdout is not stdout:
+            sys.stdout.close()
+            sys.stdout = stdout
+        os.chdir(working_directory)
+        shutil.rmtree(directory, ignore_errors = True)
+    report = probe.report()
+    report["requests_served"] = sites.request_counts
+    report["errors_served"] = sites.error_counts
+    report["parameters"] = vars(args)
+    report["scrapy_stats"] = dict((key, value) for key, value in crawler.stats.get_stats().items()
+                                  if key.startswith(("downloader/", "retry/", "item_scraped_count")))
+    return report
+
+
+def print_report(report):
+    print "\n========  Load test: " + str(report["parameters"]["notices"]) + " notices  ========"
+    print "notices stored:        %d" % report["notices"]
+    print "crawl seconds:         %.1f" % report["crawl_seconds"]
+    print "notices per second:    %.1f" % (report["notices_per_second"] or 0.0)
+    print "shutdown seconds:      %.1f" % report["shutdown_seconds"]
+    for name, unit in (("download_concurrency", ""), ("notice_latency_seconds", " s"), ("writer_queue_length", "")):
+        summary = report[name]
+        if summary["mean"] is None:
+            continue
+        print "%-22s mean %.2f%s, p95 %.2f%s, max %.2f%s" % (name.replace("_", " ") + ":", summary["mean"], unit,
+                                                              summary["p95"], unit, summary["max"], unit)
+    print "requests served:       " + ", ".join(kind + " " + str(count) for kind, count
+                                                in sorted(report["requests_served"].items()))
+    if report["errors_served"]:
+        print "errors served:         " + ", ".join(kind + " " + str(count) for kind, count
+                                                    in sorted(report["errors_served"].items()))
+
+
+def main():
+    parser = argparse.ArgumentParser(description = "Run the spider & pipelines against a local mock of fbo.gov & darpa.mil.")
+    parser.add_argument("--notices", type = int, default = 10000, help = "number of notices on the mock fbo.gov")
+    parser.add_argument("--announcements", type = int, default = None,
+                        help = "number of darpa.mil announcements (defaults to a tenth of the notices)")
+    parser.add_argument("--latency", type = float, default = 0.05, help = "mean response delay of the mock, in seconds")
+    parser.add_argument("--error_rate", type = float, default = 0.0, help = "share of requests the mock answers with 503")
+    parser.add_argument("--concurrency", type = int, default = 16, help = "CONCURRENT_REQUESTS (also per domain)")
+    parser.add_argument("--delay", type = float, default = 0.0, help = "DOWNLOAD_DELAY")
+    parser.add_argument("--throttle", action = "store_true", help = "enable the adaptive throttle")
+    parser.add_argument("--lose_darpa_pages", type = int, default = 0,
+                        help = "number of darpa.mil listing page requests to drop without a callback or an errback")
+    parser.add_argument("--backend", default = "sqlite", choices = ["sqlite", "excel"], help = "FBO_DB_BACKEND")
+    parser.add_argument("--no_writer_thread", action = "store_true", help = "write notices on the reactor thread")
+    parser.add_argument("--log_level", default = "WARNING", help = "scrapy log level")
+    parser.add_argument("--output", default = None, help = "write the report as json to this file")
+    parser.add_argument("-v", "--verbose", action = "store_true", help = "show the spider's output")
+    args = parser.parse_args()
+
+    report = run_load_test(args)
+    print_report(report)
+    if args.output:
+        with open(args.output, "w") as output_file:
+            json.dump(report, output_file, indent = 2, sort_keys = True)
+    if report["notices"] < args.notices:
+        print "===> Only " + str(report["notices"]) + " of " + str(args.notices) + " notices went through the pipelines"
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
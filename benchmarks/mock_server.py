@@ -0,0 +1,176 @@
+################################################################################
+#    @author: Greg Kramida (github id: Algomorph)
+# @copyright: (2015-2016) Gregory Kramida
+#   @license: Apache V2
+#            [That means (basically): feel free to modify, sell,
+#             whatever, just do not remove the original author's credits/notice
+#             from the files. For details, see LICENSE file.]
+################################################################################
+'''
+Local stand-in for www.fbo.gov & www.darpa.mil, serving synthetic darpa.mil listing pages,
+fbo.gov list pages (answering the list query POST) and notice pages, with configurable
+latency & error rate. Used by the load test (see loadtest.py) through MockSitesDownloadHandler,
+or standalone:
+
+    python -m benchmarks.mock_server --port 8080 --notices 10000 --latency 0.05 --error_rate 0.01
+'''
+import sys
+import random
+import argparse
+from urlparse import urlparse, urlunparse
+
+from twisted.internet import reactor
+from twisted.web import server, resource
+from scrapy.http import Request
+from scrapy.core.downloader.handlers.http11 import HTTP11DownloadHandler
+
+from benchmarks import synthetic
+
+DARPA_LIST = "darpa_list"
+FBO_LIST = "fbo_list"
+FBO_NOTICE = "fbo_notice"
+
+
+class MockSites(resource.Resource):
+    '''
+    Serves all the pages the spider requests, by path & query:
+    /work-with-us/opportunities?PP=<n> (darpa.mil), /index?mode=list&pageID=<n> (fbo.gov list)
+    & /index?mode=form&id=<notice id> (fbo.gov notice)
+    '''
+    isLeaf = True
+
+    def __init__(self, notice_count, announcement_count = None, latency = 0.0, error_rate = 0.0,
+                 paragraphs = 5, formatting = synthetic.PLAIN, amendments = 0, seed = 0):
+        '''
+        @param notice_count number of notices on fbo.gov
+        @param announcement_count number of darpa.mil announcements (titled with the solicitation numbers
+        of the first notices), defaults to a tenth of the notices
+        @param latency mean response delay in seconds (each response takes 0.5 - 1.5 times that)
+        @param error_rate share of requests answered with 503 Service Unavailable
+        '''
+        resource.Resource.__init__(self)
+        self.notice_count = notice_count
+        self.announcement_count = announcement_count if announcement_count is not None else max(1, notice_count // 10)
+        self.latency = latency
+        self.error_rate = error_rate
+        self.page_options = (paragraphs, formatting, amendments)
+        self.rng = random.Random(seed)
+        # notice id (as in the notice urls) ==> notice index
+        self.notice_index_by_id = dict((synthetic.make_notice_id(index), index) for index in xrange(notice_count))
+        # page kind ==> number of requests / errors served
+        self.request_counts = {}
+        self.error_counts = {}
+
+    def _argument(self, request, name, default = None):
+        values = request.args.get(name)
+        return values[0] if values else default
+
+    def page(self, request):
+        '''
+        @return (page kind, html) for the request, (None, None) if there is no such page
+        '''
+        if request.path == "/work-with-us/opportunities":
+            return DARPA_LIST, synthetic.make_darpa_list_page(int(self._argument(request, "PP", "0")),
+                                                              self.announcement_count)
+        if request.path != "/index":
+            return None, None
+        mode = self._argument(request, "mode")
+        if mode == "list":
+            return FBO_LIST, synthetic.make_fbo_list_page(int(self._argument(request, "pageID", "1")),
+                                                          self.notice_count)
+        if mode == "form":
+            index = self.notice_index_by_id.get(self._argument(request, "id"))
+            if index is None:
+                return None, None
+            paragraphs, formatting, amendments = self.page_options
+            return FBO_NOTICE, synthetic.make_notice_page(index, paragraphs, formatting, amendments)[1]
+        return None, None
+
+    def render(self, request):
+        kind, body = self.page(request)
+        if kind is None:
+            request.setResponseCode(404)
+            return "Not Found"
+        self.request_counts[kind] = self.request_counts.get(kind, 0) + 1
+        if self.rng.random() < self.error_rate:
+            self.error_counts[kind] = self.error_counts.get(kind, 0) + 1
+            request.setResponseCode(503)
+            return "Service Unavailable"
+        request.setHeader("Content-Type", "text/html; charset=utf-8")
+        if self.latency <= 0:
+            return body
+        delayed_call = reactor.callLater(self.latency * self.rng.uniform(0.5, 1.5), self._finish, request, body)
+        # the client may give up (e.g. download timeout) before the response is ready
+        request.notifyFinish().addErrback(lambda _: delayed_call.cancel() if delayed_call.active() else None)
+        return server.NOT_DONE_YET
+
+    @staticmethod
+    def _finish(request, body):
+        request.write(body)
+        request.finish()
+
+
+class MockSitesDownloadHandler(object):
+    '''
+    Download handler sending all http(s) requests to the mock server (FBO_MOCK_SITES_ADDRESS), as plain
+    http, with the responses keeping the original urls, so that the spider sees www.fbo.gov & www.darpa.mil
+    '''
+    lazy = False
+
+    def __init__(self, settings):
+        self.address = settings.get("FBO_MOCK_SITES_ADDRESS")
+        self.handler = HTTP11DownloadHandler(settings)
+
+    def download_request(self, request, spider):
+        local_url = urlunparse(("http", self.address) + urlparse(request.url)[2:])
+        return self.handler.download_request(request.replace(url = local_url), spider).addCallback(
+            lambda response: response.replace(url = request.url, request = request))
+
+    def close(self):
+        return self.handler.close()
+
+
+class LosingDarpaPagesMiddleware(object):
+    '''
+    Spider middleware dropping the first FBO_MOCK_LOSE_DARPA_PAGES darpa.mil listing page requests
+    made from the spider's callbacks, so that they get neither a callback nor an errback (as with
+    requests discarded by the duplicate filter)
+    '''
+    def __init__(self, settings):
+        self.remaining = settings.getint("FBO_MOCK_LOSE_DARPA_PAGES", 0)
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        return cls(crawler.settings)
+
+    def process_spider_output(self, response, result, spider):
+        for output in result:
+            if self.remaining > 0 and isinstance(output, Request) and "/work-with-us/opportunities" in output.url:
+                self.remaining -= 1
+                continue
+            yield output
+
+
+def listen(sites, port = 0, interface = "127.0.0.1"):
+    '''
+    @return the listening port, see its getHost().port for the port number
+    '''
+    return reactor.listenTCP(port, server.Site(sites), interface = interface)
+
+
+def main():
+    parser = argparse.ArgumentParser(description = "Serve synthetic fbo.gov & darpa.mil pages locally.")
+    parser.add_argument("--port", type = int, default = 8080)
+    parser.add_argument("--notices", type = int, default = 10000, help = "number of notices on fbo.gov")
+    parser.add_argument("--announcements", type = int, default = None,
+                        help = "number of darpa.mil announcements (defaults to a tenth of the notices)")
+    parser.add_argument("--latency", type = float, default = 0.05, help = "mean response delay in seconds")
+    parser.add_argument("--error_rate", type = float, default = 0.0, help = "share of requests answered with 503")
+    args = parser.parse_args()
+    listening_port = listen(MockSites(args.notices, args.announcements, args.latency, args.error_rate), args.port)
+    print "Serving synthetic pages on http://127.0.0.1:" + str(listening_port.getHost().port)
+    reactor.run()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
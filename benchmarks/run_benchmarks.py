@@ -0,0 +1,276 @@
+################################################################################
+#    @author: Greg Kramida (github id: Algomorph)
+# @copyright: (2015-2016) Gregory Kramida
+#   @license: Apache V2
+#            [That means (basically): feel free to modify, sell,
+#             whatever, just do not remove the original author's credits/notice
+#             from the files. For details, see LICENSE file.]
+################################################################################
+'''
+Benchmarks for FboDarpaSpider.parse_fbo_solicitation, for the database helpers
+(add_item, contains, save_all, generate_report) and for selecting the open notices of
+a dataframe with plain object columns vs. the typed columns of fbo_scraper/db/schema.py
+(also reporting the memory taken by the dataframe), run on synthetic pages & notices.
+Every case runs in a separate process, so that its peak memory can be measured.
+
+Run from root directory (top-level fbo_scraper folder) like this:
+    python -m benchmarks.run_benchmarks --sizes 1000,10000 --save <baseline name>
+    python -m benchmarks.run_benchmarks --sizes 1000,10000 --compare <baseline name>
+'''
+import os
+import sys
+import json
+import time
+import shutil
+import tempfile
+import argparse
+import platform
+import multiprocessing
+from datetime import datetime
+
+try:
+    import resource
+except ImportError:
+    # not available on Windows, peak memory is not reported there
+    resource = None
+
+import pandas as pd
+from scrapy.http import HtmlResponse
+
+from fbo_scraper.spiders.fbo_darpa_spider import FboDarpaSpider
+from fbo_scraper.db.pdexcel import PandasExcelHelper
+from fbo_scraper.db.sqlitedb import SqliteHelper
+from fbo_scraper.replay import NothingStored
+from fbo_scraper.db import schema
+from benchmarks import synthetic
+
+baseline_directory = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baselines")
+
+# synopsis variants for the parsing benchmark: (paragraphs, formatting, amendments)
+page_corpora = {
+    "short": (3, synthetic.PLAIN, 0),
+    "long": (60, synthetic.SPANS, 4),
+    "crazy": (20, synthetic.CRAZY, 8)
+}
+deadline_kinds = ["date", "date", "date", "continuous", "original", "archive"]
+
+db_operations = ["add_item", "contains", "save_all", "generate_report"]
+# dataframe layouts for the filtering benchmark
+frame_layouts = ["object", "typed"]
+# times the open notices are selected in the filtering benchmark
+filter_repeats = 10
+
+
+def peak_memory_mb():
+    if resource is None:
+        return None
+    # ru_maxrss is in kilobytes on Linux, bytes on OS X
+    scale = 1024.0 * 1024.0 if sys.platform == "darwin" else 1024.0
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / scale
+
+
+class Timer(object):
+    '''
+    Times the enclosed block, silencing the (very chatty) spider & database output
+    '''
+    def __enter__(self):
+        self.stdout = sys.stdout
+        sys.stdout = open(os.devnull, "w")
+        self.start = time.time()
+        return self
+
+    def __exit__(self, *args):
+        self.seconds = time.time() - self.start
+        sys.stdout.close()
+        sys.stdout = self.stdout
+
+
+def make_db(backend, directory):
+    if backend == "sqlite":
+        return SqliteHelper(db_filename = os.path.join(directory, "bench.sqlite"),
+                            excel_filename = os.path.join(directory, "bench.xlsx"),
+                            report_prefix = os.path.join(directory, "report"))
+    return PandasExcelHelper(db_filename = os.path.join(directory, "bench.xlsx"),
+                             report_prefix = os.path.join(directory, "report"))
+
+
+def bench_parse(corpus, count):
+    paragraphs, formatting, amendments = page_corpora[corpus]
+    responses = []
+    for index in xrange(count):
+        notice_id, html = synthetic.make_notice_page(index, paragraphs, formatting, amendments,
+                                                     deadline_kinds[index % len(deadline_kinds)])
+        responses.append(HtmlResponse(url = synthetic.make_notice_url(notice_id), body = html))
+    spider = FboDarpaSpider(dont_skip_continuous = "true")
+    spider.db = NothingStored()
+    with Timer() as timer:
+        items = sum(1 for response in responses for _ in spider.parse_fbo_solicitation(response) or [])
+    if items != count:
+        raise RuntimeError("Parsed " + str(items) + " notices out of " + str(count) + " synthetic pages")
+    return count, timer.seconds
+
+
+def bench_db(backend, operation, size):
+    directory = tempfile.mkdtemp()
+    try:
+        db = make_db(backend, directory)
+        items = list(synthetic.make_notice_items(size))
+        with Timer() as timer:
+            for item in items:
+                db.add_item(item)
+        if operation == "add_item":
+            return size, timer.seconds
+        if operation == "contains":
+            # half hits, half misses
+            keys = ([synthetic.make_sponsor_number(index) for index in xrange(0, size, 2)]
+                    + [synthetic.make_sponsor_number(index) for index in xrange(size, size + size / 2)])
+            with Timer() as timer:
+                for key in keys:
+                    db.contains(key)
+            return len(keys), timer.seconds
+        if operation == "save_all":
+            with Timer() as timer:
+                db.save_all()
+                # the sqlite helper only commits in save_all, the workbook is written on export
+                if backend == "sqlite":
+                    db.export_excel()
+            return size, timer.seconds
+        with Timer() as timer:
+            db.generate_report()
+        return size, timer.seconds
+    finally:
+        shutil.rmtree(directory, ignore_errors = True)
+
+
+def bench_filter(layout, size):
+    '''
+    Select the notices for the report (open, not awards), as generate_report does
+    @return (number of rows filtered, seconds, {"frame_mb": memory taken by the dataframe})
+    '''
+    df = pd.DataFrame(list(synthetic.make_notice_items(size))).set_index("sponsor_number")
+    del df["filtered"]
+    if layout == "typed":
+        df = schema.apply_schema(df)
+    today = datetime.today()
+    with Timer() as timer:
+        for _ in xrange(filter_repeats):
+            if layout == "typed":
+                deadlines = df[schema.deadline_column]
+            else:
+                deadlines = pd.to_datetime(df["deadline_date"], format = "%m/%d/%Y", errors = "coerce")
+            in_report = ((deadlines >= today) & (df["announcement_type"] != "Award")).values
+            df[in_report]
+    return size * filter_repeats, timer.seconds, {"frame_mb": schema.memory_usage_mb(df)}
+
+
+def _run_case(function_name, args):
+    outcome = globals()[function_name](*args)
+    items, seconds = outcome[:2]
+    result = {"items": items, "seconds": seconds,
+              "items_per_second": items / seconds if seconds > 0 else None,
+              "peak_memory_mb": peak_memory_mb()}
+    if len(outcome) > 2:
+        result.update(outcome[2])
+    return result
+
+
+def run_case(function_name, *args):
+    '''
+    Run a single benchmark case in a fresh process
+    '''
+    pool = multiprocessing.Pool(1, maxtasksperchild = 1)
+    try:
+        return pool.apply(_run_case, (function_name, args))
+    finally:
+        pool.close()
+        pool.join()
+
+
+def run_all(sizes, pages, backends):
+    results = {}
+    for corpus in sorted(page_corpora):
+        name = "parse_fbo_solicitation[" + corpus + "]"
+        print "Running " + name + "..."
+        results[name] = run_case("bench_parse", corpus, pages)
+    for backend in backends:
+        for size in sizes:
+            for operation in db_operations:
+                name = operation + "[" + backend + "," + str(size) + "]"
+                print "Running " + name + "..."
+                results[name] = run_case("bench_db", backend, operation, size)
+    for size in sizes:
+        for layout in frame_layouts:
+            name = "filter_open_notices[" + layout + "," + str(size) + "]"
+            print "Running " + name + "..."
+            results[name] = run_case("bench_filter", layout, size)
+    return results
+
+
+def compare(results, baseline, tolerance):
+    '''
+    @return list of regression descriptions (slower or more memory than baseline beyond tolerance)
+    '''
+    regressions = []
+    for name in sorted(results):
+        if name not in baseline:
+            continue
+        current, previous = results[name], baseline[name]
+        if (current["items_per_second"] and previous["items_per_second"]
+                and current["items_per_second"] < previous["items_per_second"] * (1.0 - tolerance)):
+            regressions.append(name + ": %.1f items/s (baseline %.1f)"
+                               % (current["items_per_second"], previous["items_per_second"]))
+        if (current["peak_memory_mb"] and previous["peak_memory_mb"]
+                and current["peak_memory_mb"] > previous["peak_memory_mb"] * (1.0 + tolerance)):
+            regressions.append(name + ": %.1f MB peak memory (baseline %.1f)"
+                               % (current["peak_memory_mb"], previous["peak_memory_mb"]))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description = "Benchmark notice parsing & the database helpers.")
+    parser.add_argument("--sizes", default = "1000,10000,100000",
+                        help = "comma-separated numbers of notices in the synthetic databases")
+    parser.add_argument("--pages", type = int, default = 1000,
+                        help = "number of synthetic pages per parsing corpus")
+    parser.add_argument("--backends", default = "sqlite,excel", help = "comma-separated database backends")
+    parser.add_argument("--output", default = None, help = "write the results as json to this file")
+    parser.add_argument("--save", default = None, metavar = "NAME", help = "save the results as baseline NAME")
+    parser.add_argument("--compare", default = None, metavar = "NAME", help = "compare against baseline NAME")
+    parser.add_argument("--tolerance", type = float, default = 0.2,
+                        help = "relative slowdown / memory growth tolerated when comparing")
+    args = parser.parse_args()
+
+    results = run_all([int(size) for size in args.sizes.split(",")], args.pages, args.backends.split(","))
+    document = {"created": str(datetime.now())[:19], "python": platform.python_version(),
+                "platform": platform.platform(), "results": results}
+
+    print "\n%-45s %12s %12s %12s" % ("benchmark", "items", "items/s", "peak MB")
+    for name in sorted(results):
+        result = results[name]
+        print "%-45s %12d %12.1f %12s" % (name, result["items"], result["items_per_second"] or 0.0,
+                                          "%.1f" % result["peak_memory_mb"] if result["peak_memory_mb"] else "n/a")
+    for name in sorted(results):
+        if "frame_mb" in results[name]:
+            print "%-45s %12.1f MB dataframe" % (name, results[name]["frame_mb"])
+
+    if args.output:
+        with open(args.output, "w") as output_file:
+            json.dump(document, output_file, indent = 2, sort_keys = True)
+    if args.save:
+        if not os.path.isdir(baseline_directory):
+            os.makedirs(baseline_directory)
+        with open(os.path.join(baseline_directory, args.save + ".json"), "w") as baseline_file:
+            json.dump(document, baseline_file, indent = 2, sort_keys = True)
+    if args.compare:
+        with open(os.path.join(baseline_directory, args.compare + ".json")) as baseline_file:
+            baseline = json.load(baseline_file)["results"]
+        regressions = compare(results, baseline, args.tolerance)
+        if regressions:
+            print "\n========  REGRESSIONS against baseline " + args.compare + "  ========"
+            for regression in regressions:
+                print regression
+            sys.exit(1)
+        print "\n========  No regressions against baseline " + args.compare + "  ========"
+
+if __name__ == "__main__":
+    main()
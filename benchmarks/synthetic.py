@@ -0,0 +1,208 @@
+################################################################################
+#    @author: Greg Kramida (github id: Algomorph)
+# @copyright: (2015-2016) Gregory Kramida
+#   @license: Apache V2
+#            [That means (basically): feel free to modify, sell,
+#             whatever, just do not remove the original author's credits/notice
+#             from the files. For details, see LICENSE file.]
+################################################################################
+'''
+Generators of synthetic fbo.gov notice & list pages, darpa.mil listing pages and of
+synthetic notices (as stored in the database), mimicking the markup & contents the spider expects.
+'''
+import random
+import hashlib
+from datetime import date, timedelta
+
+from fbo_scraper.spiders.fbo_darpa_spider import FboDarpaSpider
+
+vocabulary = ("research development proposal program office technology system systems "
+              "innovative approaches solicitation performance phase cyber autonomy sensor "
+              "network biological materials quantum microsystems tactical strategic data "
+              "analysis evaluation demonstration prototype capability agency award contract "
+              "abstract submission deadline proposers teams objectives metrics").split()
+
+announcement_types = ["Combined Synopsis/Solicitation", "Presolicitation", "Special Notice",
+                      "Award", "Modification/Amendment", "Sources Sought"]
+
+month_abbreviations = ["Jan", "Feb", "Mar", "Apr", "May", "Jun",
+                       "Jul", "Aug", "Sep", "Oct", "Nov", "Dec"]
+
+# synopsis formatting variants, see make_description_widget
+PLAIN = "plain"
+SPANS = "spans"
+CRAZY = "crazy"
+
+
+def random_sentence(rng, min_words = 6, max_words = 24):
+    words = [rng.choice(vocabulary) for _ in xrange(rng.randint(min_words, max_words))]
+    return words[0].capitalize() + " " + " ".join(words[1:]) + "."
+
+
+def make_sponsor_number(index):
+    return "DARPA-BAA-%02d-%05d" % (10 + index % 10, index)
+
+
+def make_notice_title(index):
+    rng = random.Random("title" + str(index))
+    return " ".join(rng.choice(vocabulary).capitalize() for _ in xrange(rng.randint(2, 7)))
+
+
+def make_notice_id(index):
+    return hashlib.md5("notice" + str(index)).hexdigest()
+
+
+def make_notice_url(notice_id):
+    return (FboDarpaSpider.fbo_index_url + "?s=opportunity&mode=form&id=" + notice_id
+            + "&tab=core&_cview=1")
+
+
+def format_fbo_date(day):
+    return month_abbreviations[day.month - 1] + " " + "%02d" % day.day + ", " + str(day.year)
+
+
+def make_description_widget(rng, paragraphs, formatting, amendments):
+    '''
+    Markup of the description widget, with the given number of paragraphs and "Added:" entries.
+    The CRAZY formatting splits every paragraph into many spans, so that the spider
+    sees more than a hundred text fragments.
+    '''
+    parts = ['<div id="dnf_class_values_procurement_notice__description__widget">']
+    for ix_amendment in xrange(amendments):
+        added = date(2015, 1, 1) + timedelta(days = 7 * ix_amendment)
+        parts.append('<div><span class="added">Added: ' + format_fbo_date(added)
+                     + ' %d:%02d pm</span></div>' % (rng.randint(1, 12), rng.randint(0, 59)))
+    for _ in xrange(paragraphs):
+        sentence = random_sentence(rng)
+        if formatting == PLAIN:
+            parts.append("<p>" + sentence + " &amp; " + random_sentence(rng) + "</p>")
+        elif formatting == SPANS:
+            parts.append("<p><span>" + sentence + "</span><span><span>"
+                         + random_sentence(rng) + "</span></span></p>")
+        else:
+            parts.append("<p>" + "".join("<span>" + word + " </span>" for word in sentence.split()) + "</p>")
+    parts.append("</div>")
+    return "".join(parts)
+
+
+def make_notice_page(index, paragraphs = 5, formatting = PLAIN, amendments = 0,
+                     deadline = "date", seed = None):
+    '''
+    Generate the html of a single fbo.gov notice ("Complete View") page
+    @param deadline one of "date" (proper deadline), "continuous" ("-" for deadline),
+    "original" (unparseable deadline, proper original deadline) or "archive" (archived notice)
+    @return (notice id, html) tuple
+    '''
+    rng = random.Random(index if seed is None else seed)
+    deadline_day = date(2015, 6, 1) + timedelta(days = rng.randint(0, 700))
+    title = make_notice_title(index if seed is None else seed)
+    if rng.random() < 0.05:
+        title += " Office-Wide"
+    parts = ['<html><head><title>' + title + '</title></head><body>',
+             '<div class="agency-header-w"><div><h2>' + title + '</h2></div></div>',
+             '<div id="dnf_class_values_procurement_notice__solicitation_number__widget">'
+             + make_sponsor_number(index) + '</div>',
+             '<div id="dnf_class_values_procurement_notice__procurement_type__widget">'
+             + rng.choice(announcement_types) + '</div>']
+    if deadline == "archive":
+        parts.append('<div id="so_formfield_dnf_class_values_procurement_notice_archive__response_deadline_">'
+                     + '<div>Response Date:</div><div>' + format_fbo_date(deadline_day)
+                     + ' 12:00 pm Eastern</div></div>')
+    elif deadline == "continuous":
+        parts.append('<div id="dnf_class_values_procurement_notice__response_deadline__widget">-</div>')
+    elif deadline == "original":
+        parts.append('<div id="dnf_class_values_procurement_notice__response_deadline__widget">'
+                     + 'See synopsis</div>')
+        parts.append('<div id="dnf_class_values_procurement_notice__original_response_deadline__widget">'
+                     + format_fbo_date(deadline_day) + ' 4:00 pm Eastern</div>')
+    else:
+        parts.append('<div id="dnf_class_values_procurement_notice__response_deadline__widget">'
+                     + format_fbo_date(deadline_day) + ' 12:00 pm Eastern</div>')
+    parts.append(make_description_widget(rng, paragraphs, formatting, amendments))
+    parts.append('</body></html>')
+    return make_notice_id(index), "\n".join(parts)
+
+
+def make_fbo_list_page(page_id, notice_count, per_page = FboDarpaSpider.opportunities_per_page):
+    '''
+    Generate the html of an fbo.gov list page (1-based page id) out of notice_count notices in total,
+    the notice indices on each page being consecutive
+    '''
+    start = (page_id - 1) * per_page
+    end = min(start + per_page, notice_count)
+    parts = ['<html><body><div class="lst-rt">',
+             '<span class="lst-cnt">%d - %d of %d</span>' % (start + 1, end, notice_count),
+             '</div><table class="list">']
+    for index in xrange(start, end):
+        rng = random.Random(index)
+        posted_day = date(2015, 6, 1) - timedelta(days = index // 20)
+        parts.append('<tr id="row_%d" class="lst-rw"><td class="lst-cl lst-cl-first" headers="lh_id">' % (index - start)
+                     + '<a href="?s=opportunity&mode=form&id=' + make_notice_id(index) + '&tab=core&_cview=0" '
+                     + 'class="lst-lnk-notice"><div class="solt">' + make_notice_title(index) + ' </div>'
+                     + '<div class="soln">' + make_sponsor_number(index) + ' </div>'
+                     + '<div class="solcc">A -- Research &amp; Development </div></a></td>'
+                     + '<td class="lst-cl" headers="lh_base_type">' + rng.choice(announcement_types) + '</td>'
+                     + '<td class="lst-cl lst-cl-last" headers="lh_current_posted_date">'
+                     + format_fbo_date(posted_day) + '</td></tr>')
+    parts.append('</table></body></html>')
+    return "\n".join(parts)
+
+
+def make_darpa_announcement(index):
+    '''
+    @return (title, office acronym) of a darpa.mil announcement, titled with the solicitation number 
+    of the synthetic notice with the same index (as many real ones are)
+    '''
+    rng = random.Random("announcement" + str(index))
+    return make_sponsor_number(index), rng.choice(sorted(FboDarpaSpider.darpa_office_by_acronym))
+
+
+def make_darpa_list_page(page_num, announcement_count, per_page = 10):
+    '''
+    Generate the html of a darpa.mil announcement listing page (0-based page number)
+    '''
+    page_count = max(1, (announcement_count + per_page - 1) // per_page)
+    parts = ['<html><body><div class="listing">']
+    for index in xrange(page_num * per_page, min((page_num + 1) * per_page, announcement_count)):
+        title, acronym = make_darpa_announcement(index)
+        parts.append('<div class="listing__item"><h2 class="listing__link"><a href="#">' + title + '</a></h2>'
+                     + '<div class="listing__office">' + acronym + '</div></div>')
+    parts.append('</div><div class="pager"><ul>')
+    for other_page_num in xrange(page_count):
+        parts.append('<li><a href="/work-with-us/opportunities?ppl=viewall&PP=%d">%d</a></li>'
+                     % (other_page_num, other_page_num + 1))
+    parts.append('</ul></div></body></html>')
+    return "\n".join(parts)
+
+
+def make_notice_item(index, seed = None):
+    '''
+    Generate a single notice as it would be yielded by the spider
+    @return dictionary with all Opportunity fields
+    '''
+    rng = random.Random(index if seed is None else seed)
+    # about half of the notices are still open
+    deadline_day = date.today() + timedelta(days = rng.randint(-730, 730))
+    bad_date = rng.random() < 0.05
+    return {
+        "opportunity_title": " ".join(rng.choice(vocabulary).capitalize() for _ in xrange(rng.randint(2, 7))),
+        "sponsor_number": make_sponsor_number(index),
+        "announcement_type": rng.choice(announcement_types),
+        "synopsis": u" ".join(random_sentence(rng) for _ in xrange(rng.randint(3, 30))),
+        "program_url": make_notice_url(make_notice_id(index)),
+        "office": rng.choice(FboDarpaSpider.darpa_office_by_acronym.values() + [""]),
+        "deadline_date": "-" if bad_date else deadline_day.strftime("%m/%d/%Y"),
+        "check_date": bad_date,
+        "check_office": rng.random() < 0.2,
+        "check_office_wide": rng.random() < 0.05,
+        # continuous-submission notices are filtered by default
+        "filtered": bad_date or rng.random() < 0.05
+    }
+
+
+def make_notice_items(count, start = 0):
+    '''
+    @return generator of count synthetic notices
+    '''
+    for index in xrange(start, start + count):
+        yield make_notice_item(index)
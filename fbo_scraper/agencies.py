@@ -0,0 +1,66 @@
+################################################################################
+#    @author: Greg Kramida (github id: Algomorph)
+# @copyright: (2015-2016) Gregory Kramida
+#   @license: Apache V2
+#            [That means (basically): feel free to modify, sell,
+#             whatever, just do not remove the original author's credits/notice
+#             from the files. For details, see LICENSE file.]
+################################################################################
+'''
+Agencies the spider knows how to crawl on fbo.gov, and where the offices of their
+notices come from.
+'''
+
+# office-resolution sources
+DARPA_WEBSITE = "darpa.mil"
+
+
+class Agency(object):
+    '''
+    A single agency on fbo.gov
+    @param name short name, as passed to the spider (-a agencies=<name>,<name>,...)
+    @param agency_id see value attribute of <input id="dnf_class_values_procurement_notice__agency_" ...>
+    after you type & choose the name of the desired agency on the fbo.gov front page.
+    @param autocomplete_name see value attribute of
+    <input id="autocomplete_input_dnf_class_values_procurement_notice__agency_" ...>
+    after you type & choose the name of the desired agency on the fbo.gov front page.
+    It may be nonessential, I (Algomorph) have not checked.
+    @param office_source where to get the office of each notice from (e.g. DARPA_WEBSITE),
+    None if there is no such source: the office is then left blank & marked for checking
+    '''
+    def __init__(self, name, agency_id, autocomplete_name, office_source = None):
+        self.name = name
+        self.agency_id = agency_id
+        self.autocomplete_name = autocomplete_name
+        self.office_source = office_source
+
+    def __repr__(self):
+        return "Agency(" + self.name + ")"
+
+
+AGENCIES = dict((agency.name, agency) for agency in [
+    Agency("darpa", "048f413b4c64abc6c0afbc36b09f099d",
+           "Other Defense Agencies/Defense Advanced Research Projects Agency", DARPA_WEBSITE),
+    # see notes.txt, the autocomplete name was not recorded
+    Agency("dca", "8e1ff864fde18b1eff005e41be152153", "")
+])
+
+
+def parse_agencies(names):
+    '''
+    @param names comma-separated short names of agencies, e.g. "darpa,dca"
+    @return list of Agency objects, in the given order, without duplicates
+    '''
+    agencies = []
+    for name in names.split(","):
+        name = name.strip().lower()
+        if name == "":
+            continue
+        if name not in AGENCIES:
+            raise ValueError("Unknown agency \"" + name + "\", expecting one of: "
+                             + ", ".join(sorted(AGENCIES)))
+        if AGENCIES[name] not in agencies:
+            agencies.append(AGENCIES[name])
+    if len(agencies) == 0:
+        raise ValueError("No agencies given, expecting one or more of: " + ", ".join(sorted(AGENCIES)))
+    return agencies
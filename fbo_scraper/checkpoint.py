@@ -0,0 +1,148 @@
+################################################################################
+#    @author: Greg Kramida (github id: Algomorph)
+# @copyright: (2015-2016) Gregory Kramida
+#   @license: Apache V2
+#            [That means (basically): feel free to modify, sell,
+#             whatever, just do not remove the original author's credits/notice
+#             from the files. For details, see LICENSE file.]
+################################################################################
+'''
+On-disk checkpoint of the crawl frontier, so that a crawl that died partway can be
+resumed without repeating the darpa.mil listing & the fbo.gov list pages.
+'''
+import os
+import gzip
+import json
+import time
+
+
+class CrawlCheckpoint(object):
+    '''
+    Crawl frontier, saved as gzipped json: the darpa.mil office map, the fbo.gov list pages
+    done (per agency), the notice urls requested but not yet parsed & the urls that failed.
+    The file is replaced atomically, at most every save_interval seconds & when closing.
+    '''
+    save_interval = 30.0
+
+    def __init__(self, filename, parameters):
+        '''
+        @param filename path to the checkpoint file
+        @param parameters dictionary with the crawl parameters (agencies, date range, ...),
+        a checkpoint is only resumed from if these match
+        '''
+        self.filename = filename
+        self.parameters = parameters
+        # announcement ==> office as scraped from darpa.mil, None until the listing is done
+        self.darpa_offices = None
+        # agency name ==> number of fbo.gov list pages
+        self.list_page_numbers = {}
+        # agency name ==> set of list page ids (1-based) that were processed
+        self.list_pages_done = {}
+        # agencies for which the incremental walk through the list pages stopped
+        self.list_stopped = set()
+        # notice url ==> agency name
+        self.pending_notices = {}
+        # notice url ==> agency name
+        self.failed_notices = {}
+        self.last_save_time = time.time()
+
+    def load(self):
+        '''
+        Load the checkpoint file, if there is one for the same crawl parameters
+        @return True if the checkpoint was loaded, False otherwise
+        '''
+        if not os.path.isfile(self.filename):
+            return False
+        try:
+            with gzip.open(self.filename, "rb") as checkpoint_file:
+                state = json.load(checkpoint_file)
+        except (IOError, ValueError) as error:
+            print "===> Could not read checkpoint " + self.filename + ": " + repr(error)
+            return False
+        if state["parameters"] != self.parameters:
+            print "===> Checkpoint " + self.filename + " is for a different crawl, ignoring it."
+            return False
+        self.darpa_offices = state["darpa_offices"]
+        self.list_page_numbers = state["list_page_numbers"]
+        self.list_pages_done = dict((agency_name, set(page_ids))
+                                    for agency_name, page_ids in state["list_pages_done"].items())
+        self.list_stopped = set(state["list_stopped"])
+        self.pending_notices = state["pending_notices"]
+        self.failed_notices = state["failed_notices"]
+        return True
+
+    def save(self):
+        '''
+        Write the checkpoint file (via a temporary file, so that a crash never leaves a partial one)
+        '''
+        state = {
+            "parameters": self.parameters,
+            "darpa_offices": self.darpa_offices,
+            "list_page_numbers": self.list_page_numbers,
+            "list_pages_done": dict((agency_name, sorted(page_ids))
+                                    for agency_name, page_ids in self.list_pages_done.items()),
+            "list_stopped": sorted(self.list_stopped),
+            "pending_notices": self.pending_notices,
+            "failed_notices": self.failed_notices
+        }
+        temp_filename = self.filename + ".tmp"
+        with gzip.open(temp_filename, "wb") as checkpoint_file:
+            json.dump(state, checkpoint_file)
+        if os.name == "nt" and os.path.exists(self.filename):
+            # rename does not replace existing files on Windows
+            os.remove(self.filename)
+        os.rename(temp_filename, self.filename)
+        self.last_save_time = time.time()
+
+    def changed(self):
+        if time.time() - self.last_save_time > CrawlCheckpoint.save_interval:
+            self.save()
+
+    def remove(self):
+        if os.path.exists(self.filename):
+            os.remove(self.filename)
+
+    def set_darpa_offices(self, darpa_offices):
+        self.darpa_offices = dict(darpa_offices)
+        self.changed()
+
+    def set_list_page_number(self, agency_name, list_page_number):
+        self.list_page_numbers[agency_name] = list_page_number
+        self.list_pages_done.setdefault(agency_name, set())
+        self.changed()
+
+    def list_page_done(self, agency_name, page_id, notice_urls):
+        '''
+        Mark the list page as processed & the notice urls requested from it as pending
+        '''
+        for url in notice_urls:
+            self.pending_notices[url] = agency_name
+        self.list_pages_done.setdefault(agency_name, set()).add(page_id)
+        self.changed()
+
+    def list_stop(self, agency_name):
+        self.list_stopped.add(agency_name)
+        self.changed()
+
+    def remaining_list_pages(self, agency_name, incremental):
+        '''
+        @return ids of the list pages of the agency that still have to be processed
+        '''
+        done = self.list_pages_done.get(agency_name, set())
+        if incremental:
+            # one page at a time, continue after the last one done
+            next_page_id = max(done) + 1 if len(done) > 0 else 1
+            if agency_name in self.list_stopped or next_page_id > self.list_page_numbers[agency_name]:
+                return []
+            return [next_page_id]
+        return [page_id for page_id in xrange(1, self.list_page_numbers[agency_name] + 1) if page_id not in done]
+
+    def notice_done(self, url):
+        self.pending_notices.pop(url, None)
+        self.failed_notices.pop(url, None)
+        self.changed()
+
+    def notice_failed(self, url, agency_name):
+        self.pending_notices.pop(url, None)
+        self.failed_notices[url] = agency_name
+        self.changed()
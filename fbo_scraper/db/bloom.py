@@ -0,0 +1,186 @@
+################################################################################
+#    @author: Greg Kramida (github id: Algomorph)
+# @copyright: (2015-2016) Gregory Kramida
+#   @license: Apache V2
+#            [That means (basically): feel free to modify, sell,
+#             whatever, just do not remove the original author's credits/notice
+#             from the files. For details, see LICENSE file.]
+################################################################################
+'''
+Compact membership checks against the sponsor numbers of archived solicitation
+databases: a bloom filter (<prefix>.bloom) answers most lookups from memory, and
+only possible hits are confirmed in an on-disk table of the keys (<prefix>.keys.sqlite).
+
+Build from archived workbooks / databases like this:
+    python -m fbo_scraper.db.bloom --output fbo_archive fbo_solicitations_backup.xlsx <more archives...>
+and set FBO_ARCHIVE_INDEX = "fbo_archive" in settings.py.
+'''
+import os
+import sys
+import math
+import struct
+import sqlite3
+import hashlib
+import argparse
+
+import pandas as pd
+
+from fbo_scraper.db.index import normalize_key
+from fbo_scraper.metrics import metrics
+
+
+class BloomFilter(object):
+    '''
+    Bloom filter over normalized sponsor numbers, with double hashing of the md5 digest
+    '''
+    magic = b"FBOBLOOM"
+    header_format = "<8sIQII"
+    version = 1
+
+    def __init__(self, bit_count, hash_count, bits = None, key_count = 0):
+        self.bit_count = bit_count
+        self.hash_count = hash_count
+        self.bits = bits if bits is not None else bytearray((bit_count + 7) // 8)
+        self.key_count = key_count
+
+    @classmethod
+    def for_capacity(cls, capacity, error_rate = 0.001):
+        '''
+        @return empty filter sized for the given number of keys & false positive rate
+        '''
+        capacity = max(capacity, 1)
+        bit_count = int(math.ceil(-capacity * math.log(error_rate) / (math.log(2) ** 2)))
+        hash_count = max(1, int(round(float(bit_count) / capacity * math.log(2))))
+        return cls(bit_count, hash_count)
+
+    def _positions(self, key):
+        digest = hashlib.md5(normalize_key(key).encode("utf8")).digest()
+        first, second = struct.unpack("<QQ", digest)
+        return [(first + ix_hash * second) % self.bit_count for ix_hash in xrange(self.hash_count)]
+
+    def add(self, key):
+        for position in self._positions(key):
+            self.bits[position >> 3] |= 1 << (position & 7)
+        self.key_count += 1
+
+    def __contains__(self, key):
+        bits = self.bits
+        for position in self._positions(key):
+            if not bits[position >> 3] & (1 << (position & 7)):
+                return False
+        return True
+
+    def save(self, filename):
+        with open(filename, "wb") as bloom_file:
+            bloom_file.write(struct.pack(self.header_format, self.magic, self.version,
+                                         self.bit_count, self.hash_count, self.key_count))
+            bloom_file.write(bytes(self.bits))
+
+    @classmethod
+    def load(cls, filename):
+        with open(filename, "rb") as bloom_file:
+            header = bloom_file.read(struct.calcsize(cls.header_format))
+            magic, version, bit_count, hash_count, key_count = struct.unpack(cls.header_format, header)
+            if magic != cls.magic or version != cls.version:
+                raise ValueError(filename + " is not a sponsor number bloom filter file")
+            bits = bytearray(bloom_file.read())
+        if len(bits) != (bit_count + 7) // 8:
+            raise ValueError(filename + " is truncated")
+        return cls(bit_count, hash_count, bits, key_count)
+
+
+class ArchiveIndex(object):
+    '''
+    Sponsor numbers of archived databases: bloom filter in memory, exact keys on disk
+    '''
+    table_name = "archive_keys"
+
+    def __init__(self, prefix):
+        '''
+        @param prefix path prefix of the <prefix>.bloom & <prefix>.keys.sqlite files (see build)
+        '''
+        self.bloom_filter = BloomFilter.load(prefix + ".bloom")
+        # only used for lookups, from whichever thread calls contains
+        self.connection = sqlite3.connect(prefix + ".keys.sqlite", check_same_thread = False)
+
+    def __len__(self):
+        return self.bloom_filter.key_count
+
+    def __contains__(self, key):
+        if key not in self.bloom_filter:
+            return False
+        found = self.connection.execute("SELECT 1 FROM " + self.table_name + " WHERE key = ?",
+                                        (normalize_key(key),)).fetchone() is not None
+        if not found:
+            metrics.increment("archive_bloom_false_positives")
+        return found
+
+    def close(self):
+        self.connection.close()
+
+
+def read_archive_keys(filename, index_column = "sponsor_number"):
+    '''
+    @return generator of the sponsor numbers in an archived workbook (all sheets),
+    sqlite database or feather mirror
+    '''
+    extension = os.path.splitext(filename)[1].lower()
+    if extension in (".xlsx", ".xls"):
+        for df in pd.read_excel(filename, sheet_name = None).values():
+            if index_column in df.columns:
+                for key in df[index_column].dropna():
+                    yield key
+    elif extension == ".feather":
+        for key in pd.read_feather(filename, columns = [index_column])[index_column].dropna():
+            yield key
+    elif extension in (".sqlite", ".db"):
+        connection = sqlite3.connect(filename)
+        for row in connection.execute("SELECT " + index_column + " FROM notices WHERE "
+                                      + index_column + " IS NOT NULL"):
+            yield row[0]
+        connection.close()
+    else:
+        raise ValueError("Archives can be .xlsx/.xls workbooks, .sqlite/.db databases or .feather files, got: "
+                         + filename)
+
+
+def build(prefix, archive_filenames, error_rate = 0.001):
+    '''
+    Build <prefix>.keys.sqlite & <prefix>.bloom from the sponsor numbers in the archives
+    @return number of distinct sponsor numbers
+    '''
+    keys_filename = prefix + ".keys.sqlite"
+    if os.path.exists(keys_filename):
+        os.remove(keys_filename)
+    connection = sqlite3.connect(keys_filename)
+    connection.execute("CREATE TABLE " + ArchiveIndex.table_name + " (key TEXT PRIMARY KEY)")
+    for filename in archive_filenames:
+        print "Reading " + filename + "..."
+        connection.executemany("INSERT OR IGNORE INTO " + ArchiveIndex.table_name + " VALUES (?)",
+                               ((normalize_key(key),) for key in read_archive_keys(filename)))
+    connection.commit()
+    key_count = connection.execute("SELECT COUNT(*) FROM " + ArchiveIndex.table_name).fetchone()[0]
+    bloom_filter = BloomFilter.for_capacity(key_count, error_rate)
+    for row in connection.execute("SELECT key FROM " + ArchiveIndex.table_name):
+        bloom_filter.add(row[0])
+    connection.close()
+    bloom_filter.save(prefix + ".bloom")
+    return key_count
+
+
+def main():
+    parser = argparse.ArgumentParser(description = "Build the bloom filter & key table of archived sponsor numbers.")
+    parser.add_argument("archives", nargs = "+",
+                        help = "archived .xlsx/.xls workbooks, .sqlite/.db databases or .feather files")
+    parser.add_argument("-o", "--output", default = "fbo_archive",
+                        help = "prefix of the output files (<prefix>.bloom, <prefix>.keys.sqlite)")
+    parser.add_argument("-e", "--error_rate", type = float, default = 0.001,
+                        help = "false positive rate of the bloom filter")
+    args = parser.parse_args()
+    key_count = build(args.output, args.archives, args.error_rate)
+    print ("Stored " + str(key_count) + " sponsor numbers, bloom filter: "
+           + str(os.path.getsize(args.output + ".bloom")) + " bytes")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
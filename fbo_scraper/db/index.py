@@ -0,0 +1,44 @@
+################################################################################
+#    @author: Greg Kramida (github id: Algomorph)
+# @copyright: (2015-2016) Gregory Kramida
+#   @license: Apache V2
+#            [That means (basically): feel free to modify, sell,
+#             whatever, just do not remove the original author's credits/notice
+#             from the files. For details, see LICENSE file.]
+################################################################################
+
+def normalize_key(key):
+    '''
+    Bring a sponsor (solicitation) number into the form used for dedup lookups. Only surrounding
+    whitespace is dropped: the stores (sqlite primary key, dataframe index) compare case-sensitively.
+    '''
+    if isinstance(key, str):
+        key = key.decode("utf-8", "replace")
+    elif not isinstance(key, unicode):
+        key = unicode(key)
+    return key.strip()
+
+
+class SponsorNumberIndex(object):
+    '''
+    An in-memory set of normalized sponsor numbers, used to check in constant time
+    whether a notice is already in the database (in any sheet / table)
+    '''
+
+    def __init__(self, keys = ()):
+        self.keys = set(normalize_key(key) for key in keys)
+
+    def __contains__(self, key):
+        return normalize_key(key) in self.keys
+
+    def __len__(self):
+        return len(self.keys)
+
+    def add(self, key):
+        self.keys.add(normalize_key(key))
+
+    def update(self, keys):
+        self.keys.update(normalize_key(key) for key in keys)
+
+    def discard(self, key):
+        self.keys.discard(normalize_key(key))
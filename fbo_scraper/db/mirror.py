@@ -0,0 +1,103 @@
+################################################################################
+#    @author: Greg Kramida (github id: Algomorph)
+# @copyright: (2015-2016) Gregory Kramida
+#   @license: Apache V2
+#            [That means (basically): feel free to modify, sell,
+#             whatever, just do not remove the original author's credits/notice
+#             from the files. For details, see LICENSE file.]
+################################################################################
+'''
+Columnar (Feather / Arrow) mirror of the solicitation workbook: one .feather file per
+sheet, next to the workbook, with the typed columns of fbo_scraper/db/schema.py (e.g. the
+datetime "deadline" in place of the "deadline_date" strings, boolean check flags).
+Requires pyarrow. The mirror files can be memory-mapped for analytics, e.g.:
+
+    import pyarrow, pyarrow.feather
+    table = pyarrow.feather.read_table(pyarrow.memory_map("fbo_solicitations.solicitations.feather"))
+'''
+import os
+
+import pandas as pd
+
+try:
+    import pyarrow
+except ImportError:
+    # no mirror, the workbook is read & written directly
+    pyarrow = None
+
+from fbo_scraper.db.schema import apply_schema, text_value, boolean_columns as check_columns
+
+
+def mirror_available():
+    return pyarrow is not None
+
+
+class FeatherMirror(object):
+    '''
+    Feather files mirroring the sheets of an excel workbook
+    '''
+    def __init__(self, excel_filename, sheet_names, index_column):
+        self.excel_filename = excel_filename
+        self.index_column = index_column
+        base = os.path.splitext(excel_filename)[0]
+        # sheet name ==> mirror file name
+        self.filenames = dict((sheet_name, base + "." + sheet_name + ".feather") for sheet_name in sheet_names)
+
+    def is_current(self):
+        '''
+        @return True if all mirror files exist & none is older than the workbook
+        '''
+        if not all(os.path.isfile(filename) for filename in self.filenames.values()):
+            return False
+        if not os.path.isfile(self.excel_filename):
+            return True
+        excel_time = os.path.getmtime(self.excel_filename)
+        return all(os.path.getmtime(filename) >= excel_time for filename in self.filenames.values())
+
+    def load(self, sheet_name):
+        '''
+        @return the sheet as a dataframe indexed by the index column, with the typed columns
+        (see fbo_scraper/db/schema.py)
+        '''
+        df = pd.read_feather(self.filenames[sheet_name])
+        # feather yields unicode column names, and only writes frames with names of one kind
+        df.columns = [str(column) for column in df.columns]
+        return df.set_index(self.index_column)
+
+    def _to_columnar(self, df):
+        '''
+        Convert the sheet into a frame with consistent column types
+        '''
+        if "deadline_date" in df.columns:
+            df = apply_schema(df)
+        df = df.reset_index()
+        # the workbook yields unicode column names, new frames have str ones
+        df.columns = [str(column) for column in df.columns]
+        for column in df.columns:
+            if column in check_columns:
+                df[column] = df[column].fillna(False).astype(bool)
+            elif df[column].dtype == object or column == self.index_column:
+                df[column] = [text_value(value) for value in df[column]]
+        return df
+
+    def save_all(self, frames_by_sheet):
+        '''
+        Write all sheets, replacing the files only once all of them were written
+        @param frames_by_sheet dictionary sheet name ==> dataframe
+        '''
+        temp_filenames = dict((sheet_name, self._save_temp(sheet_name, df))
+                              for sheet_name, df in frames_by_sheet.items())
+        for sheet_name, temp_filename in temp_filenames.items():
+            self._replace(temp_filename, self.filenames[sheet_name])
+
+    def _save_temp(self, sheet_name, df):
+        temp_filename = self.filenames[sheet_name] + ".tmp"
+        self._to_columnar(df).to_feather(temp_filename)
+        return temp_filename
+
+    @staticmethod
+    def _replace(temp_filename, filename):
+        if os.name == "nt" and os.path.exists(filename):
+            # rename does not replace existing files on Windows
+            os.remove(filename)
+        os.rename(temp_filename, filename)
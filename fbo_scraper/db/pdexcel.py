@@ -8,17 +8,28 @@ import pandas as pd
 from pandas.io.excel import ExcelWriter
 import os
 from fbo_scraper.items import Opportunity
+from fbo_scraper.db.index import SponsorNumberIndex, normalize_key
+from fbo_scraper.metrics import timed
+from fbo_scraper.db.report import write_report, ReportWatermark, report_watermark_filename, NEW
+from fbo_scraper.db.mirror import FeatherMirror, mirror_available
+from fbo_scraper.db.textindex import TextIndex, text_index_filename
+from fbo_scraper.db import schema
 #from datetime import date
 from datetime import datetime
+import time
 
 
 class PandasExcelHelper(object):
     '''
-    A helper class to help write notices to and read them from excel
+    A helper class to help write notices to and read them from excel. In memory, the
+    notices are kept with typed columns (see fbo_scraper/db/schema.py).
     '''
-    #how frequently to save the scraped items, i.e. interval of 5 means
-    #5 items are saved at a time.
-    save_interval = 1
+    #longest time (in seconds) between saves of the scraped items (they are
+    #also saved on close)
+    save_interval = 30.0
+    #how many incoming items to buffer before they are concatenated onto the
+    #dataframes (saving also concatenates them)
+    flush_batch_size = 100
 
 
     def __init__(self, db_filename = "fbo_solicitations.xlsx",
@@ -26,17 +37,36 @@ class PandasExcelHelper(object):
                  sol_sheet_name = "solicitations",
                  filtered_sheet_name = "filtered_solicitations",
                  index_column = "sponsor_number",
-                 report_only_new = True):
+                 report_only_new = True,
+                 use_mirror = True,
+                 archive = None,
+                 text_index = True,
+                 delta_report = True,
+                 report_deadline_days = 14):
         '''
         Constructor
+        @param use_mirror whether to keep a columnar (feather) mirror of the workbook, if pyarrow
+        is available: the mirror is then loaded instead of the workbook when it is newer, and 
+        save_all writes the mirror, while the workbook is only exported on close
+        @param archive optional ArchiveIndex (see fbo_scraper/db/bloom.py) with the sponsor numbers
+        of archived databases, which contains also checks
+        @param text_index whether to keep a full-text index of the titles & synopses next to the 
+        workbook (see fbo_scraper/db/textindex.py)
+        @param delta_report whether reports only have the notices that are new, changed or newly within
+        report_deadline_days of their deadline since the last report (see ReportWatermark)
         '''
-        if(not os.path.isfile(db_filename)):
+        self.archive = archive
+        self.mirror = None
+        if(use_mirror and mirror_available()):
+            self.mirror = FeatherMirror(db_filename, [sol_sheet_name, filtered_sheet_name], index_column)
+        
+        if(not os.path.isfile(db_filename) and not (self.mirror is not None and self.mirror.is_current())):
             #generate a blank writable excel sheet from scratch
             field_names = [field_name for field_name in Opportunity.fields]
             field_names.remove("filtered")
             writer = ExcelWriter(db_filename)
-            sol_df = pd.DataFrame(columns = field_names)
-            filtered_df = pd.DataFrame(columns = field_names)
+            sol_df = pd.DataFrame(columns = field_names).set_index(index_column)
+            filtered_df = pd.DataFrame(columns = field_names).set_index(index_column)
             sol_df.to_excel(writer,sol_sheet_name)
             filtered_df.to_excel(writer,filtered_sheet_name)
             writer.save()
@@ -50,36 +80,105 @@ class PandasExcelHelper(object):
         self.db_filename = db_filename
         self.sol_sheet_name = sol_sheet_name
         self.filtered_sheet_name = filtered_sheet_name
-        self.sol_df = pd.read_excel(db_filename,sol_sheet_name, index_col = index_column)
-        self.filtered_df = pd.read_excel(db_filename,filtered_sheet_name, index_col = index_column)
+        if(self.mirror is not None and self.mirror.is_current()):
+            #the columnar mirror is much faster to load than the workbook
+            self.sol_df = self.mirror.load(sol_sheet_name)
+            self.filtered_df = self.mirror.load(filtered_sheet_name)
+        else:
+            self.sol_df = pd.read_excel(db_filename,sol_sheet_name, index_col = index_column)
+            self.filtered_df = pd.read_excel(db_filename,filtered_sheet_name, index_col = index_column)
+        #workbooks saved before a field was added to Opportunity lack its column
+        self.sol_df = schema.apply_schema(self._add_missing_columns(self.sol_df, index_column))
+        self.filtered_df = schema.apply_schema(self._add_missing_columns(self.filtered_df, index_column))
+        #sponsor numbers in both sheets, for constant-time dedup checks
+        self.index = SponsorNumberIndex(self.sol_df.index)
+        self.index.update(self.filtered_df.index)
+        #normalized sponsor number ==> sponsor number as stored (the dataframe index label)
+        self.stored_keys = dict((normalize_key(key), key) for df in (self.filtered_df, self.sol_df) 
+                                for key in df.index)
+        #normalized sponsor number ==> fingerprint of the stored notice (if it has one)
+        self.fingerprints = {}
+        for df in (self.filtered_df, self.sol_df):
+            fingerprints = df["fingerprint"].dropna()
+            self.fingerprints.update(zip((normalize_key(key) for key in fingerprints.index), fingerprints.values))
         self.usaved_sol_counter = 0
-        self.sol_counter = 0
+        self.last_save_time = time.time()
         self.added_items = set()
+        #notice page urls of the items added since the last save, handed to on_save once they are saved
+        self.unsaved_urls = []
+        self.on_save = None
+        #items that have been added, but not yet concatenated onto the dataframes:
+        #lists of (key, item body) pairs
+        self.pending_sol_rows = []
+        self.pending_filtered_rows = []
+        self.report_watermark = (ReportWatermark(report_watermark_filename(db_filename), report_deadline_days)
+                                 if delta_report else None)
+        
+        self.text_index = None
+        if(text_index):
+            self.text_index = TextIndex(text_index_filename(db_filename))
+            if(len(self.text_index) == 0 and len(self.index) > 0):
+                print "\n\n========  Building text index " + self.text_index.filename + "...  ========"
+                self.text_index.build(row + (filtered,) for df, filtered in [(self.sol_df, False), (self.filtered_df, True)]
+                                      for row in zip(df.index, df["opportunity_title"], df["synopsis"], 
+                                                     df["office"], schema.deadline_strings(df)))
         
     
+    @staticmethod
+    def _add_missing_columns(df, index_column):
+        # (the mirror has the typed deadline instead of "deadline_date")
+        stored_columns = schema.storage_columns(df)
+        for field_name in Opportunity.fields:
+            if(field_name not in stored_columns and field_name != index_column and field_name != "filtered"):
+                df[field_name] = None
+        return df
+    
+    @timed("generate_report")
     def generate_report(self):
         '''
         Generates a separate excel report, consisting of non-award-type notices
-        that are not yet overdue
+        that are not yet overdue (with a report watermark, only those that are new, changed
+        or newly close to their deadline since the last report)
         '''
         print "\n\n========  Generating report...  ========"
+        self.flush()
         today = datetime.today()
-        df = self.sol_df.copy()
-        df["new"] = pd.Series([(1 if ix in self.added_items else 0 ) 
-                                      for ix in df.index ],
-                                      index=df.index)
-        df["dd"] = [datetime.strptime(dt, "%m/%d/%Y") for dt in df["deadline_date"].values]
-        report_df = df[(df["dd"] >= today) 
-                                & (df["announcement_type"] != "Award")]
-        
-        writer = ExcelWriter(self.report_filename)
-        report_df.to_excel(writer,self.sol_sheet_name,merge_cells=False)
-        writer.save()
-        writer.close()
+        # select the report rows first, without copying or looping over the whole database
+        deadlines = self.sol_df[schema.deadline_column]
+        in_report = ((deadlines >= today) & (self.sol_df["announcement_type"] != "Award")).values
+        report_df = self.sol_df[in_report]
+        report_deadlines = deadlines[in_report]
+        if(self.report_watermark is None):
+            new = report_df.index.isin(list(self.added_items)).astype(int)
+        else:
+            changes = self.report_watermark.delta(zip(report_df.index, report_df["fingerprint"], report_deadlines),
+                                                  today)
+            if(len(changes) == 0):
+                self.report_watermark.save()
+                print "========  Nothing new to report since the last report  ========\n"
+                return
+            in_delta = report_df.index.isin(list(changes))
+            report_df = report_df[in_delta]
+            report_deadlines = report_deadlines[in_delta]
+            new = [1 if changes[key] == NEW else 0 for key in report_df.index]
+        # fingerprints are of no use to the reader, the typed deadline is the "dd" column
+        report_df = schema.storage_frame(report_df).drop(["fingerprint"], axis = 1)
+        
+        rows = (tuple(row) + (is_new, deadline) for row, is_new, deadline
+                in zip(report_df.itertuples(), new, report_deadlines))
+        header = [report_df.index.name] + list(report_df.columns) + ["new", "dd"]
+        if(self.report_watermark is not None):
+            rows = (row + (changes[row[0]],) for row in rows)
+            header.append("change")
+        write_report(self.report_filename, self.sol_sheet_name, header, rows)
+        if(self.report_watermark is not None):
+            # only once the report is written, so that a failed report is made up for next time
+            self.report_watermark.save()
         
         print "========  Report Generated as " + self.report_filename + " ========\n"
         
         
+    @timed("add_item")
     def add_item(self,item):
         '''
         Adds the item to the proper dataframe based on the "filtered" attribute
@@ -97,37 +196,145 @@ class PandasExcelHelper(object):
                 item_body[field_name] = item[field_name]
                 
         
-        item_series = pd.Series(name=key,data=item_body)
-        
+        self.index.add(key)
+        self.stored_keys[normalize_key(key)] = key
+        if(item.get("fingerprint") is not None):
+            self.fingerprints[normalize_key(key)] = item["fingerprint"]
+        if(self.text_index is not None):
+            self.text_index.add_item(item)
+        if(item.get("program_url") is not None):
+            self.unsaved_urls.append(item["program_url"])
         if(filtered):
-            self.filtered_df.loc[key] = item_series
+            self.pending_filtered_rows.append((key, item_body))
         else:
             self.added_items.add(key)
-            self.sol_df.loc[key] = item_series
-            
-        if(self.sol_counter < PandasExcelHelper.save_interval):
-            self.sol_counter += 1
-        else:
-            self.sol_counter = 0
+            self.pending_sol_rows.append((key, item_body))
+        
+        # saving rewrites the whole mirror / workbook, so it is only done every save_interval seconds
+        if(time.time() - self.last_save_time >= PandasExcelHelper.save_interval):
             self.save_all()
+        elif(len(self.pending_sol_rows) + len(self.pending_filtered_rows) >= PandasExcelHelper.flush_batch_size):
+            self.flush()
 
         
+    @staticmethod
+    def _append_rows(df, rows):
+        '''
+        Concatenate the buffered (key, item body) rows onto the dataframe in one step,
+        with the typed columns. Rows with keys that are already present replace the existing ones.
+        '''
+        if(len(rows) == 0):
+            return df
+        keys = [key for key, _ in rows]
+        new_df = pd.DataFrame([body for _, body in rows],
+                              index = pd.Index(keys, name = df.index.name),
+                              columns = schema.storage_columns(df))
+        # last occurrence wins, as with repeated .loc assignment
+        new_df = schema.apply_schema(new_df[~new_df.index.duplicated(keep = "last")])
+        return schema.concat([df[~df.index.isin(new_df.index)], new_df])
+        
+    @staticmethod
+    def _drop_rows(df, rows):
+        '''
+        Remove the rows with the keys of the given (key, item body) rows from the dataframe
+        '''
+        if(len(rows) == 0):
+            return df
+        return df[~df.index.isin([key for key, _ in rows])]
+        
+    @timed("flush")
+    def flush(self):
+        '''
+        Moves all buffered items into the dataframes
+        '''
+        # a re-fetched notice may have moved from one sheet to the other
+        self.sol_df = self._append_rows(self._drop_rows(self.sol_df, self.pending_filtered_rows), 
+                                        self.pending_sol_rows)
+        self.filtered_df = self._append_rows(self._drop_rows(self.filtered_df, self.pending_sol_rows), 
+                                             self.pending_filtered_rows)
+        self.pending_sol_rows = []
+        self.pending_filtered_rows = []
+        
+    @timed("save_all")
     def save_all(self):
+        '''
+        Dumps all solicitations in both databases to the columnar mirror, or, if there 
+        is none, to the excel file (see export_excel)
+        '''
+        print "\n\n========  Saving solicitations...  ========"
+        self.flush()
+        if(self.text_index is not None):
+            self.text_index.commit()
+        if(self.mirror is not None):
+            self.mirror.save_all({self.sol_sheet_name: self.sol_df,
+                                  self.filtered_sheet_name: self.filtered_df})
+        else:
+            self.export_excel()
+        self.last_save_time = time.time()
+        self._saved()
+        print "========  Done saving.  ========\n"
+        
+    def _saved(self):
+        '''
+        Hand the notice page urls of the items that were just saved to on_save (e.g. to take
+        them off the crawl checkpoint's pending notices)
+        '''
+        urls = self.unsaved_urls
+        self.unsaved_urls = []
+        if(self.on_save is not None and len(urls) > 0):
+            self.on_save(urls)
+        
+    @timed("export_excel")
+    def export_excel(self):
         '''
         Dumps all solicitations in both databases to an excel file,
         into two separate spreadsheets: one for filtered items, the other
         for the remaining (relevant) items
         '''
-        print "\n\n========  Saving solicitations...  ========"
         writer = ExcelWriter(self.db_filename)
-        self.sol_df.to_excel(writer,self.sol_sheet_name,merge_cells=False)
-        self.filtered_df.to_excel(writer,self.filtered_sheet_name,merge_cells=False)
+        schema.storage_frame(self.sol_df).to_excel(writer,self.sol_sheet_name,merge_cells=False)
+        schema.storage_frame(self.filtered_df).to_excel(writer,self.filtered_sheet_name,merge_cells=False)
         writer.save()
         writer.close()
-        print "========  Done saving.  ========\n"
         
+    def close(self):
+        '''
+        Saves all solicitations before the helper is discarded
+        '''
+        if(self.mirror is not None):
+            self.flush()
+            self.export_excel()
+        # the mirror is written after the workbook, so that it is loaded next time
+        self.save_all()
+        if(self.text_index is not None):
+            self.text_index.close()
+        
+    def fingerprint(self, key):
+        '''
+        @return fingerprint of the stored notice, None if it has none (or is not stored)
+        '''
+        return self.fingerprints.get(normalize_key(key))
+    
+    def set_fingerprint(self, key, fingerprint):
+        '''
+        Store the fingerprint for a notice that is already in the database
+        '''
+        normalized_key = normalize_key(key)
+        # (may be stored with a differently spaced sponsor number, as contains sees it)
+        stored_key = self.stored_keys.get(normalized_key, key)
+        # rows not yet flushed (at most flush_batch_size of them) would replace the dataframe rows
+        for pending_key, item_body in self.pending_sol_rows + self.pending_filtered_rows:
+            if(pending_key == stored_key):
+                item_body["fingerprint"] = fingerprint
+        for df in (self.sol_df, self.filtered_df):
+            if(stored_key in df.index):
+                df.at[stored_key, "fingerprint"] = fingerprint
+        self.fingerprints[normalized_key] = fingerprint
+        
+    @timed("contains")
     def contains(self,key):
         '''
         Checks whether the key is present in either filtered or the unfiltered dataframe
+        (or in the archive)
         '''
-        return key in self.sol_df.index or key in self.filtered_df.index
\ No newline at end of file
+        return key in self.index or (self.archive is not None and key in self.archive)
@@ -0,0 +1,147 @@
+################################################################################
+#    @author: Greg Kramida (github id: Algomorph)
+# @copyright: (2015-2016) Gregory Kramida
+#   @license: Apache V2
+#            [That means (basically): feel free to modify, sell,
+#             whatever, just do not remove the original author's credits/notice
+#             from the files. For details, see LICENSE file.]
+################################################################################
+import os
+import json
+import time
+from datetime import datetime, timedelta
+
+from openpyxl import Workbook
+
+from fbo_scraper.db.index import normalize_key
+
+# reasons for a notice to be in a delta report
+NEW = "new"
+CHANGED = "changed"
+DEADLINE = "deadline"
+
+
+def _cell_value(value):
+    '''
+    Convert a pandas / sqlite value into something openpyxl can write
+    '''
+    if value is None:
+        return None
+    if isinstance(value, float) and value != value:
+        #NaN / NaT, i.e. an empty cell
+        return None
+    if hasattr(value, "to_pydatetime"):
+        #pandas Timestamp
+        return None if value != value else value.to_pydatetime()
+    if hasattr(value, "item"):
+        #numpy scalar
+        return value.item()
+    return value
+
+
+def write_report(filename, sheet_name, header, rows):
+    '''
+    Stream the rows into a new excel workbook, one row at a time, so that
+    memory use stays proportional to a single row rather than the whole report
+    @param header list of column names
+    @param rows iterable of row value sequences, in the same order as the header
+    @return number of rows written
+    '''
+    workbook = Workbook(write_only = True)
+    sheet = workbook.create_sheet(title = sheet_name)
+    sheet.append(header)
+    row_count = 0
+    for row in rows:
+        sheet.append([_cell_value(value) for value in row])
+        row_count += 1
+    workbook.save(filename)
+    return row_count
+
+
+def parse_deadline(deadline_string):
+    '''
+    @return datetime of a "%m/%d/%Y" deadline date string, None if it is not a proper date
+    '''
+    try:
+        return datetime.strptime(deadline_string, "%m/%d/%Y")
+    except (TypeError, ValueError):
+        return None
+
+
+def report_watermark_filename(db_filename):
+    return os.path.splitext(db_filename)[0] + ".report_watermark.json"
+
+
+class ReportWatermark(object):
+    '''
+    Which open notices were last reported, with their fingerprints & whether their deadline
+    was already close, so that delta reports only have the notices that are new, changed or
+    newly approaching their deadline since then. Saved as json (replaced atomically) once
+    the report is written, so that a crashed run is caught up on by the next report.
+    '''
+    def __init__(self, filename, deadline_days = 14):
+        '''
+        @param filename json file to load the watermark from & save it to
+        @param deadline_days notices are reported again once their deadline is this many days away
+        '''
+        self.filename = filename
+        self.deadline_window = timedelta(days = deadline_days)
+        # time of the last report
+        self.time = None
+        # normalized sponsor number ==> [fingerprint, whether the deadline was close]
+        self.notices = {}
+        self.next_notices = None
+        if os.path.isfile(filename):
+            try:
+                with open(filename, "rb") as watermark_file:
+                    watermark = json.load(watermark_file)
+                self.time = watermark["time"]
+                self.notices = watermark["notices"]
+            except (IOError, ValueError, KeyError) as error:
+                print "===> Could not read report watermark " + filename + ": " + repr(error)
+
+    def __len__(self):
+        return len(self.notices)
+
+    def delta(self, candidates, today):
+        '''
+        Find the notices to report & prepare the next watermark (see save)
+        @param candidates iterable of (sponsor number, fingerprint, deadline datetime) of all open notices
+        @param today time the report is made at
+        @return dictionary sponsor number ==> reason it is reported (NEW, CHANGED or DEADLINE)
+        '''
+        changes = {}
+        # notices that closed since the last report are dropped
+        self.next_notices = {}
+        for key, fingerprint, deadline in candidates:
+            normalized_key = normalize_key(key)
+            if fingerprint is not None and fingerprint != fingerprint:
+                # NaN from an empty cell
+                fingerprint = None
+            deadline_close = deadline - today <= self.deadline_window
+            entry = self.notices.get(normalized_key)
+            if entry is None:
+                changes[key] = NEW
+            elif fingerprint is not None and fingerprint != entry[0]:
+                changes[key] = CHANGED
+            elif deadline_close and not entry[1]:
+                changes[key] = DEADLINE
+            self.next_notices[normalized_key] = [fingerprint, deadline_close]
+        return changes
+
+    def save(self):
+        '''
+        Advance the watermark to the notices passed to the last delta call
+        '''
+        if self.next_notices is None:
+            return
+        self.notices = self.next_notices
+        self.next_notices = None
+        self.time = time.time()
+        temp_filename = self.filename + ".tmp"
+        with open(temp_filename, "wb") as watermark_file:
+            json.dump({"time": self.time, "notices": self.notices}, watermark_file)
+        if os.name == "nt" and os.path.exists(self.filename):
+            # rename does not replace existing files on Windows
+            os.remove(self.filename)
+        os.rename(temp_filename, self.filename)
@@ -0,0 +1,145 @@
+################################################################################
+#    @author: Greg Kramida (github id: Algomorph)
+# @copyright: (2015-2016) Gregory Kramida
+#   @license: Apache V2
+#            [That means (basically): feel free to modify, sell,
+#             whatever, just do not remove the original author's credits/notice
+#             from the files. For details, see LICENSE file.]
+################################################################################
+'''
+Column types of the in-memory notice dataframes: office & announcement type as categoricals
+(a small vocabulary repeated on every row), the check flags as booleans, and the deadline as
+a datetime "deadline" column in place of the "%m/%d/%Y" "deadline_date" strings, so that
+filtering by deadline does not re-parse them. Deadlines that are not proper dates keep their
+scraped text in the categorical "deadline_text" column. The "deadline_date" strings are only
+made again for the workbook & reports (see storage_frame).
+'''
+import pandas as pd
+from pandas.api.types import CategoricalDtype, union_categoricals
+
+from fbo_scraper.items import Opportunity
+
+categorical_columns = ["office", "announcement_type"]
+boolean_columns = ["check_date", "check_office", "check_office_wide"]
+# text columns that are read back as floats while all empty, kept as objects so that text can be set in place
+object_columns = ["fingerprint"]
+# replace "deadline_date" in memory & in the columnar mirror
+deadline_column = "deadline"
+deadline_text_column = "deadline_text"
+deadline_format = "%m/%d/%Y"
+
+
+def text_value(value):
+    '''
+    @return the cell value as unicode text, None for missing values
+    '''
+    if value is None or (isinstance(value, float) and value != value):
+        return None
+    if isinstance(value, str):
+        return value.decode("utf8", "replace")
+    if isinstance(value, unicode):
+        return value
+    return unicode(value)
+
+
+def parse_deadlines(deadline_dates):
+    '''
+    @return datetime64 series of the "%m/%d/%Y" deadline date strings, NaT where not a proper date
+    '''
+    return pd.to_datetime(deadline_dates, format = deadline_format, errors = "coerce")
+
+
+def _categorical(values, index):
+    texts = [text_value(value) for value in values]
+    # text categories also when there are none, so that the categories of all frames can be merged
+    categories = pd.Index(sorted(set(text for text in texts if text is not None)), dtype = object)
+    # (with the index, assigning plain values to an empty frame would replace it)
+    return pd.Series(pd.Categorical(texts, categories = categories), index = index)
+
+
+def apply_schema(df):
+    '''
+    Bring a notice dataframe (as read from the workbook / mirror or built from new items) to the
+    typed column layout
+    @return the typed dataframe (the given one is not modified)
+    '''
+    df = df.copy()
+    for column in categorical_columns:
+        if column in df.columns and not isinstance(df[column].dtype, CategoricalDtype):
+            df[column] = _categorical(df[column], df.index)
+    for column in boolean_columns:
+        if column in df.columns and df[column].dtype != bool:
+            df[column] = df[column].fillna(False).astype(bool)
+    for column in object_columns:
+        if column in df.columns and df[column].dtype != object:
+            df[column] = df[column].astype(object)
+    if "deadline_date" in df.columns:
+        deadline_dates = df["deadline_date"]
+        deadlines = parse_deadlines(deadline_dates)
+        for column in (deadline_column, deadline_text_column):
+            if column in df.columns:
+                del df[column]
+        # the typed columns take the place of "deadline_date", so that storage_frame can put it back there
+        position = df.columns.get_loc("deadline_date")
+        del df["deadline_date"]
+        df.insert(position, deadline_column, deadlines)
+        df.insert(position + 1, deadline_text_column, _categorical(deadline_dates.where(deadlines.isnull()), df.index))
+    return df
+
+
+def deadline_strings(df):
+    '''
+    @return the "%m/%d/%Y" deadline date strings of the typed dataframe, or the scraped text
+    for deadlines that are not proper dates
+    '''
+    deadlines = df[deadline_column]
+    strings = pd.Series(deadlines.dt.strftime(deadline_format).values, index = df.index, dtype = object)
+    return strings.where(deadlines.notnull(), df[deadline_text_column].astype(object))
+
+
+def concat(frames):
+    '''
+    Concatenate typed notice dataframes, with the categories of all of them, so that the
+    categorical columns stay categorical
+    '''
+    frames = list(frames)
+    for column in categorical_columns + [deadline_text_column]:
+        if not all(column in frame.columns and isinstance(frame[column].dtype, CategoricalDtype)
+                   for frame in frames):
+            continue
+        # categories of the first frame come first, so that (large) frames with all of them are not recoded
+        categories = union_categoricals([frame[column].values for frame in frames], ignore_order = True).categories
+        for ix_frame, frame in enumerate(frames):
+            if not frame[column].cat.categories.equals(categories):
+                frames[ix_frame] = frame.assign(**{column: frame[column].cat.set_categories(categories)})
+    return pd.concat(frames)
+
+
+def storage_columns(df):
+    '''
+    @return the columns of the typed dataframe as stored in the workbook
+    '''
+    return [("deadline_date" if column == deadline_column else column) for column in df.columns
+            if column != deadline_text_column]
+
+
+def storage_frame(df):
+    '''
+    @return the dataframe as stored in the workbook: Opportunity fields only, with plain text
+    instead of categoricals & the "deadline_date" strings instead of the typed deadline
+    '''
+    if deadline_column in df.columns:
+        df = df.assign(**{deadline_column: deadline_strings(df)})
+        df = df.drop([deadline_text_column], axis = 1).rename(columns = {deadline_column: "deadline_date"})
+    df = df.drop([column for column in df.columns if column not in Opportunity.fields], axis = 1)
+    for column in categorical_columns:
+        if column in df.columns and isinstance(df[column].dtype, CategoricalDtype):
+            df[column] = df[column].astype(object)
+    return df
+
+
+def memory_usage_mb(df):
+    '''
+    @return memory taken by the dataframe, including the python strings it refers to, in megabytes
+    '''
+    return (df.memory_usage(deep = True).sum() + df.index.memory_usage(deep = True)) / (1024.0 * 1024.0)
@@ -0,0 +1,327 @@
+################################################################################
+#    @author: Greg Kramida (github id: Algomorph)
+# @copyright: (2015-2016) Gregory Kramida
+#   @license: Apache V2
+#            [That means (basically): feel free to modify, sell,
+#             whatever, just do not remove the original author's credits/notice
+#             from the files. For details, see LICENSE file.]
+################################################################################
+import sqlite3
+import os
+from datetime import datetime
+
+import pandas as pd
+from pandas.io.excel import ExcelWriter
+
+from fbo_scraper.items import Opportunity
+from fbo_scraper.db.index import SponsorNumberIndex, normalize_key
+from fbo_scraper.metrics import timed
+from fbo_scraper.db.report import write_report, parse_deadline, ReportWatermark, report_watermark_filename, NEW
+from fbo_scraper.db.textindex import TextIndex, text_index_filename
+
+
+class SqliteHelper(object):
+    '''
+    A helper class to store notices in a journaled SQLite database (one row per
+    notice, appended as they come in) and to export them to excel on demand.
+    Provides the same contains/add_item/save_all/generate_report interface as
+    PandasExcelHelper.
+    '''
+    #how frequently to commit the scraped items, i.e. interval of 5 means
+    #5 items are committed at a time.
+    save_interval = 1
+
+    table_name = "notices"
+    #most keys to look up in a single query
+    select_batch_size = 500
+
+    def __init__(self, db_filename = "fbo_solicitations.sqlite",
+                 excel_filename = "fbo_solicitations.xlsx",
+                 report_prefix = "report",
+                 sol_sheet_name = "solicitations",
+                 filtered_sheet_name = "filtered_solicitations",
+                 index_column = "sponsor_number",
+                 archive = None,
+                 text_index = True,
+                 delta_report = True,
+                 report_deadline_days = 14):
+        '''
+        Constructor
+        @param db_filename path to the SQLite database file
+        @param excel_filename path to the excel workbook. It is imported once if
+        the SQLite database does not exist yet, and re-exported on close.
+        @param archive optional ArchiveIndex (see fbo_scraper/db/bloom.py) with the sponsor numbers
+        of archived databases, which contains also checks
+        @param text_index whether to keep a full-text index of the titles & synopses next to the 
+        database (see fbo_scraper/db/textindex.py)
+        @param delta_report whether reports only have the notices that are new, changed or newly within
+        report_deadline_days of their deadline since the last report (see ReportWatermark)
+        '''
+        self.archive = archive
+        field_names = [field_name for field_name in Opportunity.fields]
+        field_names.remove("filtered")
+        field_names.remove(index_column)
+        self.field_names = field_names
+        self.index_column = index_column
+
+        self.report_filename = (report_prefix + "_"
+                                + str(datetime.today())[:19]
+                                .replace(":","_").replace(" ","[") + "].xlsx")
+        self.db_filename = db_filename
+        self.excel_filename = excel_filename
+        self.sol_sheet_name = sol_sheet_name
+        self.filtered_sheet_name = filtered_sheet_name
+
+        is_new_db = not os.path.isfile(db_filename)
+        # notices may be added from a background writer thread (one thread at a time)
+        self.connection = sqlite3.connect(db_filename, check_same_thread = False)
+        # write-ahead log: every commit is a sequential append to the journal
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.execute("CREATE TABLE IF NOT EXISTS " + self.table_name + " ("
+                                + index_column + " TEXT PRIMARY KEY, "
+                                + "filtered INTEGER NOT NULL DEFAULT 0, "
+                                + ", ".join(self.field_names) + ")")
+        # databases created before a field was added to Opportunity lack its column
+        existing_columns = set(row[1] for row in self.connection.execute("PRAGMA table_info(" + self.table_name + ")"))
+        for field_name in self.field_names:
+            if(field_name not in existing_columns):
+                self.connection.execute("ALTER TABLE " + self.table_name + " ADD COLUMN " + field_name)
+        self.connection.commit()
+
+        if(is_new_db and os.path.isfile(excel_filename)):
+            self.import_excel(excel_filename)
+
+        #sponsor numbers of all stored notices, for constant-time dedup checks
+        self.index = SponsorNumberIndex(row[0] for row in self.connection.execute(
+                                        "SELECT " + index_column + " FROM " + self.table_name))
+        #normalized sponsor number ==> fingerprint of the stored notice (if it has one)
+        self.fingerprints = dict((normalize_key(row[0]), row[1]) for row in self.connection.execute(
+                                 "SELECT " + index_column + ", fingerprint FROM " + self.table_name
+                                 + " WHERE fingerprint IS NOT NULL"))
+        self.uncommitted_counter = 0
+        self.added_items = set()
+        #notice page urls of the items added since the last save, handed to on_save once they are saved
+        self.unsaved_urls = []
+        self.on_save = None
+        self.report_watermark = (ReportWatermark(report_watermark_filename(db_filename), report_deadline_days)
+                                 if delta_report else None)
+
+        self.text_index = None
+        if(text_index):
+            self.text_index = TextIndex(text_index_filename(db_filename))
+            if(len(self.text_index) == 0 and len(self.index) > 0):
+                print "\n\n========  Building text index " + self.text_index.filename + "...  ========"
+                self.text_index.build(self.connection.execute(
+                                      "SELECT " + index_column + ", opportunity_title, synopsis, office, "
+                                      + "deadline_date, filtered FROM " + self.table_name).fetchall())
+
+    @staticmethod
+    def _to_db_value(value):
+        '''
+        Convert a value coming from an item or a pandas cell into something sqlite can store
+        '''
+        if value is None:
+            return None
+        if isinstance(value, float) and value != value:
+            #NaN, i.e. an empty excel cell
+            return None
+        if hasattr(value, "item"):
+            #numpy scalar
+            value = value.item()
+        if isinstance(value, bool):
+            return int(value)
+        if isinstance(value, str):
+            return value.decode("utf-8", "replace")
+        return value
+
+    def _insert(self, key, filtered, item_body):
+        values = ([self._to_db_value(key), int(bool(filtered))]
+                  + [self._to_db_value(item_body.get(field_name)) for field_name in self.field_names])
+        self.connection.execute("INSERT OR REPLACE INTO " + self.table_name + " ("
+                                + self.index_column + ", filtered, " + ", ".join(self.field_names)
+                                + ") VALUES (" + ", ".join(["?"] * len(values)) + ")", values)
+
+    def import_excel(self, excel_filename):
+        '''
+        Import both spreadsheets of an existing excel database in a single transaction
+        '''
+        print "\n\n========  Importing " + excel_filename + " into " + self.db_filename + "...  ========"
+        for sheet_name, filtered in [(self.sol_sheet_name, False), (self.filtered_sheet_name, True)]:
+            df = pd.read_excel(excel_filename, sheet_name, index_col = self.index_column)
+            for key, row in df.iterrows():
+                self._insert(key, filtered, dict(row))
+        self.connection.commit()
+        print "========  Done importing.  ========\n"
+
+    @timed("add_item")
+    def add_item(self, item):
+        '''
+        Appends the item to the database, storing the "filtered" attribute along with it
+        '''
+        item = dict(item)
+        filtered = item["filtered"]
+        key = item[self.index_column]
+        self._insert(key, filtered, item)
+        self.index.add(key)
+        if(self.text_index is not None):
+            self.text_index.add_item(item)
+        if(item.get("fingerprint") is not None):
+            self.fingerprints[normalize_key(key)] = item["fingerprint"]
+        if(item.get("program_url") is not None):
+            self.unsaved_urls.append(item["program_url"])
+        if(not filtered):
+            self.added_items.add(key)
+
+        if(self.uncommitted_counter < SqliteHelper.save_interval - 1):
+            self.uncommitted_counter += 1
+        else:
+            self.uncommitted_counter = 0
+            self.save_all()
+
+    @timed("save_all")
+    def save_all(self):
+        '''
+        Commits all pending notices to the database journal
+        '''
+        self.connection.commit()
+        if(self.text_index is not None):
+            self.text_index.commit()
+        self._saved()
+
+    def _saved(self):
+        '''
+        Hand the notice page urls of the items that were just saved to on_save (e.g. to take
+        them off the crawl checkpoint's pending notices)
+        '''
+        urls = self.unsaved_urls
+        self.unsaved_urls = []
+        if(self.on_save is not None and len(urls) > 0):
+            self.on_save(urls)
+
+    @timed("contains")
+    def contains(self, key):
+        '''
+        Checks whether the key is present in the database (filtered or not) or in the archive
+        '''
+        return key in self.index or (self.archive is not None and key in self.archive)
+
+    def fingerprint(self, key):
+        '''
+        @return fingerprint of the stored notice, None if it has none (or is not stored)
+        '''
+        return self.fingerprints.get(normalize_key(key))
+
+    def set_fingerprint(self, key, fingerprint):
+        '''
+        Store the fingerprint for a notice that is already in the database
+        '''
+        cursor = self.connection.execute("UPDATE " + self.table_name + " SET fingerprint = ? WHERE "
+                                         + self.index_column + " = ?", (fingerprint, self._to_db_value(key)))
+        if(cursor.rowcount == 0):
+            # stored with a differently spaced sponsor number, as contains sees it
+            self.connection.execute("UPDATE " + self.table_name + " SET fingerprint = ? WHERE TRIM("
+                                    + self.index_column + ") = ?", (fingerprint, normalize_key(key)))
+        self.fingerprints[normalize_key(key)] = fingerprint
+
+    def _read_frame(self, where_clause = "", parameters = ()):
+        df = pd.read_sql_query("SELECT " + self.index_column + ", " + ", ".join(self.field_names)
+                               + " FROM " + self.table_name + " " + where_clause,
+                               self.connection, params = parameters, index_col = self.index_column)
+        for field_name in self.field_names:
+            if(field_name.startswith("check_")):
+                df[field_name] = df[field_name].fillna(0).astype(bool)
+        return df
+
+    @timed("export_excel")
+    def export_excel(self):
+        '''
+        Dumps all solicitations to the excel file, into two separate spreadsheets:
+        one for filtered items, the other for the remaining (relevant) items
+        '''
+        print "\n\n========  Exporting solicitations to " + self.excel_filename + "...  ========"
+        writer = ExcelWriter(self.excel_filename)
+        self._read_frame("WHERE filtered = 0").to_excel(writer, self.sol_sheet_name, merge_cells=False)
+        self._read_frame("WHERE filtered = 1").to_excel(writer, self.filtered_sheet_name, merge_cells=False)
+        writer.save()
+        writer.close()
+        print "========  Done exporting.  ========\n"
+
+    def _select_keys(self, columns, keys):
+        '''
+        @return generator of the rows (with the given columns) of the notices with the given keys
+        '''
+        for ix_batch in xrange(0, len(keys), SqliteHelper.select_batch_size):
+            batch = keys[ix_batch:ix_batch + SqliteHelper.select_batch_size]
+            for row in self.connection.execute("SELECT " + columns + " FROM " + self.table_name + " WHERE "
+                                               + self.index_column + " IN (" + ", ".join(["?"] * len(batch))
+                                               + ")", batch):
+                yield row
+
+    @timed("generate_report")
+    def generate_report(self):
+        '''
+        Generates a separate excel report, consisting of non-award-type notices
+        that are not yet overdue (with a report watermark, only those that are new, changed
+        or newly close to their deadline since the last report)
+        '''
+        print "\n\n========  Generating report...  ========"
+        today = datetime.today()
+        # deadline_date is stored as mm/dd/yyyy, rearrange it as yyyymmdd to compare
+        sortable_deadline = ("substr(deadline_date,7,4) || substr(deadline_date,1,2) "
+                             + "|| substr(deadline_date,4,2)")
+        # same rule as the excel backend (deadline >= now): a deadline (at midnight) of today has passed
+        open_notices = (" FROM " + self.table_name + " WHERE filtered = 0 AND announcement_type != 'Award' "
+                        + "AND deadline_date LIKE '__/__/____' AND " + sortable_deadline + " > ?")
+        parameters = (today.strftime("%Y%m%d"),)
+        # fingerprints are of no use to the reader
+        report_fields = [field_name for field_name in self.field_names if field_name != "fingerprint"]
+        columns = self.index_column + ", " + ", ".join(report_fields)
+        if(self.report_watermark is None):
+            changes = None
+            cursor = self.connection.execute("SELECT " + columns + open_notices, parameters)
+        else:
+            # only the keys, fingerprints & deadlines of the open notices are read to find what changed
+            candidates = ((key, fingerprint, parse_deadline(deadline)) for key, fingerprint, deadline
+                          in self.connection.execute("SELECT " + self.index_column + ", fingerprint, deadline_date"
+                                                     + open_notices, parameters))
+            changes = self.report_watermark.delta(candidates, today)
+            if(len(changes) == 0):
+                self.report_watermark.save()
+                print "========  Nothing new to report since the last report  ========\n"
+                return
+            cursor = self._select_keys(columns, list(changes))
+        # column positions in the selected rows (the index column comes first)
+        check_columns = [ix_field + 1 for ix_field, field_name in enumerate(report_fields)
+                         if field_name.startswith("check_")]
+        deadline_column = report_fields.index("deadline_date") + 1
+
+        def report_rows():
+            for row in cursor:
+                row = list(row)
+                for ix_column in check_columns:
+                    row[ix_column] = bool(row[ix_column])
+                if(changes is None):
+                    yield row + [1 if row[0] in self.added_items else 0, parse_deadline(row[deadline_column])]
+                else:
+                    yield row + [1 if changes[row[0]] == NEW else 0, parse_deadline(row[deadline_column]),
+                                 changes[row[0]]]
+
+        write_report(self.report_filename, self.sol_sheet_name,
+                     [self.index_column] + report_fields + ["new", "dd"] + ([] if changes is None else ["change"]),
+                     report_rows())
+        if(self.report_watermark is not None):
+            # only once the report is written, so that a failed report is made up for next time
+            self.report_watermark.save()
+
+        print "========  Report Generated as " + self.report_filename + " ========\n"
+
+    def close(self):
+        '''
+        Commits outstanding notices, exports the database to excel, and closes it
+        '''
+        self.save_all()
+        self.export_excel()
+        self.connection.close()
+        if(self.text_index is not None):
+            self.text_index.close()
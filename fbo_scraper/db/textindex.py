@@ -0,0 +1,324 @@
+################################################################################
+#    @author: Greg Kramida (github id: Algomorph)
+# @copyright: (2015-2016) Gregory Kramida
+#   @license: Apache V2
+#            [That means (basically): feel free to modify, sell,
+#             whatever, just do not remove the original author's credits/notice
+#             from the files. For details, see LICENSE file.]
+################################################################################
+'''
+Inverted index over the titles & synopses of the stored notices, kept in a SQLite file next
+to the database (e.g. fbo_solicitations.textindex.sqlite) & updated as notices are added.
+Queries are ranked (BM25), "quoted phrases" have to match word for word.
+
+Run from root directory (top-level fbo_scraper folder) like this:
+    python -m fbo_scraper.db.textindex search "hypersonic \\"machine learning\\"" --office "Defense Sciences" --after 01/01/2016
+    python -m fbo_scraper.db.textindex build fbo_solicitations.sqlite
+'''
+import os
+import re
+import sys
+import math
+import time
+import sqlite3
+import argparse
+from datetime import datetime
+
+import pandas as pd
+
+from fbo_scraper.db.index import normalize_key
+from fbo_scraper.db.report import parse_deadline
+
+word_pattern = re.compile(r"\w+", re.UNICODE)
+# "a phrase" or a single word
+query_pattern = re.compile(r'"([^"]*)"|(\S+)', re.UNICODE)
+# positions skipped between the title & the synopsis, so that phrases don't match across them
+field_gap = 10
+# documents are looked up in batches of this size (SQLite allows at most 999 parameters),
+# if there are more, all rows are scanned instead
+lookup_batch_size = 500
+
+
+def text_index_filename(db_filename):
+    return os.path.splitext(db_filename)[0] + ".textindex.sqlite"
+
+
+def _text(value):
+    if value is None or (isinstance(value, float) and value != value):
+        #empty cell
+        return u""
+    if isinstance(value, str):
+        return value.decode("utf-8", "replace")
+    return unicode(value)
+
+
+def tokenize(text):
+    return word_pattern.findall(_text(text).lower())
+
+
+def parse_query(query):
+    '''
+    @return list of phrases (lists of words), a single word being a phrase of one
+    '''
+    phrases = []
+    for phrase, word in query_pattern.findall(_text(query)):
+        words = tokenize(phrase if phrase else word)
+        if len(words) > 0:
+            phrases.append(words)
+    return phrases
+
+
+def _has_phrase(postings, phrase):
+    # each position of the first word starts a possible match
+    positions = [set(int(position) for position in postings[word][1].split(",")) for word in phrase]
+    return any(all(start + offset in positions[offset] for offset in xrange(1, len(phrase)))
+               for start in positions[0])
+
+
+class TextIndex(object):
+    '''
+    Word ==> (notice, frequency, positions) postings & notice metadata for filtering, in SQLite
+    '''
+    # title words count this many times as much as synopsis words
+    title_weight = 2
+    # BM25 parameters
+    k1 = 1.2
+    b = 0.75
+
+    def __init__(self, filename):
+        self.filename = filename
+        # notices are added from the database writer thread, one thread at a time
+        self.connection = sqlite3.connect(filename, check_same_thread = False)
+        # readers (e.g. the search CLI) are not blocked while the crawl adds notices
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.execute("CREATE TABLE IF NOT EXISTS documents (doc_id INTEGER PRIMARY KEY, "
+                                + "key TEXT UNIQUE NOT NULL, sponsor_number TEXT, title TEXT, office TEXT, "
+                                + "deadline TEXT, filtered INTEGER NOT NULL DEFAULT 0, length INTEGER NOT NULL)")
+        self.connection.execute("CREATE TABLE IF NOT EXISTS postings (term TEXT NOT NULL, doc_id INTEGER NOT NULL, "
+                                + "frequency INTEGER NOT NULL, positions TEXT NOT NULL, PRIMARY KEY (term, doc_id))")
+        # for replacing the postings of a re-fetched notice
+        self.connection.execute("CREATE INDEX IF NOT EXISTS postings_doc_id ON postings (doc_id)")
+        self.connection.commit()
+
+    def __len__(self):
+        return self.connection.execute("SELECT COUNT(*) FROM documents").fetchone()[0]
+
+    def add(self, sponsor_number, title, synopsis, office = None, deadline_date = None, filtered = False):
+        '''
+        Index the notice, replacing what was indexed for it before
+        @param deadline_date "%m/%d/%Y" deadline date string, as stored in the database
+        '''
+        key = normalize_key(sponsor_number)
+        row = self.connection.execute("SELECT doc_id FROM documents WHERE key = ?", (key,)).fetchone()
+        doc_id = None
+        if row is not None:
+            doc_id = row[0]
+            self.connection.execute("DELETE FROM postings WHERE doc_id = ?", (doc_id,))
+        title_words = tokenize(title)
+        synopsis_words = tokenize(synopsis)
+        # word ==> [frequency, positions]
+        postings = {}
+        for position, word in enumerate(title_words):
+            posting = postings.setdefault(word, [0, []])
+            posting[0] += TextIndex.title_weight
+            posting[1].append(position)
+        for position, word in enumerate(synopsis_words, len(title_words) + field_gap):
+            posting = postings.setdefault(word, [0, []])
+            posting[0] += 1
+            posting[1].append(position)
+        deadline = parse_deadline(_text(deadline_date))
+        cursor = self.connection.execute("INSERT OR REPLACE INTO documents (doc_id, key, sponsor_number, title, "
+                                         + "office, deadline, filtered, length) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                                         (doc_id, key, _text(sponsor_number), _text(title), _text(office),
+                                          deadline.strftime("%Y-%m-%d") if deadline is not None else None,
+                                          int(bool(filtered)),
+                                          TextIndex.title_weight * len(title_words) + len(synopsis_words)))
+        if doc_id is None:
+            doc_id = cursor.lastrowid
+        self.connection.executemany("INSERT INTO postings (term, doc_id, frequency, positions) VALUES (?, ?, ?, ?)",
+                                    ((word, doc_id, posting[0], ",".join(str(position) for position in posting[1]))
+                                     for word, posting in postings.iteritems()))
+
+    def add_item(self, item):
+        self.add(item["sponsor_number"], item.get("opportunity_title"), item.get("synopsis"),
+                 item.get("office"), item.get("deadline_date"), item.get("filtered", False))
+
+    def build(self, rows):
+        '''
+        Replace the whole index
+        @param rows iterable of (sponsor number, title, synopsis, office, deadline date, filtered) tuples
+        @return number of notices indexed
+        '''
+        self.connection.execute("DELETE FROM postings")
+        self.connection.execute("DELETE FROM documents")
+        count = 0
+        for row in rows:
+            self.add(*row)
+            count += 1
+        self.commit()
+        return count
+
+    def commit(self):
+        self.connection.commit()
+
+    def close(self):
+        self.connection.commit()
+        self.connection.close()
+
+    def _select(self, query, parameters, doc_ids):
+        '''
+        Run the query (which ends with a WHERE clause) for the given documents only, if doc_ids 
+        is not None
+        @return generator of rows, the doc id being the first column
+        '''
+        if doc_ids is None:
+            for row in self.connection.execute(query, parameters):
+                yield row
+        elif len(doc_ids) > lookup_batch_size:
+            for row in self.connection.execute(query, parameters):
+                if row[0] in doc_ids:
+                    yield row
+        else:
+            for row in self.connection.execute(query + " AND doc_id IN (" + ", ".join(["?"] * len(doc_ids)) + ")",
+                                               list(parameters) + list(doc_ids)):
+                yield row
+
+    def _postings(self, word, doc_ids = None):
+        '''
+        @return dictionary doc id ==> (frequency, comma-separated positions) for the word, only
+        for the given documents if doc_ids is not None
+        '''
+        return dict((doc_id, (frequency, positions)) for doc_id, frequency, positions in
+                    self._select("SELECT doc_id, frequency, positions FROM postings WHERE term = ?", (word,), doc_ids))
+
+    def search(self, query, office = None, deadline_from = None, deadline_to = None,
+               include_filtered = False, limit = 20):
+        '''
+        Find the notices that have all words & phrases of the query in their title or synopsis
+        @param query words & "quoted phrases"
+        @param office only notices with an office containing this text
+        @param deadline_from only notices with a deadline on or after this date (datetime)
+        @param deadline_to only notices with a deadline on or before this date (datetime)
+        @param include_filtered whether to include filtered notices
+        @param limit maximum number of results
+        @return list of dictionaries with "sponsor_number", "title", "office", "deadline" & "score",
+        best matches first
+        '''
+        phrases = parse_query(query)
+        words = set(word for phrase in phrases for word in phrase)
+        if len(words) == 0:
+            return []
+        document_frequencies = dict((word, self.connection.execute("SELECT COUNT(*) FROM postings WHERE term = ?",
+                                                                   (word,)).fetchone()[0]) for word in words)
+        if min(document_frequencies.values()) == 0:
+            return []
+        # start with the rarest word, look up the others only for the documents that have it
+        postings_by_doc = None
+        for word in sorted(words, key = lambda word: document_frequencies[word]):
+            word_postings = self._postings(word, postings_by_doc)
+            if postings_by_doc is None:
+                postings_by_doc = dict((doc_id, {}) for doc_id in word_postings)
+            else:
+                postings_by_doc = dict((doc_id, postings_by_doc[doc_id]) for doc_id in word_postings)
+            for doc_id, posting in word_postings.iteritems():
+                postings_by_doc[doc_id][word] = posting
+            if len(postings_by_doc) == 0:
+                return []
+
+        conditions = ["1"]
+        parameters = []
+        if not include_filtered:
+            conditions.append("filtered = 0")
+        if office is not None:
+            conditions.append("office LIKE ?")
+            parameters.append("%" + office + "%")
+        if deadline_from is not None:
+            conditions.append("deadline >= ?")
+            parameters.append(deadline_from.strftime("%Y-%m-%d"))
+        if deadline_to is not None:
+            conditions.append("deadline <= ?")
+            parameters.append(deadline_to.strftime("%Y-%m-%d"))
+        document_count, total_length = self.connection.execute("SELECT COUNT(*), SUM(length) FROM documents").fetchone()
+        average_length = float(total_length) / document_count
+        idf = dict((word, math.log(1.0 + (document_count - frequency + 0.5) / (frequency + 0.5)))
+                   for word, frequency in document_frequencies.items())
+        multi_word_phrases = [phrase for phrase in phrases if len(phrase) > 1]
+
+        results = []
+        for doc_id, sponsor_number, title, doc_office, deadline, length in self._select(
+                "SELECT doc_id, sponsor_number, title, office, deadline, length FROM documents WHERE "
+                + " AND ".join(conditions), parameters, postings_by_doc):
+            postings = postings_by_doc[doc_id]
+            if not all(_has_phrase(postings, phrase) for phrase in multi_word_phrases):
+                continue
+            length_norm = TextIndex.k1 * (1.0 - TextIndex.b + TextIndex.b * length / average_length)
+            score = sum(idf[word] * frequency * (TextIndex.k1 + 1.0) / (frequency + length_norm)
+                        for word, (frequency, _) in postings.iteritems())
+            results.append({"sponsor_number": sponsor_number, "title": title, "office": doc_office,
+                            "deadline": deadline, "score": score})
+        results.sort(key = lambda result: -result["score"])
+        return results[:limit]
+
+
+def read_database_rows(db_filename, sol_sheet_name = "solicitations", filtered_sheet_name = "filtered_solicitations"):
+    '''
+    @return generator of the (sponsor number, title, synopsis, office, deadline date, filtered) tuples
+    of the notices in an excel or sqlite database
+    '''
+    columns = ["opportunity_title", "synopsis", "office", "deadline_date"]
+    if os.path.splitext(db_filename)[1].lower() in (".xlsx", ".xls"):
+        for sheet_name, filtered in [(sol_sheet_name, False), (filtered_sheet_name, True)]:
+            df = pd.read_excel(db_filename, sheet_name, index_col = "sponsor_number")
+            for row in zip(df.index, *[df[column] for column in columns]):
+                yield row + (filtered,)
+    else:
+        connection = sqlite3.connect(db_filename)
+        for row in connection.execute("SELECT sponsor_number, " + ", ".join(columns) + ", filtered FROM notices"):
+            yield row
+        connection.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description = "Ranked keyword / phrase search over the stored notices.")
+    subparsers = parser.add_subparsers(dest = "command")
+    search_parser = subparsers.add_parser("search", help = "search the index")
+    search_parser.add_argument("query", help = "words & \"quoted phrases\" that all have to match")
+    search_parser.add_argument("-i", "--index", default = text_index_filename("fbo_solicitations.sqlite"),
+                               help = "text index file")
+    search_parser.add_argument("-o", "--office", default = None, help = "only notices of offices containing this text")
+    search_parser.add_argument("--after", default = None, help = "only notices with a deadline on/after mm/dd/yyyy")
+    search_parser.add_argument("--before", default = None, help = "only notices with a deadline on/before mm/dd/yyyy")
+    search_parser.add_argument("-f", "--filtered", action = "store_true", help = "include filtered notices")
+    search_parser.add_argument("-n", "--limit", type = int, default = 20, help = "maximum number of results")
+    build_parser = subparsers.add_parser("build", help = "(re)build the index from a database")
+    build_parser.add_argument("db", nargs = "?", default = "fbo_solicitations.sqlite",
+                              help = "sqlite database or excel workbook, the index is written next to it")
+    args = parser.parse_args()
+
+    if args.command == "build":
+        text_index = TextIndex(text_index_filename(args.db))
+        count = text_index.build(read_database_rows(args.db))
+        text_index.close()
+        print "Indexed " + str(count) + " notices in " + text_index_filename(args.db)
+        return 0
+
+    if not os.path.isfile(args.index):
+        print "No text index " + args.index + ", build it with: python -m fbo_scraper.db.textindex build <database>"
+        return 1
+    text_index = TextIndex(args.index)
+    start_time = time.time()
+    results = text_index.search(args.query, args.office,
+                                datetime.strptime(args.after, "%m/%d/%Y") if args.after else None,
+                                datetime.strptime(args.before, "%m/%d/%Y") if args.before else None,
+                                args.filtered, args.limit)
+    elapsed = time.time() - start_time
+    for result in results:
+        print (u"%8.3f  %-20s %-10s %-32s %s" % (result["score"], result["sponsor_number"], result["deadline"] or u"-",
+                                                  (result["office"] or u"")[:32], result["title"])).encode("utf8")
+    print "%d result(s) in %.1f ms" % (len(results), elapsed * 1000.0)
+    text_index.close()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
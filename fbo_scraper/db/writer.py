@@ -0,0 +1,160 @@
+################################################################################
+#    @author: Greg Kramida (github id: Algomorph)
+# @copyright: (2015-2016) Gregory Kramida
+#   @license: Apache V2
+#            [That means (basically): feel free to modify, sell,
+#             whatever, just do not remove the original author's credits/notice
+#             from the files. For details, see LICENSE file.]
+################################################################################
+import Queue
+import logging
+import threading
+import collections
+
+from twisted.internet import reactor, defer
+
+from fbo_scraper.db.index import normalize_key
+from fbo_scraper.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# put on the queue to stop the writer thread
+_stop = object()
+
+
+class BackgroundWriter(object):
+    '''
+    Hands items to a database helper (PandasExcelHelper or SqliteHelper) on a separate
+    thread, through a bounded queue, so that saving the database does not hold up the
+    crawl. Items that were submitted, but not yet written, are still seen by contains.
+    While the queue is full, entries wait in line without blocking any thread, and the
+    writer thread moves them onto the queue as it makes room.
+    '''
+
+    def __init__(self, db, max_queue_size = 1000):
+        self.db = db
+        self.queue = Queue.Queue(max_queue_size)
+        # normalized key ==> number of submitted items with that key that are not yet written
+        self.pending_keys = {}
+        self.pending_lock = threading.Lock()
+        # (entry, deferred fired once the entry is on the queue, or None) waiting for room in the queue
+        self.waiting = collections.deque()
+        self.waiting_lock = threading.Lock()
+        self.error_count = 0
+        self.thread = threading.Thread(target = self._run, name = "fbo_db_writer")
+        self.thread.daemon = True
+        self.thread.start()
+
+    def _add_pending(self, key, count):
+        with self.pending_lock:
+            count += self.pending_keys.get(key, 0)
+            if count > 0:
+                self.pending_keys[key] = count
+            else:
+                del self.pending_keys[key]
+
+    def _enqueue(self, entry, deferred = None):
+        '''
+        Put the entry on the queue, or, if the queue is full (or others are waiting already),
+        in line for it
+        @return True if the entry is on the queue, False if it waits in line
+        '''
+        with self.waiting_lock:
+            if len(self.waiting) == 0:
+                try:
+                    self.queue.put_nowait(entry)
+                    return True
+                except Queue.Full:
+                    pass
+            self.waiting.append((entry, deferred))
+            return False
+
+    def _admit_waiting(self):
+        '''
+        Move waiting entries onto the queue while there is room, firing their deferreds
+        on the reactor thread
+        '''
+        with self.waiting_lock:
+            while len(self.waiting) > 0:
+                entry, deferred = self.waiting[0]
+                try:
+                    self.queue.put_nowait(entry)
+                except Queue.Full:
+                    return
+                self.waiting.popleft()
+                if deferred is not None:
+                    reactor.callFromThread(deferred.callback, None)
+
+    def submit(self, item):
+        '''
+        Queue the item for writing. The item is seen by contains from now on.
+        @return None if the item is queued, otherwise (the queue is full) a Deferred
+        fired once the item is queued
+        '''
+        self._add_pending(normalize_key(item["sponsor_number"]), 1)
+        deferred = defer.Deferred()
+        if self._enqueue(item, deferred):
+            return None
+        metrics.increment("db_writer_queue_full")
+        return deferred
+
+    def queue_length(self):
+        '''
+        @return number of entries on the queue or waiting for room in it
+        '''
+        return self.queue.qsize() + len(self.waiting)
+
+    def contains(self, key):
+        '''
+        Checks whether the key is in the database or waiting to be written to it
+        '''
+        with self.pending_lock:
+            if normalize_key(key) in self.pending_keys:
+                return True
+        return self.db.contains(key)
+
+    def fingerprint(self, key):
+        return self.db.fingerprint(key)
+
+    def set_fingerprint(self, key, fingerprint):
+        '''
+        Queue storing the fingerprint of a notice that is already in the database
+        (in line for the queue if it is full, the caller does not wait for it)
+        '''
+        self._enqueue((key, fingerprint))
+
+    def _run(self):
+        while True:
+            entry = self.queue.get()
+            self._admit_waiting()
+            if entry is _stop:
+                break
+            if isinstance(entry, tuple):
+                # (key, fingerprint)
+                try:
+                    self.db.set_fingerprint(*entry)
+                except Exception:
+                    logger.exception("Failed to store fingerprint of notice %s", entry[0])
+                continue
+            try:
+                self.db.add_item(entry)
+            except Exception:
+                self.error_count += 1
+                logger.exception("Failed to store notice %s", entry.get("sponsor_number"))
+            finally:
+                # only forget the key once the database has it
+                self._add_pending(normalize_key(entry["sponsor_number"]), -1)
+
+    def close(self):
+        '''
+        Wait until all queued items are written & stop the writer thread
+        '''
+        if not self.thread.is_alive():
+            return
+        print "\n\n========  Waiting for " + str(self.queue_length()) + " queued notices to be written...  ========"
+        # behind any entries still waiting for room
+        self._enqueue(_stop)
+        self.thread.join()
+        if self.error_count > 0:
+            print "===> Failed to store " + str(self.error_count) + " notice(s), see log."
+        print "========  Done writing.  ========\n"
@@ -0,0 +1,132 @@
+################################################################################
+#    @author: Greg Kramida (github id: Algomorph)
+# @copyright: (2015-2016) Gregory Kramida
+#   @license: Apache V2
+#            [That means (basically): feel free to modify, sell,
+#             whatever, just do not remove the original author's credits/notice
+#             from the files. For details, see LICENSE file.]
+################################################################################
+'''
+Extraction plan for fbo.gov notice pages: the page is parsed once, all the widgets
+the spider needs are located with a single precompiled XPath, and the fields are
+pulled out of them with precompiled relative XPaths and module-level regexes.
+'''
+import re
+import htmlentitydefs
+from lxml import etree
+
+#=================== WIDGETS OF THE NOTICE PAGE ==============================#
+SOLICITATION_NUMBER_WIDGET = "dnf_class_values_procurement_notice__solicitation_number__widget"
+RESPONSE_DEADLINE_WIDGET = "dnf_class_values_procurement_notice__response_deadline__widget"
+ARCHIVE_RESPONSE_DEADLINE_FIELD = "so_formfield_dnf_class_values_procurement_notice_archive__response_deadline_"
+ORIGINAL_RESPONSE_DEADLINE_WIDGET = "dnf_class_values_procurement_notice__original_response_deadline__widget"
+PROCUREMENT_TYPE_WIDGET = "dnf_class_values_procurement_notice__procurement_type__widget"
+DESCRIPTION_WIDGET = "dnf_class_values_procurement_notice__description__widget"
+AGENCY_HEADER_CLASS = "agency-header-w"
+
+widget_ids = (SOLICITATION_NUMBER_WIDGET, RESPONSE_DEADLINE_WIDGET, ARCHIVE_RESPONSE_DEADLINE_FIELD,
+              ORIGINAL_RESPONSE_DEADLINE_WIDGET, PROCUREMENT_TYPE_WIDGET, DESCRIPTION_WIDGET)
+
+# all the divs of interest, in a single pass over the document
+notice_widgets_xpath = etree.XPath("//div[" + " or ".join("@id='" + widget_id + "'" for widget_id in widget_ids)
+                                   + " or @class='" + AGENCY_HEADER_CLASS + "']")
+text_xpath = etree.XPath("./text()", smart_strings = False)
+archive_deadline_text_xpath = etree.XPath("./div[2]/text()", smart_strings = False)
+title_text_xpath = etree.XPath("./div/h2/text()", smart_strings = False)
+# some <p> tags have formatting, or perhaps...
+# some idiot hand-pasted an entry from another website / text document
+# and did not remove the formatting, hence the complicated query
+description_text_xpath = etree.XPath("./text()|./p/text()|"  # regular text & paragraphs
+                                     + "./p/span/text()|./p/span/span/text()|"  # some queer line spacing & kerning
+                                     + "./div/span[@class='added']/text()",  # the dates entries were added
+                                     smart_strings = False)
+
+#=================== PATTERNS ================================================#
+date_pattern = re.compile(r"(?:Jan|January|Feb|February|Mar|March|Apr|April|May|Jun|June|Jul|July|Aug|August|"
+                          + r"Sep|September|Oct|October|Nov|November|Dec|December)\s\d\d?,\s\d\d\d\d")
+office_wide_pattern = re.compile(r"Office\s*\-?\s*Wide", re.IGNORECASE)
+entry_date_pattern = re.compile(r'(?:Jan|Feb|Mar|Apr|May|Jun|Jul|Aug|Sep|Oct|Nov|Dec)\s\d\d?,\s\d\d\d\d\s\d\d?:\d\d?\d\s(?:pm|am)')
+html_entity_pattern = re.compile(r'&([^;]+);')
+
+# if the description has more text fragments than this, it is considered to have crazy formatting
+crazy_formatting_fragment_count = 100
+newline = u'\u000D\u000A'
+
+html_parser = etree.HTMLParser(recover = True, encoding = "utf8")
+
+
+def parse_document(text):
+    '''
+    Parse the (unicode) text of a page into an lxml tree, the same way scrapy's selectors do
+    '''
+    body = text.strip().replace(u"\x00", u"").encode("utf8") or "<html/>"
+    root = etree.fromstring(body, parser = html_parser)
+    if root is None:
+        root = etree.fromstring("<html/>", parser = html_parser)
+    return root
+
+
+def extract_notice_fields(root):
+    '''
+    Pull the raw fields out of a parsed notice page
+    @param root root of the parsed page, see parse_document
+    @return dictionary of lists of text fragments, keyed by: "solicitation_number",
+    "response_deadline" (the archive response date if there is no response deadline),
+    "original_response_deadline", "title", "procurement_type" & "description"
+    '''
+    widgets = dict((widget_id, []) for widget_id in widget_ids)
+    headers = []
+    for div in notice_widgets_xpath(root):
+        div_id = div.get("id")
+        if div_id in widgets:
+            widgets[div_id].append(div)
+        if div.get("class") == AGENCY_HEADER_CLASS:
+            headers.append(div)
+
+    def texts(divs, xpath = text_xpath):
+        return [text for div in divs for text in xpath(div)]
+
+    response_deadline = texts(widgets[RESPONSE_DEADLINE_WIDGET])
+    if len(response_deadline) == 0:
+        #archive date only
+        response_deadline = texts(widgets[ARCHIVE_RESPONSE_DEADLINE_FIELD], archive_deadline_text_xpath)
+    return {
+        "solicitation_number": texts(widgets[SOLICITATION_NUMBER_WIDGET]),
+        "response_deadline": response_deadline,
+        "original_response_deadline": texts(widgets[ORIGINAL_RESPONSE_DEADLINE_WIDGET]),
+        "title": texts(headers, title_text_xpath),
+        "procurement_type": texts(widgets[PROCUREMENT_TYPE_WIDGET]),
+        # only the first description widget is used
+        "description": texts(widgets[DESCRIPTION_WIDGET][:1], description_text_xpath)
+    }
+
+
+def _replace_entity(match):
+    return unichr(htmlentitydefs.name2codepoint[match.group(1)])
+
+
+def normalize_synopsis(fragments):
+    '''
+    Join the text fragments of the description into the synopsis text
+    @param fragments list of unicode strings, as extracted by extract_notice_fields
+    @return unicode synopsis
+    '''
+    if len(fragments) > crazy_formatting_fragment_count:
+        # crazy formatting! Collapse (don't insert newlines except for dates)
+        fragments = [entry.strip() + newline if entry_date_pattern.match(entry) or entry == u'Added:' else entry
+                     for entry in fragments]
+    elif len(fragments) > 0:
+        # insert newlines for all entries
+        # trim whitespace
+        fragments = [entry.strip() + newline for entry in fragments]
+        # get rid of newline for last entry
+        fragments[-1] = fragments[-1].strip()
+
+    desc_text = u''.join(fragments)
+    # convert html special characters to unicode
+    try:
+        desc_text = html_entity_pattern.sub(_replace_entity, desc_text)
+    except(KeyError):
+        pass  # ignore step
+
+    return desc_text.strip()  # remove trailing newlines
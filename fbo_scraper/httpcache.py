@@ -0,0 +1,192 @@
+################################################################################
+#    @author: Greg Kramida (github id: Algomorph)
+# @copyright: (2015-2016) Gregory Kramida
+#   @license: Apache V2
+#            [That means (basically): feel free to modify, sell,
+#             whatever, just do not remove the original author's credits/notice
+#             from the files. For details, see LICENSE file.]
+################################################################################
+'''
+Persistent response cache for fbo.gov notice pages & darpa.mil listing pages,
+plugged into scrapy's HttpCacheMiddleware (see HTTPCACHE_* settings).
+
+Entries are keyed by the notice id (the id= parameter of the "Complete View" notice
+url) and by the darpa.mil listing page number (PP= parameter), so that they do not
+depend on the headers or the exact form of the url. Other requests (e.g. fbo.gov
+list queries) are not cached.
+'''
+import os
+import re
+import json
+import time
+import shutil
+import hashlib
+import logging
+from email.utils import formatdate
+
+from scrapy.extensions.httpcache import FilesystemCacheStorage, RFC2616Policy, rfc1123_to_epoch
+
+logger = logging.getLogger(__name__)
+
+NOTICE_PAGE = "notice"
+DARPA_LIST_PAGE = "darpa"
+
+notice_url_pattern = re.compile(r"[?&]mode=form&id=([0-9a-fA-F]+)&.*_cview=1")
+darpa_list_url_pattern = re.compile(r"/work-with-us/opportunities\?.*PP=(\d+)")
+
+
+def request_cache_key(request):
+    '''
+    @return (kind, key) tuple for requests of cacheable pages, None for all other requests
+    '''
+    if request.method != "GET":
+        return None
+    match = notice_url_pattern.search(request.url)
+    if match:
+        return NOTICE_PAGE, match.group(1).lower()
+    match = darpa_list_url_pattern.search(request.url)
+    if match:
+        return DARPA_LIST_PAGE, match.group(1)
+    return None
+
+
+class NoticeCachePolicy(RFC2616Policy):
+    '''
+    Serves cached notice pages for FBO_HTTPCACHE_NOTICE_MAX_AGE seconds (unless the request
+    is marked with "refresh" in its meta) and cached darpa.mil listing pages for
+    FBO_HTTPCACHE_DARPA_MAX_AGE seconds without asking the server. Older entries are revalidated with If-Modified-Since / If-None-Match if the
+    server provided Last-Modified / ETag, and re-downloaded otherwise.
+    '''
+
+    def __init__(self, settings):
+        super(NoticeCachePolicy, self).__init__(settings)
+        self.max_age_by_kind = {
+            NOTICE_PAGE: settings.getint("FBO_HTTPCACHE_NOTICE_MAX_AGE", 7 * 24 * 3600),
+            DARPA_LIST_PAGE: settings.getint("FBO_HTTPCACHE_DARPA_MAX_AGE", 24 * 3600)
+        }
+
+    def should_cache_request(self, request):
+        return (request_cache_key(request) is not None
+                and super(NoticeCachePolicy, self).should_cache_request(request))
+
+    def should_cache_response(self, response, request):
+        # fbo.gov provides neither validators nor expiration, store all proper pages anyway
+        if response.status == 200:
+            return b"no-store" not in self._parse_cachecontrol(response)
+        return super(NoticeCachePolicy, self).should_cache_response(response, request)
+
+    def is_cached_response_fresh(self, cachedresponse, request):
+        # the spider sends "Cache-Control: no-cache" like a browser would, it is not honored here
+        kind = request_cache_key(request)[0]
+        stored = rfc1123_to_epoch(cachedresponse.headers.get(b"Date"))
+        # notices that changed since they were stored (see "refresh" in the spider) are always re-downloaded
+        if stored and time.time() - stored < self.max_age_by_kind[kind] and not request.meta.get("refresh"):
+            return True
+        self._set_conditional_validators(request, cachedresponse)
+        return False
+
+
+class NoticeCacheStorage(FilesystemCacheStorage):
+    '''
+    Filesystem cache storage keyed by notice id / darpa.mil page number, with a cap on
+    the total size (FBO_HTTPCACHE_MAX_BYTES): least recently used entries are evicted
+    first. Entries older than HTTPCACHE_EXPIRATION_SECS are removed when the spider opens.
+    '''
+    index_filename = "lru_index.json"
+
+    def __init__(self, settings):
+        super(NoticeCacheStorage, self).__init__(settings)
+        self.max_bytes = settings.getint("FBO_HTTPCACHE_MAX_BYTES", 512 * 1024 * 1024)
+        # entry path (relative to the spider's cache directory) ==> [size, last access time, body sha1]
+        self.entries = {}
+        self.total_bytes = 0
+        self.unchanged_count = 0
+
+    def _spider_dir(self, spider):
+        return os.path.join(self.cachedir, spider.name)
+
+    def _get_request_path(self, spider, request):
+        kind, key = request_cache_key(request)
+        return os.path.join(self._spider_dir(spider), kind, key)
+
+    def _entry_name(self, spider, rpath):
+        return os.path.relpath(rpath, self._spider_dir(spider))
+
+    def open_spider(self, spider):
+        super(NoticeCacheStorage, self).open_spider(spider)
+        index_path = os.path.join(self._spider_dir(spider), self.index_filename)
+        if os.path.isfile(index_path):
+            with open(index_path) as index_file:
+                self.entries = json.load(index_file)
+        else:
+            # rebuild from the cache directory
+            for kind in (NOTICE_PAGE, DARPA_LIST_PAGE):
+                kind_dir = os.path.join(self._spider_dir(spider), kind)
+                if not os.path.isdir(kind_dir):
+                    continue
+                for key in os.listdir(kind_dir):
+                    rpath = os.path.join(kind_dir, key)
+                    self.entries[self._entry_name(spider, rpath)] = [self._entry_size(rpath),
+                                                                     os.path.getmtime(rpath), None]
+        if self.expiration_secs > 0:
+            now = time.time()
+            for name in list(self.entries):
+                metapath = os.path.join(self._spider_dir(spider), name, "pickled_meta")
+                if not os.path.exists(metapath) or now - os.path.getmtime(metapath) > self.expiration_secs:
+                    self._evict(spider, name)
+        self.total_bytes = sum(entry[0] for entry in self.entries.values())
+
+    def close_spider(self, spider):
+        spider_dir = self._spider_dir(spider)
+        if not os.path.isdir(spider_dir):
+            os.makedirs(spider_dir)
+        with open(os.path.join(spider_dir, self.index_filename), "w") as index_file:
+            json.dump(self.entries, index_file)
+        logger.info("Response cache: %d entries, %.1f MB, %d pages re-downloaded unchanged",
+                    len(self.entries), self.total_bytes / (1024.0 * 1024.0), self.unchanged_count,
+                    extra = {"spider": spider})
+        super(NoticeCacheStorage, self).close_spider(spider)
+
+    @staticmethod
+    def _entry_size(rpath):
+        return sum(os.path.getsize(os.path.join(rpath, filename)) for filename in os.listdir(rpath))
+
+    def _evict(self, spider, name):
+        entry = self.entries.pop(name, None)
+        if entry is not None:
+            self.total_bytes -= entry[0]
+        shutil.rmtree(os.path.join(self._spider_dir(spider), name), ignore_errors = True)
+
+    def retrieve_response(self, spider, request):
+        response = super(NoticeCacheStorage, self).retrieve_response(spider, request)
+        if response is None:
+            return None
+        rpath = self._get_request_path(spider, request)
+        name = self._entry_name(spider, rpath)
+        if name in self.entries:
+            self.entries[name][1] = time.time()
+        if b"Date" not in response.headers:
+            # age of the entry is determined by the Date header, fall back to the time it was stored
+            response.headers[b"Date"] = formatdate(os.path.getmtime(os.path.join(rpath, "pickled_meta")),
+                                                  usegmt = True)
+        return response
+
+    def store_response(self, spider, request, response):
+        rpath = self._get_request_path(spider, request)
+        name = self._entry_name(spider, rpath)
+        body_hash = hashlib.sha1(response.body).hexdigest()
+        if name in self.entries and self.entries[name][2] == body_hash:
+            self.unchanged_count += 1
+        super(NoticeCacheStorage, self).store_response(spider, request, response)
+        size = self._entry_size(rpath)
+        if name in self.entries:
+            self.total_bytes -= self.entries[name][0]
+        self.entries[name] = [size, time.time(), body_hash]
+        self.total_bytes += size
+        if self.max_bytes > 0 and self.total_bytes > self.max_bytes:
+            # evict least recently used entries
+            for evicted_name in sorted(self.entries, key = lambda entry_name: self.entries[entry_name][1]):
+                if self.total_bytes <= self.max_bytes:
+                    break
+                if evicted_name != name:
+                    self._evict(spider, evicted_name)
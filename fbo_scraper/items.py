@@ -21,4 +21,6 @@ class Opportunity(scrapy.Item):
     check_office = scrapy.Field(serializer=bool)
     check_office_wide = scrapy.Field(serializer=bool)
     filtered = scrapy.Field(serializer=bool)
+    # hash of the notice's row in the fbo.gov list, changes when the notice is amended
+    fingerprint = scrapy.Field()
     
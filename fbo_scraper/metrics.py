@@ -0,0 +1,195 @@
+################################################################################
+#    @author: Greg Kramida (github id: Algomorph)
+# @copyright: (2015-2016) Gregory Kramida
+#   @license: Apache V2
+#            [That means (basically): feel free to modify, sell,
+#             whatever, just do not remove the original author's credits/notice
+#             from the files. For details, see LICENSE file.]
+################################################################################
+'''
+Timing of the crawl stages (download wait, notice parsing, database operations) and
+counters of notice outcomes, exported as json or as Prometheus text (see FBO_METRICS_* settings).
+'''
+import os
+import json
+import time
+import inspect
+import threading
+import logging
+import functools
+
+from twisted.internet import task
+from scrapy import signals
+from scrapy.exceptions import NotConfigured
+
+logger = logging.getLogger(__name__)
+
+
+class Metrics(object):
+    '''
+    Registry of stage timers (call count, total & maximum seconds) and counters.
+    Updated from both the reactor thread and the database writer thread.
+    '''
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            # stage name ==> [calls, total seconds, max seconds]
+            self.timers = {}
+            # counter name ==> value
+            self.counters = {}
+            self.start_time = time.time()
+
+    def add_time(self, stage, seconds):
+        with self.lock:
+            timer = self.timers.get(stage)
+            if timer is None:
+                self.timers[stage] = [1, seconds, seconds]
+            else:
+                timer[0] += 1
+                timer[1] += seconds
+                if seconds > timer[2]:
+                    timer[2] = seconds
+
+    def increment(self, counter, count = 1):
+        with self.lock:
+            self.counters[counter] = self.counters.get(counter, 0) + count
+
+    def snapshot(self):
+        '''
+        @return copies of the timers & the counters, taken together
+        '''
+        with self.lock:
+            return dict((stage, list(timer)) for stage, timer in self.timers.items()), dict(self.counters)
+
+    def to_dict(self):
+        timers, counters = self.snapshot()
+        return {
+            "elapsed_seconds": time.time() - self.start_time,
+            "stages": dict((stage, {"calls": timer[0], "seconds": timer[1], "max_seconds": timer[2]})
+                           for stage, timer in timers.items()),
+            "counters": counters
+        }
+
+    def to_prometheus(self, prefix = "fbo_scraper"):
+        timers, counters = self.snapshot()
+        lines = ["# TYPE " + prefix + "_elapsed_seconds gauge",
+                 prefix + "_elapsed_seconds %f" % (time.time() - self.start_time)]
+        for metric, index, kind in (("stage_calls_total", 0, "counter"), ("stage_seconds_total", 1, "counter"),
+                                    ("stage_seconds_max", 2, "gauge")):
+            lines.append("# TYPE " + prefix + "_" + metric + " " + kind)
+            for stage in sorted(timers):
+                lines.append(prefix + "_" + metric + "{stage=\"" + stage + "\"} " + repr(timers[stage][index]))
+        for counter in sorted(counters):
+            lines.append("# TYPE " + prefix + "_" + counter + "_total counter")
+            lines.append(prefix + "_" + counter + "_total " + str(counters[counter]))
+        return "\n".join(lines) + "\n"
+
+    def write(self, filename):
+        '''
+        Write the metrics to the file: Prometheus text format if it ends with .prom or .txt, json otherwise
+        '''
+        if filename.endswith((".prom", ".txt")):
+            text = self.to_prometheus()
+        else:
+            text = json.dumps(self.to_dict(), indent = 2, sort_keys = True)
+        temp_filename = filename + ".tmp"
+        with open(temp_filename, "w") as metrics_file:
+            metrics_file.write(text)
+        if os.name == "nt" and os.path.exists(filename):
+            # rename does not replace existing files on Windows
+            os.remove(filename)
+        os.rename(temp_filename, filename)
+
+    def summary(self):
+        timers, counters = self.snapshot()
+        lines = ["%-25s %10s %12s %12s" % ("stage", "calls", "seconds", "max seconds")]
+        for stage in sorted(timers, key = lambda stage: -timers[stage][1]):
+            calls, seconds, max_seconds = timers[stage]
+            lines.append("%-25s %10d %12.3f %12.3f" % (stage, calls, seconds, max_seconds))
+        for counter in sorted(counters):
+            lines.append("%-25s %10d" % (counter, counters[counter]))
+        return "\n".join(lines)
+
+
+# registry shared by the spider, the pipeline & the database helpers
+metrics = Metrics()
+
+
+def timed(stage):
+    '''
+    Decorator adding the time spent in the function to the given stage. For generator
+    functions (e.g. scrapy callbacks), only the time spent inside the generator is counted.
+    '''
+    def decorator(function):
+        if inspect.isgeneratorfunction(function):
+            @functools.wraps(function)
+            def generator_wrapper(*args, **kwargs):
+                seconds = 0.0
+                start = time.time()
+                try:
+                    for output in function(*args, **kwargs):
+                        seconds += time.time() - start
+                        yield output
+                        start = time.time()
+                    seconds += time.time() - start
+                finally:
+                    metrics.add_time(stage, seconds)
+            return generator_wrapper
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            start = time.time()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                metrics.add_time(stage, time.time() - start)
+        return wrapper
+    return decorator
+
+
+class MetricsExtension(object):
+    '''
+    Scrapy extension measuring the download wait (from when a request is scheduled until
+    its response is received) & writing the metrics to FBO_METRICS_FILE at close, and every
+    FBO_METRICS_INTERVAL seconds while crawling (if > 0)
+    '''
+    def __init__(self, filename, interval):
+        self.filename = filename
+        self.interval = interval
+        self.looping_call = None
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        filename = crawler.settings.get("FBO_METRICS_FILE")
+        if not filename:
+            raise NotConfigured
+        extension = cls(filename, crawler.settings.getfloat("FBO_METRICS_INTERVAL", 0.0))
+        crawler.signals.connect(extension.spider_opened, signal = signals.spider_opened)
+        crawler.signals.connect(extension.spider_closed, signal = signals.spider_closed)
+        crawler.signals.connect(extension.request_scheduled, signal = signals.request_scheduled)
+        crawler.signals.connect(extension.response_received, signal = signals.response_received)
+        return extension
+
+    def spider_opened(self, spider):
+        metrics.reset()
+        if self.interval > 0:
+            self.looping_call = task.LoopingCall(metrics.write, self.filename)
+            self.looping_call.start(self.interval, now = False)
+
+    def request_scheduled(self, request, spider):
+        request.meta.setdefault("metrics_scheduled_time", time.time())
+
+    def response_received(self, response, request, spider):
+        scheduled_time = request.meta.get("metrics_scheduled_time")
+        if scheduled_time is not None:
+            metrics.add_time("download_wait", time.time() - scheduled_time)
+
+    def spider_closed(self, spider):
+        if self.looping_call is not None and self.looping_call.running:
+            self.looping_call.stop()
+        metrics.write(self.filename)
+        logger.info("Crawl metrics (written to %s):\n%s", self.filename, metrics.summary(),
+                    extra = {"spider": spider})
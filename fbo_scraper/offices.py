@@ -0,0 +1,176 @@
+################################################################################
+#    @author: Greg Kramida (github id: Algomorph)
+# @copyright: (2015-2016) Gregory Kramida
+#   @license: Apache V2
+#            [That means (basically): feel free to modify, sell,
+#             whatever, just do not remove the original author's credits/notice
+#             from the files. For details, see LICENSE file.]
+################################################################################
+'''
+Persisted index of the offices of darpa.mil announcements, used to fill in the office
+of fbo.gov notices: matched by solicitation number (when the announcement title has one),
+by normalized title, or by the overlap of title words.
+'''
+import os
+import re
+import json
+
+from fbo_scraper.db.index import normalize_key
+from fbo_scraper.metrics import metrics
+
+# DARPA solicitation numbers, e.g. HR001116S0001, HR0011-16-S-0001 or DARPA-BAA-16-01
+solicitation_number_pattern = re.compile(r"\b(?:[A-Z]{2}\d{4}[\s\-]?\d{2}[\s\-]?[A-Z][\s\-]?\d{4}"
+                                         + r"|DARPA[\s\-][A-Z]{2,4}[\s\-]\d{2}[\s\-]\d{2,3})\b", re.IGNORECASE)
+non_word_pattern = re.compile(r"[\W_]+", re.UNICODE)
+# words that say nothing about which announcement a title is for
+stop_words = frozenset(["a", "an", "and", "for", "in", "of", "on", "or", "the", "to", "with",
+                        "darpa", "baa", "broad", "agency", "announcement", "program"])
+
+
+def _unicode(text):
+    if isinstance(text, str):
+        return text.decode("utf8", "replace")
+    return unicode(text)
+
+
+def normalize_title(title):
+    return non_word_pattern.sub(u" ", _unicode(title).lower()).strip()
+
+
+def normalize_number(number):
+    return non_word_pattern.sub(u"", normalize_key(number).upper())
+
+
+def title_tokens(title):
+    '''
+    @return set of the significant words of the title (solicitation numbers are matched separately)
+    '''
+    words = normalize_title(solicitation_number_pattern.sub(u" ", _unicode(title))).split()
+    return frozenset(word for word in words if len(word) > 1 and word not in stop_words)
+
+
+class OfficeIndex(object):
+    '''
+    Announcement title ==> office, with lookups by solicitation number, normalized title & title
+    words precomputed as entries are added. Saved as json (replaced atomically).
+    '''
+    # minimum share of title words (intersection over union) for a word-based match
+    min_similarity = 0.6
+
+    def __init__(self, filename = None):
+        '''
+        @param filename json file to load the index from & save it to, None to keep it in memory only
+        '''
+        self.filename = filename
+        # normalized title ==> (title, office)
+        self.entries = {}
+        # normalized solicitation number ==> normalized title
+        self.by_number = {}
+        # normalized title ==> words of the title
+        self.tokens = {}
+        # word ==> set of normalized titles with that word
+        self.by_token = {}
+        # whether there are entries that were added or changed since the index was loaded / saved
+        self.changed = False
+
+    def __len__(self):
+        return len(self.entries)
+
+    def load(self):
+        '''
+        @return True if the index file was loaded, False if there is none (or it is unreadable)
+        '''
+        if self.filename is None or not os.path.isfile(self.filename):
+            return False
+        try:
+            with open(self.filename, "rb") as index_file:
+                offices = json.load(index_file)["offices"]
+        except (IOError, ValueError, KeyError) as error:
+            print "===> Could not read office index " + self.filename + ": " + repr(error)
+            return False
+        self.update(offices)
+        self.changed = False
+        return True
+
+    def save(self):
+        if self.filename is None:
+            return
+        temp_filename = self.filename + ".tmp"
+        with open(temp_filename, "wb") as index_file:
+            json.dump({"offices": self.offices()}, index_file, indent = 1, sort_keys = True)
+        if os.name == "nt" and os.path.exists(self.filename):
+            # rename does not replace existing files on Windows
+            os.remove(self.filename)
+        os.rename(temp_filename, self.filename)
+        self.changed = False
+
+    def offices(self):
+        '''
+        @return dictionary announcement title ==> office
+        '''
+        return dict(self.entries.values())
+
+    def add(self, title, office):
+        '''
+        @return True if the announcement is new or its office changed
+        '''
+        key = normalize_title(title)
+        if key == u"":
+            return False
+        entry = self.entries.get(key)
+        if entry is not None and entry[1] == office:
+            return False
+        self.entries[key] = (_unicode(title), office)
+        if entry is None:
+            for number in solicitation_number_pattern.findall(title):
+                self.by_number[normalize_number(number)] = key
+            tokens = title_tokens(title)
+            self.tokens[key] = tokens
+            for token in tokens:
+                self.by_token.setdefault(token, set()).add(key)
+        self.changed = True
+        return True
+
+    def update(self, offices):
+        '''
+        @param offices dictionary announcement title ==> office
+        '''
+        for title, office in offices.items():
+            self.add(title, office)
+
+    def lookup(self, sponsor_number, title = None):
+        '''
+        Find the office for a notice
+        @param sponsor_number solicitation number of the notice
+        @param title title of the notice
+        @return the office, None if there is no (unambiguous) match
+        '''
+        key = self.by_number.get(normalize_number(sponsor_number))
+        if key is not None:
+            metrics.increment("offices_matched_number")
+            return self.entries[key][1]
+        if title is None:
+            return None
+        key = normalize_title(title)
+        if key in self.entries:
+            metrics.increment("offices_matched_title")
+            return self.entries[key][1]
+        # the titles sharing the most words with the notice's title
+        tokens = title_tokens(title)
+        overlaps = {}
+        for token in tokens:
+            for candidate in self.by_token.get(token, ()):
+                overlaps[candidate] = overlaps.get(candidate, 0) + 1
+        best_similarity = 0.0
+        best_offices = set()
+        for candidate, overlap in overlaps.items():
+            similarity = float(overlap) / (len(tokens) + len(self.tokens[candidate]) - overlap)
+            if similarity > best_similarity:
+                best_similarity = similarity
+                best_offices = set([self.entries[candidate][1]])
+            elif similarity == best_similarity:
+                best_offices.add(self.entries[candidate][1])
+        if best_similarity >= OfficeIndex.min_similarity and len(best_offices) == 1:
+            metrics.increment("offices_matched_tokens")
+            return best_offices.pop()
+        return None
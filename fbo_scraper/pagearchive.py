@@ -0,0 +1,438 @@
+################################################################################
+#    @author: Greg Kramida (github id: Algomorph)
+# @copyright: (2015-2016) Gregory Kramida
+#   @license: Apache V2
+#            [That means (basically): feel free to modify, sell,
+#             whatever, just do not remove the original author's credits/notice
+#             from the files. For details, see LICENSE file.]
+################################################################################
+'''
+Append-only archive of the fbo.gov notice pages & darpa.mil listing pages the spider
+fetched (FBO_PAGE_ARCHIVE), so that historical notices can be audited or re-parsed
+after they are gone from fbo.gov.
+
+Pages are appended in zlib-compressed chunks of about FBO_PAGE_ARCHIVE_CHUNK_SIZE bytes.
+Each chunk is self-describing (kind, key, url, fetch time & status of each of its pages),
+and <archive>.index.sqlite maps (kind, key, fetch time) to the chunk & the position of
+the page within it. Readers memory-map the archive & only decompress the chunk of the
+page they ask for. Pages that did not change since they were last archived are not
+stored again.
+
+Look at the archive from root directory (top-level fbo_scraper folder) like this:
+    python -m fbo_scraper.pagearchive list fbo_pages.archive
+    python -m fbo_scraper.pagearchive get fbo_pages.archive notice <notice id> > notice.html
+    python -m fbo_scraper.pagearchive reindex fbo_pages.archive
+and replay it with python -m fbo_scraper.replay fbo_pages.archive
+'''
+import os
+import sys
+import mmap
+import json
+import time
+import zlib
+import struct
+import sqlite3
+import hashlib
+import logging
+import argparse
+
+from scrapy import signals
+from scrapy.exceptions import NotConfigured
+
+from fbo_scraper.httpcache import request_cache_key
+from fbo_scraper.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# chunk header: magic, compressed length, uncompressed length, page count
+chunk_header_format = "<8sIII"
+chunk_header_size = struct.calcsize(chunk_header_format)
+chunk_magic = b"FBOPAGES"
+# page header within a chunk: length of the json metadata, length of the body
+page_header_format = "<II"
+page_header_size = struct.calcsize(page_header_format)
+
+
+def index_filename(archive_filename):
+    return archive_filename + ".index.sqlite"
+
+
+def is_page_archive(filename):
+    '''
+    @return True if the file starts with a page archive chunk
+    '''
+    if not os.path.isfile(filename):
+        return False
+    with open(filename, "rb") as archive_file:
+        return archive_file.read(len(chunk_magic)) == chunk_magic
+
+
+def open_index(filename):
+    connection = sqlite3.connect(filename, check_same_thread = False)
+    connection.execute("PRAGMA journal_mode=WAL")
+    connection.execute("CREATE TABLE IF NOT EXISTS pages (kind TEXT, key TEXT, fetch_time REAL, url TEXT, "
+                       + "status INTEGER, sha1 TEXT, chunk_offset INTEGER, page_offset INTEGER, "
+                       + "length INTEGER, PRIMARY KEY (kind, key, fetch_time))")
+    return connection
+
+
+def pack_chunk(pages, compression_level = 6):
+    '''
+    @param pages list of (metadata dictionary, body) tuples
+    @return (chunk bytes, list of (page offset, body length) within the uncompressed chunk)
+    '''
+    parts = []
+    positions = []
+    offset = 0
+    for metadata, body in pages:
+        metadata_json = json.dumps(metadata, sort_keys = True)
+        parts.append(struct.pack(page_header_format, len(metadata_json), len(body)))
+        parts.append(metadata_json)
+        parts.append(body)
+        offset += page_header_size + len(metadata_json)
+        positions.append((offset, len(body)))
+        offset += len(body)
+    payload = b"".join(parts)
+    compressed = zlib.compress(payload, compression_level)
+    return struct.pack(chunk_header_format, chunk_magic, len(compressed), len(payload), len(pages)) + compressed, positions
+
+
+def unpack_chunk(payload):
+    '''
+    @param payload uncompressed chunk
+    @return generator of (metadata dictionary, page offset, body length)
+    '''
+    offset = 0
+    while offset < len(payload):
+        metadata_length, body_length = struct.unpack_from(page_header_format, payload, offset)
+        offset += page_header_size
+        metadata = json.loads(payload[offset:offset + metadata_length])
+        offset += metadata_length
+        yield metadata, offset, body_length
+        offset += body_length
+
+
+def read_chunk(data, chunk_offset):
+    '''
+    @param data the archive, or a memory map of it
+    @return (uncompressed chunk, page count, offset of the next chunk)
+    @raise ValueError if there is no complete chunk at the offset
+    '''
+    start = chunk_offset + chunk_header_size
+    if start > len(data):
+        raise ValueError("Incomplete page archive chunk header at offset " + str(chunk_offset))
+    magic, compressed_length, length, page_count = struct.unpack_from(chunk_header_format, data, chunk_offset)
+    if magic != chunk_magic or start + compressed_length > len(data):
+        raise ValueError("No complete page archive chunk at offset " + str(chunk_offset))
+    try:
+        payload = zlib.decompress(data[start:start + compressed_length])
+    except zlib.error as error:
+        raise ValueError("Corrupt page archive chunk at offset " + str(chunk_offset) + ": " + str(error))
+    if len(payload) != length:
+        raise ValueError("Corrupt page archive chunk at offset " + str(chunk_offset))
+    return payload, page_count, start + compressed_length
+
+
+def index_rows(payload, chunk_offset):
+    '''
+    @return index rows for the pages of an uncompressed chunk
+    '''
+    return [(metadata["kind"], metadata["key"], metadata["fetch_time"], metadata["url"], metadata["status"],
+             metadata["sha1"], chunk_offset, page_offset, length)
+            for metadata, page_offset, length in unpack_chunk(payload)]
+
+
+def scan_chunks(data, chunk_offset = 0):
+    '''
+    @return generator of (chunk offset, uncompressed chunk, offset of the next chunk)
+    of the complete chunks from the offset on
+    '''
+    while chunk_offset < len(data):
+        try:
+            payload, _, next_offset = read_chunk(data, chunk_offset)
+        except ValueError:
+            logger.warning("Page archive ends with an incomplete chunk at offset %d", chunk_offset)
+            return
+        yield chunk_offset, payload, next_offset
+        chunk_offset = next_offset
+
+
+class PageArchiveWriter(object):
+    '''
+    Appends pages to the archive, a chunk at a time, & records them in the index
+    '''
+    def __init__(self, filename, chunk_size = 256 * 1024, compression_level = 6):
+        '''
+        @param filename archive file (created if it does not exist)
+        @param chunk_size pages are buffered until they add up to this many bytes, then compressed together
+        '''
+        self.filename = filename
+        self.chunk_size = chunk_size
+        self.compression_level = compression_level
+        self.index = open_index(index_filename(filename))
+        if os.path.isfile(filename) and os.path.getsize(filename) > 0:
+            self._recover()
+        self.archive_file = open(filename, "ab")
+        self.pending = []
+        self.pending_bytes = 0
+        # (kind, key) ==> sha1 of the latest archived body, to skip unchanged pages
+        self.latest_hashes = {}
+        for kind, key, sha1 in self.index.execute("SELECT kind, key, sha1 FROM pages ORDER BY fetch_time"):
+            self.latest_hashes[(kind, key)] = sha1
+        self.page_count = 0
+        self.unchanged_count = 0
+
+    def _recover(self):
+        '''
+        Index the chunks written after the last indexed one (if the crawl died before the index was
+        committed) & cut off an incomplete chunk at the end of the archive
+        '''
+        last_offset = self.index.execute("SELECT MAX(chunk_offset) FROM pages").fetchone()[0]
+        rows = []
+        with open(self.filename, "rb") as archive_file:
+            data = mmap.mmap(archive_file.fileno(), 0, access = mmap.ACCESS_READ)
+            try:
+                end = 0 if last_offset is None else read_chunk(data, last_offset)[2]
+                for chunk_offset, payload, end in scan_chunks(data, end):
+                    rows.extend(index_rows(payload, chunk_offset))
+                size = len(data)
+            finally:
+                data.close()
+        if len(rows) > 0:
+            self.index.executemany("INSERT OR REPLACE INTO pages VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+            self.index.commit()
+        if end < size:
+            with open(self.filename, "r+b") as archive_file:
+                archive_file.truncate(end)
+
+    def add(self, kind, key, url, body, status = 200, fetch_time = None):
+        '''
+        @return True if the page was archived, False if it is unchanged since the last time
+        '''
+        sha1 = hashlib.sha1(body).hexdigest()
+        if self.latest_hashes.get((kind, key)) == sha1:
+            self.unchanged_count += 1
+            metrics.increment("pages_archive_unchanged")
+            return False
+        self.latest_hashes[(kind, key)] = sha1
+        metadata = {"kind": kind, "key": key, "url": url, "status": status, "sha1": sha1,
+                    "fetch_time": fetch_time if fetch_time is not None else time.time()}
+        self.pending.append((metadata, body))
+        self.pending_bytes += len(body)
+        self.page_count += 1
+        metrics.increment("pages_archived")
+        if self.pending_bytes >= self.chunk_size:
+            self.flush()
+        return True
+
+    def flush(self):
+        if len(self.pending) == 0:
+            return
+        chunk, positions = pack_chunk(self.pending, self.compression_level)
+        chunk_offset = self.archive_file.tell()
+        self.archive_file.write(chunk)
+        self.archive_file.flush()
+        # the index only points to chunks that were written completely
+        self.index.executemany("INSERT OR REPLACE INTO pages VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                               [(metadata["kind"], metadata["key"], metadata["fetch_time"], metadata["url"],
+                                 metadata["status"], metadata["sha1"], chunk_offset, page_offset, length)
+                                for (metadata, _), (page_offset, length) in zip(self.pending, positions)])
+        self.index.commit()
+        self.pending = []
+        self.pending_bytes = 0
+
+    def close(self):
+        self.flush()
+        self.archive_file.close()
+        self.index.close()
+
+
+class PageArchiveReader(object):
+    '''
+    Random access to archived pages through a memory map of the archive
+    '''
+    columns = "kind, key, fetch_time, url, status, sha1, chunk_offset, page_offset, length"
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.archive_file = open(filename, "rb")
+        self.map = b""
+        self._map()
+        self.index = open_index(index_filename(filename))
+        # most recently decompressed chunk: (chunk offset, payload), pages of a chunk are often read together
+        self.last_chunk = (None, None)
+
+    def _map(self):
+        size = os.fstat(self.archive_file.fileno()).st_size
+        if len(self.map) == size:
+            return
+        if isinstance(self.map, mmap.mmap):
+            self.map.close()
+        # mmap refuses empty files
+        self.map = mmap.mmap(self.archive_file.fileno(), 0, access = mmap.ACCESS_READ) if size > 0 else b""
+
+    def _payload(self, chunk_offset):
+        '''
+        @return uncompressed chunk at the offset
+        '''
+        if chunk_offset == self.last_chunk[0]:
+            return self.last_chunk[1]
+        try:
+            payload = read_chunk(self.map, chunk_offset)[0]
+        except ValueError:
+            # the archive may have grown since it was mapped
+            self._map()
+            payload = read_chunk(self.map, chunk_offset)[0]
+        self.last_chunk = (chunk_offset, payload)
+        return payload
+
+    def get(self, kind, key, fetch_time = None):
+        '''
+        @param fetch_time time the page was fetched at, None for the latest version
+        @return (metadata dictionary, body), None if the page is not in the archive
+        '''
+        query = "SELECT " + self.columns + " FROM pages WHERE kind = ? AND key = ?"
+        if fetch_time is None:
+            row = self.index.execute(query + " ORDER BY fetch_time DESC LIMIT 1", (kind, key)).fetchone()
+        else:
+            row = self.index.execute(query + " AND fetch_time = ?", (kind, key, fetch_time)).fetchone()
+        if row is None:
+            return None
+        return self._page(row)
+
+    def _page(self, row):
+        kind, key, fetch_time, url, status, sha1, chunk_offset, page_offset, length = row
+        payload = self._payload(chunk_offset)
+        metadata = {"kind": kind, "key": key, "url": url, "status": status, "fetch_time": fetch_time, "sha1": sha1}
+        return metadata, payload[page_offset:page_offset + length]
+
+    def latest(self):
+        '''
+        @return generator of (metadata dictionary, body) of the latest version of each archived page, in archive order
+        '''
+        # sqlite takes the other columns from the row with the maximum
+        rows = self.index.execute("SELECT kind, key, MAX(fetch_time), url, status, sha1, chunk_offset, page_offset, "
+                                  + "length FROM pages GROUP BY kind, key ORDER BY chunk_offset, page_offset").fetchall()
+        for row in rows:
+            yield self._page(row)
+
+    def versions(self, kind, key):
+        '''
+        @return list of the fetch times of the archived versions of a page, oldest first
+        '''
+        return [row[0] for row in self.index.execute("SELECT fetch_time FROM pages WHERE kind = ? AND key = ? "
+                                                     + "ORDER BY fetch_time", (kind, key))]
+
+    def entries(self):
+        '''
+        @return generator of (kind, key, fetch time, url) of all archived pages, in archive order
+        '''
+        return self.index.execute("SELECT kind, key, fetch_time, url FROM pages ORDER BY chunk_offset, page_offset")
+
+    def __iter__(self):
+        '''
+        Go through all complete chunks of the archive, without the index
+        @return generator of (metadata dictionary, body)
+        '''
+        self._map()
+        for _, payload, _ in scan_chunks(self.map):
+            for metadata, page_offset, length in unpack_chunk(payload):
+                yield metadata, payload[page_offset:page_offset + length]
+
+    def reindex(self):
+        '''
+        Rebuild the index from the chunks of the archive
+        @return number of pages indexed
+        '''
+        self._map()
+        rows = []
+        for chunk_offset, payload, _ in scan_chunks(self.map):
+            rows.extend(index_rows(payload, chunk_offset))
+        self.index.execute("DELETE FROM pages")
+        self.index.executemany("INSERT OR REPLACE INTO pages VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+        self.index.commit()
+        return len(rows)
+
+    def close(self):
+        if isinstance(self.map, mmap.mmap):
+            self.map.close()
+        self.archive_file.close()
+        self.index.close()
+
+
+class PageArchiveMiddleware(object):
+    '''
+    Downloader middleware appending the notice pages & darpa.mil listing pages downloaded
+    by the spider (not those served from the http cache) to the page archive
+    '''
+    def __init__(self, filename, chunk_size):
+        self.filename = filename
+        self.chunk_size = chunk_size
+        self.writer = None
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        filename = crawler.settings.get("FBO_PAGE_ARCHIVE")
+        if not filename:
+            raise NotConfigured
+        middleware = cls(filename, crawler.settings.getint("FBO_PAGE_ARCHIVE_CHUNK_SIZE", 256 * 1024))
+        crawler.signals.connect(middleware.spider_opened, signal = signals.spider_opened)
+        crawler.signals.connect(middleware.spider_closed, signal = signals.spider_closed)
+        return middleware
+
+    def spider_opened(self, spider):
+        self.writer = PageArchiveWriter(self.filename, self.chunk_size)
+
+    def spider_closed(self, spider):
+        if self.writer is None:
+            return
+        self.writer.close()
+        logger.info("Page archive %s: %d pages archived, %d unchanged pages skipped",
+                    self.filename, self.writer.page_count, self.writer.unchanged_count,
+                    extra = {"spider": spider})
+        self.writer = None
+
+    def process_response(self, request, response, spider):
+        if self.writer is None or response.status != 200 or "cached" in response.flags:
+            return response
+        cache_key = request_cache_key(request)
+        if cache_key is not None:
+            self.writer.add(cache_key[0], cache_key[1], response.url, response.body, response.status)
+        return response
+
+
+def main():
+    parser = argparse.ArgumentParser(description = "Look up pages in the archive of fetched notice & listing pages.")
+    subparsers = parser.add_subparsers(dest = "command")
+    list_parser = subparsers.add_parser("list", help = "list the archived pages")
+    list_parser.add_argument("archive")
+    get_parser = subparsers.add_parser("get", help = "write an archived page to standard output")
+    get_parser.add_argument("archive")
+    get_parser.add_argument("kind", choices = ["notice", "darpa"], help = "notice page or darpa.mil listing page")
+    get_parser.add_argument("key", help = "notice id or darpa.mil listing page number")
+    get_parser.add_argument("-t", "--fetch_time", type = float, default = None,
+                            help = "fetch time of the version to get (see list), defaults to the latest")
+    reindex_parser = subparsers.add_parser("reindex", help = "rebuild the index from the archive")
+    reindex_parser.add_argument("archive")
+    args = parser.parse_args()
+
+    reader = PageArchiveReader(args.archive)
+    try:
+        if args.command == "list":
+            for kind, key, fetch_time, url in reader.entries():
+                print "%s\t%s\t%.3f\t%s\t%s" % (kind, key, fetch_time,
+                                                time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(fetch_time)), url)
+        elif args.command == "get":
+            page = reader.get(args.kind, args.key, args.fetch_time)
+            if page is None:
+                print >> sys.stderr, "No such page in " + args.archive
+                return 1
+            sys.stdout.write(page[1])
+        else:
+            print "Indexed " + str(reader.reindex()) + " pages"
+    finally:
+        reader.close()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -6,23 +6,158 @@
 # See: http://doc.scrapy.org/en/latest/topics/item-pipeline.html
 
 
+import threading
+import multiprocessing
+
+from twisted.internet import reactor, defer
+
+from fbo_scraper.extraction import normalize_synopsis, office_wide_pattern
+from fbo_scraper.metrics import metrics
 from fbo_scraper.db.pdexcel import PandasExcelHelper
+from fbo_scraper.db.sqlitedb import SqliteHelper
+from fbo_scraper.db.writer import BackgroundWriter
+from fbo_scraper.db.bloom import ArchiveIndex
+
+def _normalize_synopsis_in_pool(synopsis):
+    '''
+    @return (normalized synopsis, None), or (None, error message) if normalizing failed
+    (python 2 pools have no error callback, so errors are passed back as results)
+    '''
+    try:
+        return normalize_synopsis(synopsis), None
+    except Exception as error:
+        return None, repr(error)
+
+
+class SynopsisPipeline(object):
+    '''
+    Normalizes the synopses of notices with huge descriptions (which the spider leaves as lists
+    of text fragments) on a process pool, so that downloads continue while they are cleaned
+    '''
+    
+    def __init__(self, size_threshold = 100000, processes = 2):
+        self.size_threshold = size_threshold
+        self.processes = processes
+        self.pool = None
+        
+    @classmethod
+    def from_crawler(cls, crawler):
+        return cls(size_threshold = crawler.settings.getint("FBO_SYNOPSIS_POOL_THRESHOLD", 100000),
+                   processes = crawler.settings.getint("FBO_SYNOPSIS_POOL_PROCESSES", 2))
+        
+    def open_spider(self, spider):
+        if(self.size_threshold > 0 and self.processes > 0):
+            self.pool = multiprocessing.Pool(self.processes)
+            spider.synopsis_pool_threshold = self.size_threshold
+            
+    def process_item(self, item, spider):
+        if(not isinstance(item.get("synopsis"), list)):
+            return item
+        metrics.increment("synopses_pooled")
+        # the item continues once the pool's result thread hands the synopsis back to the reactor
+        deferred = defer.Deferred()
+        self.pool.apply_async(_normalize_synopsis_in_pool, (item["synopsis"],),
+                              callback = lambda result: reactor.callFromThread(self._synopsis_done, deferred, result))
+        return deferred.addCallback(self.set_synopsis, item)
+    
+    @staticmethod
+    def _synopsis_done(deferred, result):
+        synopsis, error = result
+        if(error is not None):
+            deferred.errback(RuntimeError("Failed to normalize synopsis: " + error))
+        else:
+            deferred.callback(synopsis)
+    
+    @staticmethod
+    def set_synopsis(synopsis, item):
+        item["synopsis"] = synopsis
+        # check for "Office-Wide" in the synopsis
+        if(office_wide_pattern.search(synopsis)):
+            item["check_office_wide"] = True
+        return item
+    
+    def close_spider(self, spider):
+        if(self.pool is not None):
+            self.pool.close()
+            self.pool.join()
+
 
 class FboScraperExcelPipeline(object):
     
     
-    def __init__(self, db_filename = "fbo_notice_database.xlsx", sol_sheet_name = "Notices"):
-        self.db = PandasExcelHelper()
+    def __init__(self, db_backend = "sqlite", writer_thread = True, writer_queue_size = 1000,
+                 archive_index = None, text_index = True, delta_report = True, report_deadline_days = 14):
+        # sponsor numbers of archived databases, also skipped as already scraped
+        self.archive = ArchiveIndex(archive_index) if archive_index else None
+        if(db_backend == "sqlite"):
+            # notices are appended to a journaled database, excel is exported at close
+            self.db = SqliteHelper(archive = self.archive, text_index = text_index, delta_report = delta_report,
+                                   report_deadline_days = report_deadline_days)
+        elif(db_backend == "excel"):
+            self.db = PandasExcelHelper(archive = self.archive, text_index = text_index, delta_report = delta_report,
+                                        report_deadline_days = report_deadline_days)
+        else:
+            raise ValueError("FBO_DB_BACKEND can be \"sqlite\" or \"excel\". Got: " + str(db_backend))
+        if(writer_thread):
+            # items are written to the database on a separate thread, so that saves don't stall the crawl
+            self.writer = BackgroundWriter(self.db, writer_queue_size)
+        else:
+            self.writer = None
+        # notice page urls saved by the writer thread, not yet passed on to the spider
+        self.saved_urls = []
+        self.saved_lock = threading.Lock()
+        
+    @classmethod
+    def from_crawler(cls, crawler):
+        return cls(db_backend = crawler.settings.get("FBO_DB_BACKEND", "sqlite"),
+                   writer_thread = crawler.settings.getbool("FBO_DB_WRITER_THREAD", True),
+                   writer_queue_size = crawler.settings.getint("FBO_DB_WRITER_QUEUE_SIZE", 1000),
+                   archive_index = crawler.settings.get("FBO_ARCHIVE_INDEX"),
+                   text_index = crawler.settings.getbool("FBO_TEXT_INDEX", True),
+                   delta_report = crawler.settings.getbool("FBO_DELTA_REPORT", True),
+                   report_deadline_days = crawler.settings.getint("FBO_REPORT_DEADLINE_DAYS", 14))
         
     def open_spider(self, spider):
-        #share database with the spider
-        spider.db = self.db
+        #share database with the spider (through the writer, which also knows the queued items)
+        spider.db = self.writer if self.writer is not None else self.db
+        # notices stay pending in the crawl checkpoint until the database has saved them
+        if(self.writer is not None):
+            self.db.on_save = lambda urls: self._saved_on_writer_thread(urls, spider)
+        else:
+            self.db.on_save = spider.notices_saved
         
     def process_item(self, item, spider):
-        self.db.add_item(item)
-        return item
+        if(self.writer is None):
+            self.db.add_item(item)
+            return item
+        queued = self.writer.submit(dict(item))
+        if(queued is None):
+            return item
+        # the queue is full: the item (and, through scrapy's limit on items in progress,
+        # the crawl) is held up until the writer thread makes room for it
+        return queued.addCallback(lambda _: item)
+
+    def _saved_on_writer_thread(self, urls, spider):
+        with self.saved_lock:
+            self.saved_urls.extend(urls)
+        reactor.callFromThread(self._pass_saved_urls, spider)
+        
+    def _pass_saved_urls(self, spider):
+        with self.saved_lock:
+            urls = self.saved_urls
+            self.saved_urls = []
+        if(len(urls) > 0):
+            spider.notices_saved(urls)
 
     def close_spider(self, spider):
+        if(self.writer is not None):
+            self.writer.close()
+            # the writer thread is done: pass on what it saved & do the final save on this thread
+            # (before the spider is closed)
+            self._pass_saved_urls(spider)
+            self.db.on_save = spider.notices_saved
         self.db.generate_report()
-        self.db.save_all()
-        
\ No newline at end of file
+        self.db.close()
+        if(self.archive is not None):
+            self.archive.close()
+        
@@ -0,0 +1,251 @@
+################################################################################
+#    @author: Greg Kramida (github id: Algomorph)
+# @copyright: (2015-2016) Gregory Kramida
+#   @license: Apache V2
+#            [That means (basically): feel free to modify, sell,
+#             whatever, just do not remove the original author's credits/notice
+#             from the files. For details, see LICENSE file.]
+################################################################################
+'''
+Offline replay: runs saved darpa.mil listing pages, fbo.gov list pages and fbo.gov
+notice pages through the parsing code of FboDarpaSpider, without any network access,
+and stores the resulting notices in the database.
+
+Run from root directory (top-level fbo_scraper folder) like this:
+    python -m fbo_scraper.replay <directory or .zip/.tar/.tar.gz archive with pages>
+or, for the pages archived by the spider (see pagearchive.py):
+    python -m fbo_scraper.replay fbo_pages.archive
+'''
+import os
+import re
+import sys
+import time
+import zipfile
+import tarfile
+import argparse
+import itertools
+import multiprocessing
+
+from scrapy.http import HtmlResponse
+
+from fbo_scraper.items import Opportunity
+from fbo_scraper.spiders.fbo_darpa_spider import FboDarpaSpider
+from fbo_scraper.db.pdexcel import PandasExcelHelper
+from fbo_scraper.db.sqlitedb import SqliteHelper
+from fbo_scraper.pagearchive import PageArchiveReader, is_page_archive
+
+DARPA_LIST_PAGE = "darpa_list"
+FBO_LIST_PAGE = "fbo_list"
+FBO_NOTICE_PAGE = "fbo_notice"
+
+page_extensions = (".html", ".htm")
+# number of notice pages handed to the worker pool at a time
+# (keeps the pages read from the source but not yet parsed out of memory)
+replay_batch_size = 2048
+notice_id_pattern = re.compile(r"(?:id=)?([0-9a-f]{32})")
+darpa_page_num_pattern = re.compile(r"PP[=_]?(\d+)")
+
+
+class NothingStored(object):
+    '''
+    Stand-in for the database in the replay workers: every notice is parsed,
+    deduplication is done by the main process.
+    '''
+    def contains(self, key):
+        return False
+
+
+def classify_page(body):
+    '''
+    Determine the kind of a saved page from its markup
+    @return one of DARPA_LIST_PAGE, FBO_LIST_PAGE, FBO_NOTICE_PAGE, or None if unrecognized
+    '''
+    if "listing__link" in body:
+        return DARPA_LIST_PAGE
+    if "lst-lnk-notice" in body:
+        return FBO_LIST_PAGE
+    if "procurement_notice__solicitation_number__widget" in body or "agency-header-w" in body:
+        return FBO_NOTICE_PAGE
+    return None
+
+
+def page_url(name, kind):
+    '''
+    Reconstruct the url a page was retrieved from, based on its file name
+    (the spider needs it to know which darpa.mil page it is on, and stores it for notices)
+    '''
+    if kind == DARPA_LIST_PAGE:
+        match = darpa_page_num_pattern.search(name)
+        return (FboDarpaSpider.darpa_index_url + "/work-with-us/opportunities?ppl=viewall&PP="
+                + (match.group(1) if match else "0"))
+    if kind == FBO_NOTICE_PAGE:
+        match = notice_id_pattern.search(os.path.basename(name))
+        if match:
+            return (FboDarpaSpider.fbo_index_url + "?s=opportunity&mode=form&id=" + match.group(1)
+                    + "&tab=core&_cview=1")
+    return FboDarpaSpider.fbo_index_url + "?s=opportunity&mode=list&tab=list&tabmode=list"
+
+
+def iter_pages(source):
+    '''
+    Go through the saved pages in a directory (recursively), in a .zip/.tar(.gz/.bz2) archive
+    or in a page archive (only the latest version of each page)
+    @return generator of (name, url, body) tuples, url is None if it is not known
+    '''
+    if is_page_archive(source):
+        reader = PageArchiveReader(source)
+        for metadata, body in reader.latest():
+            yield metadata["kind"] + "/" + metadata["key"], metadata["url"], body
+        reader.close()
+    elif os.path.isdir(source):
+        for dir_path, _, filenames in os.walk(source):
+            for filename in sorted(filenames):
+                if filename.lower().endswith(page_extensions):
+                    path = os.path.join(dir_path, filename)
+                    with open(path, "rb") as page_file:
+                        yield path, None, page_file.read()
+    elif zipfile.is_zipfile(source):
+        archive = zipfile.ZipFile(source)
+        for name in archive.namelist():
+            if name.lower().endswith(page_extensions):
+                yield name, None, archive.read(name)
+        archive.close()
+    elif tarfile.is_tarfile(source):
+        archive = tarfile.open(source)
+        for member in archive:
+            if member.isfile() and member.name.lower().endswith(page_extensions):
+                yield member.name, None, archive.extractfile(member).read()
+        archive.close()
+    else:
+        raise ValueError("Replay source has to be a directory, a .zip/.tar archive or a page archive, got: " + source)
+
+
+def make_response(name, url, body, kind):
+    return HtmlResponse(url = url or page_url(name, kind), body = body)
+
+
+def make_spider(spider_kwargs, office_index, db):
+    spider = FboDarpaSpider(**spider_kwargs)
+    if office_index is not None:
+        # offices from the darpa.mil listing pages replayed by the main process
+        spider.office_index = office_index
+    spider.db = db
+    return spider
+
+# spider used by the current worker process
+_worker_spider = None
+
+def _init_worker(spider_kwargs, office_index, verbose):
+    global _worker_spider
+    if not verbose:
+        sys.stdout = open(os.devnull, "w")
+    _worker_spider = make_spider(spider_kwargs, office_index, NothingStored())
+
+
+def parse_notice_page(page):
+    '''
+    Parse a single saved notice page
+    @return list of item dictionaries
+    '''
+    name, url, body = page
+    response = make_response(name, url, body, FBO_NOTICE_PAGE)
+    try:
+        return [dict(output) for output in _worker_spider.parse_fbo_solicitation(response) or []
+                if isinstance(output, Opportunity)]
+    except Exception as error:
+        print >> sys.stderr, "===> Failed to parse " + name + ": " + repr(error)
+        return []
+
+
+def replay(source, db, spider_kwargs = None, workers = None, overwrite = False, verbose = False):
+    '''
+    Run all pages from the source through the spider's parsing code and store the notices in db
+    @param source directory or archive with the saved pages
+    @param db PandasExcelHelper or SqliteHelper to store the notices in
+    @param spider_kwargs arguments for FboDarpaSpider (as would be passed with -a to scrapy)
+    @param workers number of worker processes for parsing notice pages (defaults to number of CPUs)
+    @param overwrite whether to replace notices that are already in the database
+    @return dictionary with page & notice counts
+    '''
+    spider_kwargs = spider_kwargs or {}
+    stats = {"pages": 0, DARPA_LIST_PAGE: 0, FBO_LIST_PAGE: 0, FBO_NOTICE_PAGE: 0,
+             "unrecognized": 0, "listed": 0, "notices": 0, "stored": 0}
+    main_spider = make_spider(spider_kwargs, None, db)
+
+    # first pass: darpa.mil listings have to be done before the notices, to resolve the offices
+    for name, url, body in iter_pages(source):
+        kind = classify_page(body)
+        stats["pages"] += 1
+        if kind is None:
+            stats["unrecognized"] += 1
+            continue
+        stats[kind] += 1
+        if kind == DARPA_LIST_PAGE:
+            for _ in main_spider.parse_darpa_website_announcement_list(make_response(name, url, body, kind)):
+                pass
+        elif kind == FBO_LIST_PAGE:
+            # requests for the notices on the list page are not followed, only counted
+            stats["listed"] += sum(1 for _ in main_spider.parse_fbo_solicitations_list_page(
+                                        make_response(name, url, body, kind)))
+
+    # second pass: notices, parsed by the worker processes
+    notice_pages = (page for page in iter_pages(source) if classify_page(page[2]) == FBO_NOTICE_PAGE)
+    start_time = time.time()
+    pool = multiprocessing.Pool(workers, _init_worker,
+                                (spider_kwargs, main_spider.office_index, verbose))
+    try:
+        while True:
+            batch = list(itertools.islice(notice_pages, replay_batch_size))
+            if len(batch) == 0:
+                break
+            for items in pool.imap_unordered(parse_notice_page, batch, chunksize = 32):
+                for item in items:
+                    stats["notices"] += 1
+                    if overwrite or not db.contains(item["sponsor_number"]):
+                        db.add_item(item)
+                        stats["stored"] += 1
+    finally:
+        pool.close()
+        pool.join()
+    elapsed = time.time() - start_time
+    stats["notice_pages_per_second"] = stats[FBO_NOTICE_PAGE] / elapsed if elapsed > 0 else 0.0
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description = "Replay saved fbo.gov / darpa.mil pages "
+                                     + "through FboDarpaSpider without network access.")
+    parser.add_argument("source", help = "directory, .zip/.tar(.gz/.bz2) archive or page archive with the saved pages")
+    parser.add_argument("-b", "--backend", default = "sqlite", choices = ["sqlite", "excel"],
+                        help = "database backend to store the notices in")
+    parser.add_argument("-d", "--db", default = None,
+                        help = "database file (defaults to the backend's default file)")
+    parser.add_argument("-w", "--workers", type = int, default = None,
+                        help = "number of parsing processes (defaults to number of CPUs)")
+    parser.add_argument("-a", dest = "spider_args", action = "append", default = [],
+                        metavar = "NAME=VALUE", help = "spider argument, as for scrapy crawl")
+    parser.add_argument("-o", "--overwrite", action = "store_true",
+                        help = "replace notices that are already in the database")
+    parser.add_argument("-r", "--report", action = "store_true", help = "generate a report afterwards")
+    parser.add_argument("-v", "--verbose", action = "store_true", help = "show the spider's output")
+    args = parser.parse_args()
+
+    spider_kwargs = dict(spider_arg.split("=", 1) for spider_arg in args.spider_args)
+    if args.backend == "sqlite":
+        db = (SqliteHelper(db_filename = args.db, excel_filename = os.path.splitext(args.db)[0] + ".xlsx")
+              if args.db else SqliteHelper())
+    else:
+        db = PandasExcelHelper(db_filename = args.db) if args.db else PandasExcelHelper()
+    # the replayed darpa.mil offices go next to the database, not into the crawl's darpa_offices.json
+    spider_kwargs.setdefault("offices", os.path.splitext(db.db_filename)[0] + ".darpa_offices.json")
+
+    stats = replay(args.source, db, spider_kwargs, args.workers, args.overwrite, args.verbose)
+    if args.report:
+        db.generate_report()
+    db.close()
+    print "\n========  Replay done  ========"
+    for key in sorted(stats):
+        print key + ": " + str(stats[key])
+
+if __name__ == "__main__":
+    main()
@@ -13,12 +13,84 @@
 BOT_NAME = 'fbo_scraper'
 
 SPIDER_MODULES = ['fbo_scraper.spiders']
-ITEM_PIPELINES = {'fbo_scraper.pipelines.FboScraperExcelPipeline':0}
+ITEM_PIPELINES = {'fbo_scraper.pipelines.SynopsisPipeline':0,
+                  'fbo_scraper.pipelines.FboScraperExcelPipeline':100}
 NEWSPIDER_MODULE = 'fbo_scraper.spiders'
 
 ROBOTSTXT_OBEY = False
 RANDOMIZE_DOWNLOAD_DELAY = True
 DOWNLOAD_DELAY = 5.0
+# The agencies passed to the spider (-a agencies=...) are crawled concurrently in the same
+# process, so they share the download slots & connection pools of www.fbo.gov and www.darpa.mil.
+# With the adaptive throttle below, the concurrency limit applies to each (host, request class) slot.
+CONCURRENT_REQUESTS = 16
+CONCURRENT_REQUESTS_PER_DOMAIN = 2
+
+DOWNLOADER_MIDDLEWARES = {'fbo_scraper.throttle.AdaptiveThrottleMiddleware':950,
+                          'fbo_scraper.pagearchive.PageArchiveMiddleware':960}
+
+# Adaptive throttling (see fbo_scraper/throttle.py): separate download slots for fbo.gov list
+# queries, fbo.gov notice pages & darpa.mil listing pages, each starting out at the start delay
+# and following the server's latency within [min delay, max delay]. The delay is multiplied by the
+# backoff factor on 429 / 5xx responses & download errors. Effective rates are logged at the end.
+FBO_THROTTLE_ENABLED = True
+FBO_THROTTLE_START_DELAY = DOWNLOAD_DELAY
+FBO_THROTTLE_MIN_DELAY = 0.5
+FBO_THROTTLE_MAX_DELAY = 60.0
+FBO_THROTTLE_TARGET_CONCURRENCY = 1.0
+FBO_THROTTLE_BACKOFF = 2.0
+FBO_THROTTLE_DEBUG = False
+
+# Timing of the crawl stages & notice counters (see fbo_scraper/metrics.py), written at the end
+# of the crawl and every FBO_METRICS_INTERVAL seconds (0 = only at the end). File names ending
+# with .prom or .txt get the Prometheus text format, others json. Set to None to disable.
+EXTENSIONS = {'fbo_scraper.metrics.MetricsExtension':500}
+FBO_METRICS_FILE = "fbo_metrics.json"
+FBO_METRICS_INTERVAL = 60
+
+# Storage for scraped notices: "sqlite" appends each notice to fbo_solicitations.sqlite
+# and exports fbo_solicitations.xlsx at the end of the crawl, "excel" rewrites the
+# excel workbook directly as notices come in
+FBO_DB_BACKEND = "sqlite"
+# Notices are handed to a background thread that writes them to the database, through a queue
+# of at most FBO_DB_WRITER_QUEUE_SIZE notices (the crawl waits for room when it is full)
+FBO_DB_WRITER_THREAD = True
+FBO_DB_WRITER_QUEUE_SIZE = 1000
+# Keep a full-text index of the stored titles & synopses next to the database, e.g.
+# fbo_solicitations.textindex.sqlite (search with python -m fbo_scraper.db.textindex search ...)
+FBO_TEXT_INDEX = True
+# Reports only have the open notices that are new, changed or, for the first time, within FBO_REPORT_DEADLINE_DAYS
+# of their deadline since the last report, as recorded in fbo_solicitations.report_watermark.json
+# (False = every report has all open notices)
+FBO_DELTA_REPORT = True
+FBO_REPORT_DEADLINE_DAYS = 14
+# Synopses of notices whose description has more than FBO_SYNOPSIS_POOL_THRESHOLD characters
+# are normalized on a pool of FBO_SYNOPSIS_POOL_PROCESSES processes, off the reactor (0 = never)
+FBO_SYNOPSIS_POOL_THRESHOLD = 100000
+FBO_SYNOPSIS_POOL_PROCESSES = 2
+# Prefix of the bloom filter & key table of archived sponsor numbers (built with
+# python -m fbo_scraper.db.bloom ...), whose notices are not scraped again. None = no archive.
+FBO_ARCHIVE_INDEX = None
+
+# On-disk cache of fbo.gov notice pages and darpa.mil listing pages (in .scrapy/httpcache),
+# keyed by notice id / listing page number. Cached pages younger than the max age are served
+# without a request, older ones are revalidated or re-downloaded.
+HTTPCACHE_ENABLED = True
+HTTPCACHE_DIR = "httpcache"
+HTTPCACHE_STORAGE = "fbo_scraper.httpcache.NoticeCacheStorage"
+HTTPCACHE_POLICY = "fbo_scraper.httpcache.NoticeCachePolicy"
+# entries not refreshed for this long are removed (90 days)
+HTTPCACHE_EXPIRATION_SECS = 90 * 24 * 3600
+FBO_HTTPCACHE_MAX_BYTES = 512 * 1024 * 1024
+FBO_HTTPCACHE_NOTICE_MAX_AGE = 7 * 24 * 3600
+FBO_HTTPCACHE_DARPA_MAX_AGE = 24 * 3600
+
+# Append-only, compressed archive of every downloaded fbo.gov notice page and darpa.mil listing page
+# (see fbo_scraper/pagearchive.py), with an index by notice id / listing page number & fetch time in
+# <archive>.index.sqlite. Pages are compressed together in chunks of about FBO_PAGE_ARCHIVE_CHUNK_SIZE
+# bytes. None = no archive.
+FBO_PAGE_ARCHIVE = "fbo_pages.archive"
+FBO_PAGE_ARCHIVE_CHUNK_SIZE = 256 * 1024
 
 # Crawl responsibly by identifying yourself (and your website) on the user-agent
 # !!! ATTENTION: PLEASE REPLACE WITH YOUR OWN WEBSITE IF YOU ARE GOING TO USE USER_AGENT!
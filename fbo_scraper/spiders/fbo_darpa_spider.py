@@ -8,43 +8,52 @@
 ################################################################################
 
 import scrapy.http
+from scrapy import signals
+from scrapy.exceptions import DontCloseSpider
 import re
+import hashlib
 import random
-from scrapy.selector import Selector
-import htmlentitydefs
 import time
 import datetime
 from datetime import date, timedelta
 from scrapy.utils.response import open_in_browser
 
 from fbo_scraper.items import Opportunity
+from fbo_scraper.agencies import parse_agencies, DARPA_WEBSITE
+from fbo_scraper.checkpoint import CrawlCheckpoint
+from fbo_scraper.offices import OfficeIndex
+from fbo_scraper.metrics import metrics, timed
+from fbo_scraper.extraction import (parse_document, extract_notice_fields, normalize_synopsis,
+									date_pattern, office_wide_pattern)
 from numpy.f2py.auxfuncs import throw_error
 #from fbo_scraper.db.pdexcel import PandasExcelHelper
 
 class FboDarpaSpider(scrapy.Spider):
 	'''
-	A utility for scraping DARPA funding solicitations from the fbo.gov website
+	A utility for scraping DARPA (and other agencies') funding solicitations from the fbo.gov website
 	Run from root directory (top-level fbo_scraper folder) like this:
 		scrapy crawl fbo_darpa
+	or, to crawl several agencies at once (see fbo_scraper/agencies.py):
+		scrapy crawl fbo_darpa -a agencies=darpa,dca
 	'''
 	#spider's name (for scrapy)
 	name = "fbo_darpa"
 	
-	# this number is specific for DARPA.
-	#  see value attribute of <input id="dnf_class_values_procurement_notice__agency_" ...>
-	#  after you type & choose the name of the desired agency on the fbo.gov front page.
-	agency_id = "048f413b4c64abc6c0afbc36b09f099d"
-	
-	# this name is specific for DARPA. It may be nonessential, I (Algomorph) have not checked.
-	#  see value attribute of <input id="autocomplete_input_dnf_class_values_procurement_notice__agency_" ...>
-	#  after you type & choose the name of the desired agency on the fbo.gov front page. 
-	agency_autocomplete_name = "Other Defense Agencies/Defense Advanced Research Projects Agency"
 	allowed_domains = ["www.fbo.gov", "www.darpa.mil"]
 	
 	# number of opportunities per page for the fbo.gov website
 	opportunities_per_page = 100
 	fbo_index_url = "https://www.fbo.gov/index"
 	fbo_start_url = fbo_index_url + "?s=opportunity&mode=list&tab=list&tabmode=list&pp=" + str(opportunities_per_page)
+	# list sorting by posted date, newest first (see "Sort By" select on the fbo.gov list page)
+	fbo_sort_newest_first = "&_psort=current_posted_date-d-desc"
+	
+	# for normalizing the text of fbo.gov list rows before fingerprinting them
+	whitespace_pattern = re.compile(r"\s+", re.UNICODE)
+	
+	# descriptions with more characters than this are left to SynopsisPipeline, which normalizes
+	# them on a process pool (set by the pipeline when it is enabled, 0 = always normalize here)
+	synopsis_pool_threshold = 0
 	
 	darpa_index_url = "http://www.darpa.mil"
 	darpa_start_url = darpa_index_url + "/work-with-us/opportunities?ppl=viewall&PP=0"
@@ -63,7 +72,13 @@ class FboDarpaSpider(scrapy.Spider):
 	def __init__(self, 
 				dont_skip_continuous="false", 
 				dont_skip_office_wide="false", 
-				date_range="last_week",
+				date_range="all",
+				incremental="false",
+				agencies="darpa",
+				checkpoint="fbo_crawl_checkpoint.json.gz",
+				resume="true",
+				offices="darpa_offices.json",
+				full_darpa_refresh="false",
 				*args, **kwargs):
 		'''
 		Constructor
@@ -78,7 +93,28 @@ class FboDarpaSpider(scrapy.Spider):
 				<month (2 numbers)> / <day (2 numbers)> / <year (4 numbers)>,
 				or just <month/day> for current year,
 				also may be one of "last_week", "this_week" or "all". 
-				IMPLEMENTATION PENDING: CURRENTLY HAS NO EFFECT!
+				Limits the fbo.gov query to notices posted within the range
+				(the default, "all", does not limit it).
+		@type date_range String
+		@param incremental whether to go through the fbo.gov list pages newest-first, one
+				at a time, and stop at the first page that has only notices already in
+				the database. Set to "true" or "false".
+		@type incremental String
+		@param agencies comma-separated short names of the agencies to crawl, e.g. "darpa,dca"
+				(see fbo_scraper/agencies.py). All of them are crawled concurrently.
+		@type agencies String
+		@param checkpoint file to keep the crawl frontier in while crawling (removed once the 
+				crawl finishes), "" to disable checkpointing
+		@type checkpoint String
+		@param resume whether to resume from the checkpoint file left by a crawl that did not finish
+				(with the same agencies & date range). Set to "true" or "false".
+		@type resume String
+		@param offices file to keep the index of darpa.mil announcement offices in between crawls,
+				"" to rebuild it from all the darpa.mil listing pages on every crawl
+		@type offices String
+		@param full_darpa_refresh whether to go through all the darpa.mil listing pages, rather 
+				than only the newest ones until a page brings no new announcements. Set to "true" or "false".
+		@type full_darpa_refresh String
 		'''
 		
 		self.data_params_determined = False
@@ -93,22 +129,60 @@ class FboDarpaSpider(scrapy.Spider):
 		else:
 			self.dont_filter_office_wide = False
 			
-		# a dictionary of DARPA announcements, keyed by opportunity_title, 
-		# containing office of each as scraped from the darpa.mil website
-		self.darpa_announcement_dict = {}
+		if(incremental in ["true", "yes", "y", "Y"]):
+			self.incremental = True
+		else:
+			self.incremental = False
+		
+		self.agencies = parse_agencies(agencies)
+		self.agency_by_name = dict((agency.name, agency) for agency in self.agencies)
+		# number of fbo.gov list pages for each agency, keyed by agency name
+		self.list_page_numbers = {}
+		# number of notices found on fbo.gov for each agency, keyed by agency name
+		self.num_opportunities_found = {}
+		
+		self.checkpoint_filename = checkpoint
+		if(resume in ["true", "yes", "y", "Y"]):
+			self.resume = True
+		else:
+			self.resume = False
+		# opened when the crawl starts (see start_requests)
+		self.checkpoint = None
+			
+		# offices of the DARPA announcements as scraped from the darpa.mil website (on this & 
+		# previous crawls), looked up by solicitation number or title
+		self.office_index = OfficeIndex(offices if offices != "" else None)
+		self.office_index.load()
+		# with an empty index, all darpa.mil listing pages are requested at once
+		self.full_darpa_refresh = (full_darpa_refresh in ["true", "yes", "y", "Y"] 
+								or len(self.office_index) == 0)
+		# number of the last darpa.mil listing page (0-based), known once the first one is parsed
+		self.darpa_last_page_num = 0
+		# number of darpa.mil listing pages requested, but not yet parsed
+		self.darpa_pages_pending = 0
+		# (notice, agency) tuples parsed before all darpa.mil listing pages were, waiting for their office
+		self.opportunities_awaiting_office = []
+		# whether a request releasing the notices above (see spider_idle) is on its way
+		self.darpa_release_scheduled = False
 			
 		# seed the random generator
 		random.seed()
 		
-		#TODO: use the posted date range to limit the fbo query
 		self.parse_date_range(date_range)
 
 		super(FboDarpaSpider, self).__init__(*args, **kwargs)
+	
+	@classmethod
+	def from_crawler(cls, crawler, *args, **kwargs):
+		spider = super(FboDarpaSpider, cls).from_crawler(crawler, *args, **kwargs)
+		crawler.signals.connect(spider.spider_idle, signal=signals.spider_idle)
+		return spider
 		
 	def parse_date_range(self,date_range_str):
 		'''
 		called to parse the passed-in date range string into the self.from_date and self.to_date
 		'''
+		self.all_dates = False
 		if(date_range_str == "last_week" or date_range_str == "this_week"):
 			#this week or last week
 			today = date.today()
@@ -129,6 +203,7 @@ class FboDarpaSpider(scrapy.Spider):
 			self.to_date = sunday
 		elif(date_range_str == "all"):
 			#from beginning of time (1969 for programmers) till the end of time
+			self.all_dates = True
 			self.from_date = date.fromtimestamp(0)
 			#Year 3000 might not be the end of time, but I hope this script will be deprecated by then
 			self.to_date = date(3000,1,1)
@@ -150,10 +225,10 @@ class FboDarpaSpider(scrapy.Spider):
 			self.to_date = date(month=int(matches[1][0]),
 								day=int(matches[1][1]),
 								#fix if missing year
-								year=(today.year if matches[1][2] == "" else int(matches[0][2])))
-			if(self.from_date < self.to_date):
-				raise ValueError("The date_range invalid: end date (" + str(self.from_date) 
-								+ ") precedes start date (" + str(self.to_date) + ").")
+								year=(today.year if matches[1][2] == "" else int(matches[1][2])))
+			if(self.to_date < self.from_date):
+				raise ValueError("The date_range invalid: end date (" + str(self.to_date) 
+								+ ") precedes start date (" + str(self.from_date) + ").")
 				
 	
 	def start_requests(self):
@@ -161,23 +236,108 @@ class FboDarpaSpider(scrapy.Spider):
 		@override
 		called to construct requests from start url(s)
 		'''
-		yield self.start_darpa_scraping()
+		if(self.checkpoint_filename != ""):
+			self.checkpoint = CrawlCheckpoint(self.checkpoint_filename, self.crawl_parameters())
+			if(self.resume and self.checkpoint.load()):
+				print "\n\n=========== Resuming crawl from " + self.checkpoint_filename + " ==============\n"
+				for request in self.resume_from_checkpoint():
+					yield request
+				return
+		# darpa.mil offices & fbo.gov notices of all agencies are scraped concurrently,
+		# DARPA notices wait for their office until the darpa.mil listing is done
+		if(any(agency.office_source == DARPA_WEBSITE for agency in self.agencies)):
+			yield self.start_darpa_scraping()
+		for agency in self.agencies:
+			yield self.start_fbo_scraping(agency)
+	
+	def crawl_parameters(self):
+		'''
+		@return the parameters that determine which pages the crawl goes through
+		'''
+		return {
+			"agencies": [agency.name for agency in self.agencies],
+			"from_date": str(self.from_date),
+			"to_date": str(self.to_date),
+			"incremental": self.incremental
+		}
+	
+	def resume_from_checkpoint(self):
+		'''
+		generate the requests for everything the checkpointed crawl did not get to: the darpa.mil listing
+		(if unfinished), the remaining fbo.gov list pages, the pending & the failed notices
+		'''
+		checkpoint = self.checkpoint
+		if(any(agency.office_source == DARPA_WEBSITE for agency in self.agencies)):
+			if(checkpoint.darpa_offices is not None):
+				self.office_index.update(checkpoint.darpa_offices)
+			else:
+				yield self.start_darpa_scraping()
+		for agency in self.agencies:
+			if(agency.name not in checkpoint.list_page_numbers):
+				# did not get past the initial list page
+				yield self.start_fbo_scraping(agency)
+				continue
+			self.list_page_numbers[agency.name] = checkpoint.list_page_numbers[agency.name]
+			for page_id in checkpoint.remaining_list_pages(agency.name, self.incremental):
+				yield self.construct_fbo_list_query_request(self.fbo_list_url(page_id), 
+														self.parse_fbo_solicitations_list_page,
+														agency, meta={"page_id": page_id})
+		notice_urls = dict(checkpoint.pending_notices)
+		# retry the failed ones
+		notice_urls.update(checkpoint.failed_notices)
+		for url, agency_name in notice_urls.items():
+			checkpoint.pending_notices[url] = agency_name
+			yield self.construct_fbo_solicitation_request(url, self.parse_fbo_solicitation, 
+														self.agency_by_name[agency_name])
+		checkpoint.failed_notices = {}
 	
-	def construct_fbo_list_query_request(self, url, callback):
+	def closed(self, reason):
+		'''
+		called by scrapy when the spider is closed
 		'''
-		build a FBO list page query based on the passed-in URL
+		if(len(self.opportunities_awaiting_office) > 0):
+			print ("===> " + str(len(self.opportunities_awaiting_office)) 
+				+ " notice(s) were still waiting for darpa.mil offices and were not stored: ")
+			for opp, agency in self.opportunities_awaiting_office:
+				print opp["program_url"]
+		if(self.office_index.changed):
+			self.office_index.save()
+		if(self.checkpoint is None):
+			return
+		if(reason == "finished"):
+			if(len(self.checkpoint.failed_notices) > 0):
+				print "===> Failed to retrieve " + str(len(self.checkpoint.failed_notices)) + " notice(s): "
+				for url in sorted(self.checkpoint.failed_notices):
+					print url
+			self.checkpoint.remove()
+		else:
+			self.checkpoint.save()
+	
+	def format_posted_date_range(self):
 		'''
+		format the date range for the posted date field of the fbo.gov query
+		(empty when all dates are requested)
+		'''
+		if(self.all_dates):
+			return ""
+		return self.from_date.strftime("%m/%d/%Y") + " - " + self.to_date.strftime("%m/%d/%Y")
+	
+	def construct_fbo_list_query_request(self, url, callback, agency, meta=None):
+		'''
+		build a FBO list page query for the given agency based on the passed-in URL
+		'''
+		posted_date_range = self.format_posted_date_range()
 		payload = {
 			"dnf_class_values[procurement_notice][keywords]":"",
-			"dnf_class_values[procurement_notice][_posted_date]":"",
-			"dnf_class_values[procurement_notice][agency]":FboDarpaSpider.agency_id,
+			"dnf_class_values[procurement_notice][_posted_date]":posted_date_range,
+			"dnf_class_values[procurement_notice][agency]":agency.agency_id,
 			"dnf_class_values[procurement_notice][zipstate]":"",
 			"dnf_class_values[procurement_notice][procurement_type][]":"",
 			"dnf_class_values[procurement_notice][set_aside][]":"",
 			"dnf_class_values[procurement_notice][dnf_class_name]":"procurement_notice",
 			"dnf_class_values[procurement_notice][notice_id]":"af741dd47e56d8a1b06c0a2788481f07",
-			"dnf_class_values[procurement_notice][posted]":"" ,
-			"autocomplete_input_dnf_class_values[procurement_notice][agency]":FboDarpaSpider.agency_autocomplete_name,
+			"dnf_class_values[procurement_notice][posted]":posted_date_range,
+			"autocomplete_input_dnf_class_values[procurement_notice][agency]":agency.autocomplete_name,
 			"search_filters":"search",
 			"_____dummy":"dnf_",
 			"so_form_prefix":"dnf_",
@@ -203,69 +363,199 @@ class FboDarpaSpider(scrapy.Spider):
 			"Referer":"https://www.fbo.gov/",
 			"User-Agent":"Mozilla/5.0 (Windows NT 6.3; WOW64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/43.0.2357.81 Safari/537.36"
 		}
+		meta = dict(meta or {})
+		meta["agency"] = agency.name
 		return scrapy.http.FormRequest(url, callback=callback,
 								method="POST", formdata=payload,
-								headers=headers)
+								headers=headers, meta=meta)
 
 	def start_darpa_scraping(self):
 		'''
 		start scraping the office from the announcements on the darpa.mil hash, 
-		and storing them in a local dictionary
+		and storing them in the office index
 		'''
-		return scrapy.http.FormRequest(FboDarpaSpider.darpa_start_url, callback=self.parse_darpa_website_announcement_list,
-									method="GET")
+		return self.construct_darpa_list_request(FboDarpaSpider.darpa_start_url)
 	
+	def construct_darpa_list_request(self, url):
+		'''
+		build a request for a single darpa.mil announcement listing page
+		'''
+		self.darpa_pages_pending += 1
+		return scrapy.http.FormRequest(url, callback=self.parse_darpa_website_announcement_list,
+									errback=self.darpa_announcement_list_failed,
+									method="GET")
 	
+	@timed("parse_darpa_list_page")
 	def parse_darpa_website_announcement_list(self, response):
 		'''
-		parse the list of announcements from the darpa website to get the office & the next list page
+		parse the list of announcements from the darpa website to get the office.
+		On a full refresh, the first page schedules all the remaining list pages at once,
+		otherwise the pages (newest announcements first) are requested one at a time,
+		until one has no announcements that are not in the office index already.
 		'''
-		print "\n\n=========== Parsing darpa.mil Announcement Listing Page ==============\n"
-		print "=========== From URL: " + response.url + "\n"
-		# process the titles and offices
-		titles = [str(unicode_title.strip()) for unicode_title 
-				in response.xpath("//h2[@class='listing__link']/a/text()").extract()]
-		office_acronyms = [str(unicode_office.strip()) for unicode_office 
-						in response.xpath("//div[@class='listing__office']/text()").extract()]
-		offices = [FboDarpaSpider.darpa_office_by_acronym[office_acronym] for office_acronym in office_acronyms]
-		
-		# if the total #-s are not the same, something is wrong here.
-		if(len(offices) != len(titles)):
-			raise RuntimeError("The number of announcement titles (" + str(len(titles)) + 
-							") does not correspond to the number of announcement offices ("
-							+ str(len(offices)) + 
-							") on the darpa.mil page!")
-		
-		for ix_announcement in xrange(len(titles)):
-			self.darpa_announcement_dict[titles[ix_announcement]] = offices[ix_announcement]
-		
-		# pattern for getting page numbers (0-based) from a darpa listing url
-		page_num_pattern = re.compile(r"(?:http:\/\/www\.darpa\.mil)?\/work-with-us\/opportunities\?ppl=viewall&PP=(\d+)")
-		
-		# determine which listing page we are on right now
-		page_num = int(page_num_pattern.match(response.url).groups(0)[0])
-		
-		# get the Page 1, 2, 3, ..., Last urls at the bottom of the page
-		page_urls = [str(url) for url in response.xpath("//div[@class='pager']/ul/li/a/@href")[:-1].extract()]
-		next_darpa_url = None
-		
-		# determine where to go next
-		for page_url in page_urls:
-			url_leads_to_page = int(page_num_pattern.match(page_url).groups(0)[0])
-			if(url_leads_to_page <= page_num):
-				continue
-			next_darpa_url = FboDarpaSpider.darpa_index_url + page_url
-		if(next_darpa_url):
-			# still have more darpa.mil list pages to go through
-			yield scrapy.http.FormRequest(next_darpa_url, callback=self.parse_darpa_website_announcement_list,
-									method="GET")
+		requests = []
+		try:
+			print "\n\n=========== Parsing darpa.mil Announcement Listing Page ==============\n"
+			print "=========== From URL: " + response.url + "\n"
+			# process the titles and offices
+			titles = [str(unicode_title.strip()) for unicode_title 
+					in response.xpath("//h2[@class='listing__link']/a/text()").extract()]
+			office_acronyms = [str(unicode_office.strip()) for unicode_office 
+							in response.xpath("//div[@class='listing__office']/text()").extract()]
+			offices = [FboDarpaSpider.darpa_office_by_acronym[office_acronym] for office_acronym in office_acronyms]
+		
+			# if the total #-s are not the same, something is wrong here.
+			if(len(offices) != len(titles)):
+				raise RuntimeError("The number of announcement titles (" + str(len(titles)) + 
+								") does not correspond to the number of announcement offices ("
+								+ str(len(offices)) + 
+								") on the darpa.mil page!")
+		
+			new_announcement_count = 0
+			for ix_announcement in xrange(len(titles)):
+				if(self.office_index.add(titles[ix_announcement], offices[ix_announcement])):
+					new_announcement_count += 1
+		
+			# pattern for getting page numbers (0-based) from a darpa listing url
+			page_num_pattern = re.compile(r"(?:http:\/\/www\.darpa\.mil)?\/work-with-us\/opportunities\?ppl=viewall&PP=(\d+)")
+		
+			# determine which listing page we are on right now
+			page_num = int(page_num_pattern.match(response.url).groups(0)[0])
+		
+			if(page_num == 0):
+				# get the Page 1, 2, 3, ..., Last urls at the bottom of the page,
+				# the "Last" link tells how many pages there are in total
+				page_urls = [str(url) for url in response.xpath("//div[@class='pager']/ul/li/a/@href").extract()]
+				last_page_num = 0
+				for page_url in page_urls:
+					match = page_num_pattern.match(page_url)
+					if(match):
+						last_page_num = max(last_page_num, int(match.group(1)))
+				self.darpa_last_page_num = last_page_num
+				if(self.full_darpa_refresh):
+					for next_page_num in xrange(1, last_page_num + 1):
+						requests.append(self.construct_darpa_list_request(FboDarpaSpider.darpa_index_url 
+									+ "/work-with-us/opportunities?ppl=viewall&PP=" + str(next_page_num)))
+		
+			if(not self.full_darpa_refresh and new_announcement_count > 0 and page_num < self.darpa_last_page_num):
+				requests.append(self.construct_darpa_list_request(FboDarpaSpider.darpa_index_url 
+									+ "/work-with-us/opportunities?ppl=viewall&PP=" + str(page_num + 1)))
+		except Exception:
+			# the page still counts as done, so that the notices waiting for it are not held forever
+			self.logger.exception("Failed to parse darpa.mil listing page %s", response.url)
+		for request in requests:
+			yield request
+		for opp in self.finish_darpa_list_page():
+			yield opp
+			
+	def darpa_announcement_list_failed(self, failure):
+		'''
+		errback for darpa.mil listing pages: don't hold up the notices because of a failed page
+		'''
+		print "===> Failed to retrieve darpa.mil listing page: " + repr(failure.value)
+		return self.finish_darpa_list_page()
+		
+	def finish_darpa_list_page(self):
+		'''
+		mark one darpa.mil listing page as processed. Once all of them are, returns the notices
+		that were waiting for the darpa.mil offices, otherwise an empty list.
+		'''
+		self.darpa_pages_pending -= 1
+		if(self.darpa_pages_pending > 0):
+			return []
+		return self.release_awaiting_notices()
+	
+	def release_awaiting_notices(self, response=None):
+		'''
+		fill in the offices of the notices that were waiting for the darpa.mil listing pages
+		(also the callback & errback of the request scheduled by spider_idle)
+		@return those notices
+		'''
+		self.darpa_pages_pending = 0
+		self.darpa_release_scheduled = False
+		print "\n\n=========== Done with darpa.mil Announcement Listing ==============\n"
+		if(self.office_index.changed):
+			self.office_index.save()
+		if(self.checkpoint is not None):
+			self.checkpoint.set_darpa_offices(self.office_index.offices())
+		awaiting = self.opportunities_awaiting_office
+		self.opportunities_awaiting_office = []
+		for opp, agency in awaiting:
+			self.resolve_office(opp, agency)
+		return [opp for opp, agency in awaiting]
+	
+	def spider_idle(self, spider):
+		'''
+		called by scrapy when there is nothing left to crawl. If notices are still waiting for
+		darpa.mil listing pages that went missing without a callback or an errback, they are
+		released (with a request that needs no download, since items can only come from callbacks)
+		'''
+		if(len(self.opportunities_awaiting_office) == 0):
+			return
+		if(not self.darpa_release_scheduled):
+			print ("===> " + str(self.darpa_pages_pending) + " darpa.mil listing page(s) were lost, releasing " 
+				+ str(len(self.opportunities_awaiting_office)) + " notice(s) waiting for their office")
+			self.darpa_release_scheduled = True
+			self.crawler.engine.crawl(scrapy.Request("data:,", callback=self.release_awaiting_notices, 
+													errback=self.release_awaiting_notices, dont_filter=True), self)
+		raise DontCloseSpider
+	
+	def resolve_office(self, opp, agency):
+		'''
+		fill in the office of the notice from the office source of its agency (e.g. the darpa.mil 
+		announcements), or mark it for manual checking if there is no corresponding announcement
+		'''
+		office = self.lookup_office(opp, agency)
+		if office is not None:
+			opp["office"] = office
+			opp["check_office"] = False
 		else:
-			# done with darpa listing, get stuff from fbo.gov now
-			yield self.start_fbo_scraping()
+			opp["office"] = ""
+			opp["check_office"] = True
+			metrics.increment("notices_office_missing")
+	
+	def lookup_office(self, opp, agency):
+		'''
+		@return office of the notice as known so far, None if unknown
+		'''
+		if agency.office_source == DARPA_WEBSITE:
+			return self.office_index.lookup(opp["sponsor_number"], opp["opportunity_title"])
+		return None
 	
-	# start scraping the official notices from the fbo.gov website
-	def start_fbo_scraping(self):
-		return self.construct_fbo_list_query_request(FboDarpaSpider.fbo_start_url, self.parse_initial_fbo_solicitation_list)
+	# start scraping the official notices of the agency from the fbo.gov website
+	def start_fbo_scraping(self, agency):
+		return self.construct_fbo_list_query_request(self.fbo_list_url(), self.parse_initial_fbo_solicitation_list,
+													agency)
+	
+	@staticmethod
+	def response_meta(response, key, default=None):
+		'''
+		@return value from the meta of the response's request, default if it is not there or 
+		if the response is not tied to a request (e.g. a replayed page)
+		'''
+		try:
+			return response.meta.get(key, default)
+		except AttributeError:
+			return default
+	
+	def response_agency(self, response):
+		'''
+		@return the agency the fbo.gov page was requested for (the first agency if the
+		response is not tied to a request, e.g. a replayed page)
+		'''
+		return self.agency_by_name.get(self.response_meta(response, "agency"), self.agencies[0])
+	
+	def fbo_list_url(self, page_id=None):
+		'''
+		url of the fbo.gov list page with the given number (1-based), sorted newest-first 
+		in incremental mode
+		'''
+		url = FboDarpaSpider.fbo_start_url
+		if(self.incremental):
+			url += FboDarpaSpider.fbo_sort_newest_first
+		if(page_id is not None):
+			url += "&pageID=" + str(page_id)
+		return url
 	
 	
 	def parse_initial_fbo_solicitation_list(self, response):
@@ -275,34 +565,51 @@ class FboDarpaSpider(scrapy.Spider):
 		(i.e. 1, 2, 3, ..., last). Each list page will have at least one and at
 		most <opportunities_per_page> notices.
 		'''
-		print "\n\n=========== Parsing Initial Notice Listing Page ==============\n"
+		agency = self.response_agency(response)
+		print "\n\n=========== Parsing Initial Notice Listing Page (" + agency.name + ") ==============\n"
 		
 		x_of_y_pages_pattern = re.compile(r"\d\s[-]\s\d\d?\d?\s(?:of)\s(\d+)")
 		x_of_y_pages = str(response.xpath("//span[@class='lst-cnt']/text()")[0].extract())
-		self.num_opportunities_found = num_ops = int(x_of_y_pages_pattern
+		self.num_opportunities_found[agency.name] = num_ops = int(x_of_y_pages_pattern
 													.match(x_of_y_pages).group(1))
 		ops_per_page = FboDarpaSpider.opportunities_per_page;
 		
 		# Number of result list pages to traverse after the initial query
-		self.list_page_number = num_pages = num_ops / ops_per_page + int(num_ops % ops_per_page > 0)
-		
-		# tweak the base url to generate urls for each page of result listing
-		base_url = FboDarpaSpider.fbo_start_url
-		list_page_urls = [base_url + "&pageID=" + str(page_id) for page_id in range(1, num_pages + 1)]
+		self.list_page_numbers[agency.name] = num_pages = num_ops / ops_per_page + int(num_ops % ops_per_page > 0)
+		if(self.checkpoint is not None):
+			self.checkpoint.set_list_page_number(agency.name, num_pages)
+		
+		if(self.incremental):
+			# go page by page, starting with the newest notices
+			if(num_pages > 0):
+				yield self.construct_fbo_list_query_request(self.fbo_list_url(1), self.parse_fbo_solicitations_list_page,
+														agency, meta={"page_id": 1})
+			return
 		
+		# tweak the base url to generate urls for each page of result listing &
 		# generate new request list
-		requests = [self.construct_fbo_list_query_request(url, self.parse_fbo_solicitations_list_page) for url in list_page_urls]
+		requests = [self.construct_fbo_list_query_request(self.fbo_list_url(page_id), 
+														self.parse_fbo_solicitations_list_page,
+														agency, meta={"page_id": page_id})
+				for page_id in range(1, num_pages + 1)]
 
 		for request in requests:
 			yield request
 	
-	def construct_fbo_solicitation_request(self, url, callback):
+	def construct_fbo_solicitation_request(self, url, callback, agency, fingerprint=None, refresh=False):
 		'''
 		build and return a single query for a single FBO notice
 		@param url The get url to build around (containing the notice's unique identifier internal to fbo.gov)
 		@type url String
 		@param callback Callback function
 		@type callback Function
+		@param agency Agency the notice belongs to
+		@type agency fbo_scraper.agencies.Agency
+		@param fingerprint fingerprint of the notice's row in the fbo.gov list
+		@type fingerprint String
+		@param refresh whether the notice is already in the database, but changed (i.e. has 
+		to be parsed & stored again, bypassing the response cache)
+		@type refresh bool
 		'''
 		headers = {
 			"Host": "www.fbo.gov",
@@ -315,14 +622,41 @@ class FboDarpaSpider(scrapy.Spider):
 			"Accept-Language": "en-US,en;q=0.8,gl;q=0.6,ru;q=0.4"
 		}
 		return scrapy.http.Request(url, callback=callback,
+								errback=self.fbo_solicitation_failed,
 								method="GET",
-								headers=headers)
+								headers=headers, 
+								meta={"agency": agency.name, "fingerprint": fingerprint, "refresh": refresh})
 	
+	def fbo_solicitation_failed(self, failure):
+		'''
+		errback for notice pages: keep track of the failed ones, so that they can be retried
+		'''
+		print "===> Failed to retrieve notice " + failure.request.url + ": " + repr(failure.value)
+		if(self.checkpoint is not None):
+			self.checkpoint.notice_failed(failure.request.url, failure.request.meta["agency"])
+	
+	def notice_done(self, url):
+		'''
+		mark the notice page as processed in the crawl checkpoint
+		'''
+		if(self.checkpoint is not None):
+			self.checkpoint.notice_done(url)
+	
+	def notices_saved(self, urls):
+		'''
+		called (by the pipeline, on the reactor thread) with the notice page urls of the items 
+		the database has saved: mark them as processed in the crawl checkpoint
+		'''
+		for url in urls:
+			self.notice_done(url)
+	
+	@timed("parse_fbo_list_page")
 	def parse_fbo_solicitations_list_page(self, response):
 		'''
 		parse the FBO opportunitues list page (go down the list and generate query for each notice link)
 		'''
-		print "\n\n=========== Parsing Notice Listing Page =============="
+		agency = self.response_agency(response)
+		print "\n\n=========== Parsing Notice Listing Page (" + agency.name + ") =============="
 		print "=========== From URL: " + response.url + "\n"
 		
 		notice_urls = response.xpath("//a[@class='lst-lnk-notice']/@href").extract()
@@ -336,38 +670,96 @@ class FboDarpaSpider(scrapy.Spider):
 							+str(len(notice_urls))
 							+") does not match number of parsed solicitation ids/numbers (" 
 							+ str(len(solns)) + ").")
+		fingerprints = [self.fingerprint_list_row(row) for row 
+					in response.xpath("//tr[contains(@class,'lst-rw')][.//a[@class='lst-lnk-notice']]")]
+		if(len(fingerprints) != len(notice_urls)):
+			# can't tell which row is which, only check for new notices
+			fingerprints = [None] * len(notice_urls)
+		else:
+			# several notices may share a solicitation number (but only one of them is stored),
+			# so the fingerprint is of all the rows with the same number
+			fingerprints_by_soln = {}
+			for soln, fingerprint in zip(solns, fingerprints):
+				fingerprints_by_soln.setdefault(soln, []).append(fingerprint)
+			fingerprints = [hashlib.sha1("|".join(sorted(fingerprints_by_soln[soln]))).hexdigest() for soln in solns]
 			
 		#check against the dictionary of solicitations we already have.
+		requests = []
 		filtered_notice_urls = []
 		for sol_ix in xrange(len(notice_urls)):
+			fingerprint = fingerprints[sol_ix]
 			if not self.db.contains(solns[sol_ix]):
 				#skip if we alread have this one
 				filtered_notice_urls.append(notice_urls[sol_ix])
-			else:
-				#report
-				print "======= SKIPPING " + solns[sol_ix] + " (already in database) ====== "
+				requests.append(self.construct_fbo_solicitation_request(notice_urls[sol_ix], self.parse_fbo_solicitation,
+																	agency, fingerprint))
+				continue
+			stored_fingerprint = self.db.fingerprint(solns[sol_ix])
+			if(fingerprint is not None and stored_fingerprint is not None and fingerprint != stored_fingerprint):
+				#the notice was amended since it was stored, get it again
+				print "======= RE-FETCHING " + solns[sol_ix] + " (changed since stored) ====== "
+				metrics.increment("notices_changed")
+				filtered_notice_urls.append(notice_urls[sol_ix])
+				requests.append(self.construct_fbo_solicitation_request(notice_urls[sol_ix], self.parse_fbo_solicitation,
+																	agency, fingerprint, refresh=True))
+				continue
+			if(fingerprint is not None and stored_fingerprint is None):
+				#stored before fingerprints were, take this as the fingerprint of the stored version
+				self.db.set_fingerprint(solns[sol_ix], fingerprint)
+			#report
+			print "======= SKIPPING " + solns[sol_ix] + " (already in database) ====== "
+			metrics.increment("notices_skipped")
 
-		requests = [self.construct_fbo_solicitation_request(url, self.parse_fbo_solicitation) 
-				for url in filtered_notice_urls]
+		# (replayed pages are not tied to a request, so they have no page number to keep track of)
+		page_id = self.response_meta(response, "page_id")
+		if(self.checkpoint is not None and page_id is not None):
+			self.checkpoint.list_page_done(agency.name, page_id, filtered_notice_urls)
 		for request in requests:
 			yield request
+		
+		if(self.incremental and page_id is not None):
+			if(len(notice_urls) > 0 and len(filtered_notice_urls) == 0):
+				# the rest of the (older) notices must be in the database already
+				print "======= ALL NOTICES ON LIST PAGE " + str(page_id) + " ALREADY IN DATABASE, STOPPING ======"
+				if(self.checkpoint is not None):
+					self.checkpoint.list_stop(agency.name)
+			elif(page_id < self.list_page_numbers[agency.name]):
+				yield self.construct_fbo_list_query_request(self.fbo_list_url(page_id + 1), 
+														self.parse_fbo_solicitations_list_page,
+														agency, meta={"page_id": page_id + 1})
 
+	def fingerprint_list_row(self, row):
+		'''
+		@return hash of the (whitespace-normalized) text & notice link of a row in the fbo.gov list. 
+		The row has the posted date of the latest amendment, so the hash changes when the notice is amended.
+		'''
+		fragments = [FboDarpaSpider.whitespace_pattern.sub(u" ", fragment).strip() 
+					for fragment in row.xpath(".//text()|.//a[@class='lst-lnk-notice']/@href").extract()]
+		return hashlib.sha1(u"|".join(fragment for fragment in fragments if fragment != u"").encode("utf8")).hexdigest()
+	
+	@timed("parse_fbo_solicitation")
 	def parse_fbo_solicitation(self, response):
 		'''
 		parse the FBO solicitation/notice itself
 		@param response The response object containing the page with the notice.
 		@type Response scrapy.http.Response
 		'''
+		# parse the page once & pull out all the fields we need
+		fields = extract_notice_fields(parse_document(response.body_as_unicode()))
 		try:
-			sponsor_number = str(response.xpath("//div[@id='dnf_class_values_procurement_notice__solicitation_number__widget']/text()")[0].extract()).strip()
+			sponsor_number = str(fields["solicitation_number"][0]).strip()
 		except IndexError:
 			print "======= NO SOLICITATION NUMBER (BAD DATA)! SKIPPING... ======"
+			metrics.increment("notices_without_solicitation_number")
+			self.notice_done(response.url)
 			return
 		
-		if(self.db.contains(sponsor_number)):
+		if(self.db.contains(sponsor_number) and not self.response_meta(response, "refresh", False)):
 			# report
 			print "======= SKIPPING (already in database) ======"
+			metrics.increment("notices_skipped")
 			#alread have this one, skip
+			self.notice_done(response.url)
 			return
 		
 		bad_date = False
@@ -376,15 +768,8 @@ class FboDarpaSpider(scrapy.Spider):
 		print "\n============== Parsing Single Solicitation ====================="
 		print "============== From: " + response.url
 		#=================== GET DEADLINE DATE=================================#
-		date_xpath = "//div[@id='dnf_class_values_procurement_notice__response_deadline__widget']/text()"
-		xpath_result = response.xpath(date_xpath)
-		if(len(xpath_result) == 0):
-			#archive date only
-			date_xpath = "//div[@id='so_formfield_dnf_class_values_procurement_notice_archive__response_deadline_']/div[2]/text()"
-		full_date_string = response.xpath(date_xpath)[0].extract()
-		
-		date_pattern = r"(?:Jan|January|Feb|February|Mar|March|Apr|April|May|Jun|June|Jul|July|Aug|August|Sep|September|Oct|October|Nov|November|Dec|December)\s\d\d?,\s\d\d\d\d"
-		proper_date_string_matches = response.xpath(date_xpath)[0].re(date_pattern)
+		full_date_string = fields["response_deadline"][0]
+		proper_date_string_matches = date_pattern.findall(full_date_string)
 		if(full_date_string.strip() == u"-"):
 			bad_date = True
 			if(not self.dont_filter_continous):
@@ -400,11 +785,9 @@ class FboDarpaSpider(scrapy.Spider):
 		
 		#try getting the original deadline instead
 		if(bad_date):
-			date_xpath = "//div[@id='dnf_class_values_procurement_notice__original_response_deadline__widget']/text()"
-			
-			if(len(response.xpath(date_xpath)) == 1):
-				full_date_string = response.xpath(date_xpath)[0].extract()
-				proper_date_string_matches = response.xpath(date_xpath)[0].re(date_pattern)
+			if(len(fields["original_response_deadline"]) == 1):
+				full_date_string = fields["original_response_deadline"][0]
+				proper_date_string_matches = date_pattern.findall(full_date_string)
 		
 		if(len(proper_date_string_matches) > 0):
 			first_match = str(proper_date_string_matches[0].strip())
@@ -427,12 +810,10 @@ class FboDarpaSpider(scrapy.Spider):
 		opp["deadline_date"] = date_string
 		
 		#=================== GET & PROCESS TITLE ==============================#
-		opp_title = response.xpath("//div[@class='agency-header-w']/div/h2/text()")[0].extract()
-		
-		office_wide_pattern = re.compile(r"Office\s*\-?\s*Wide", re.IGNORECASE)
+		opp_title = fields["title"][0]
 		
 		# check for "Office-Wide" in the title
-		if(len(re.findall(office_wide_pattern, opp_title)) > 0):
+		if(office_wide_pattern.search(opp_title)):
 			check_office_wide = True
 			if(not self.dont_filter_office_wide):
 				# report
@@ -445,58 +826,45 @@ class FboDarpaSpider(scrapy.Spider):
 		#================== THE EASY STUFF (sponsor num, announcement type, url)
 		opp["sponsor_number"] = sponsor_number
 		
-		opp["announcement_type"] = str(response.xpath("//div[@id='dnf_class_values_procurement_notice__procurement_type__widget']/text()")[0].extract().strip())
+		opp["announcement_type"] = str(fields["procurement_type"][0].strip())
 		opp["program_url"] = response.url
+		opp["fingerprint"] = self.response_meta(response, "fingerprint")
 		
 		#============= GET & PROCESS SYNOPSIS (this is tough) =================#
-		opp["synopsis"] = u""
-		full_desc = response.xpath("//div[@id='dnf_class_values_procurement_notice__description__widget']")[0].extract()
-		
-		# some <p> tags have formatting, or perhaps...
-		# some idiot hand-pasted an entry from another website / text document 
-		# and did not remove the formatting, hence the complicated query
-		desc_text_query = ("./body/div/text()|./body/div/p/text()|"  # regular text & paragraphs
-						+ "./body/div/p/span/text()|./body/div/p/span/span/text()|"  # some queer line spacing & kerning 
-						+ "/body/div/p/strong/text()|"  # some bold text / headers
-						+ "./body/div/div/span[@class='added']/text()")  # the dates entries were added
-		sel = Selector(text=full_desc).xpath(desc_text_query).extract()
-		
-		newline = u'\u000D\u000A'
-		if(len(sel) > 100):  # crazy formatting! Collapse (don't insert newlines except for dates)
-			entr_date_pattern = re.compile(r'(?:Jan|Feb|Mar|Apr|May|Jun|Jul|Aug|Sep|Oct|Nov|Dec)\s\d\d?,\s\d\d\d\d\s\d\d?:\d\d?\d\s(?:pm|am)')
-			sel = [entry.strip() + newline if entr_date_pattern.match(entry) or entry == u'Added:' else entry for entry in sel]
+		description = fields["description"]
+		if(self.synopsis_pool_threshold > 0 
+		   and sum(len(fragment) for fragment in description) > self.synopsis_pool_threshold):
+			# huge description: keep the fragments, SynopsisPipeline normalizes them off the
+			# reactor & checks the synopsis for "Office-Wide"
+			opp["synopsis"] = description
 		else:
-			# insert newlines for all entries
-			# trim whitespace
-			sel = [entry.strip() + newline for entry in sel]
-			# get rid of newline for last entry
-			sel[len(sel) - 1] = sel[len(sel) - 1].strip()
-				
-		desc_text = u''.join(sel)
-		# convert html special characters to unicode
-		try:
-			desc_text = re.sub(r'&([^;]+);', lambda m: unichr(htmlentitydefs.name2codepoint[m.group(1)]), desc_text)
-		except(KeyError):
-			pass  # ignore step
-		
-		desc_text = desc_text.strip()  # remove trailing newlines
-		
-		# check for "Office-Wide" in the synopsis
-		if(len(re.findall(office_wide_pattern, desc_text)) > 0):
-			check_office_wide = True
-		
-		opp["synopsis"] = desc_text
+			desc_text = normalize_synopsis(description)
+			
+			# check for "Office-Wide" in the synopsis
+			if(office_wide_pattern.search(desc_text)):
+				check_office_wide = True
+			
+			opp["synopsis"] = desc_text
 		
 		#============GET OFFICE & MARK HAND-CHECK FLAGS========================#
 		
-		if sponsor_number in self.darpa_announcement_dict:
-			opp["office"] = self.darpa_announcement_dict[sponsor_number]
-			opp["check_office"] = False
-		else:
-			opp["office"] = ""
-			opp["check_office"] = True
-		
 		opp["check_date"] = bad_date
 		opp["check_office_wide"] = check_office_wide
 		opp["filtered"] = filtered
+		metrics.increment("notices_parsed")
+		if(bad_date):
+			metrics.increment("notices_bad_date")
+		if(filtered):
+			metrics.increment("notices_filtered")
+		
+		agency = self.response_agency(response)
+		if(agency.office_source == DARPA_WEBSITE and self.darpa_pages_pending > 0 
+		   and self.lookup_office(opp, agency) is None):
+			# not in the office index & the darpa.mil listing is still being refreshed,
+			# the office will be filled in once it is done
+			self.opportunities_awaiting_office.append((opp, agency))
+			return
+		
+		self.resolve_office(opp, agency)
+		# (the notice is done once the database has saved it, see notices_saved)
 		yield opp
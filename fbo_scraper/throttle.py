@@ -0,0 +1,174 @@
+################################################################################
+#    @author: Greg Kramida (github id: Algomorph)
+# @copyright: (2015-2016) Gregory Kramida
+#   @license: Apache V2
+#            [That means (basically): feel free to modify, sell,
+#             whatever, just do not remove the original author's credits/notice
+#             from the files. For details, see LICENSE file.]
+################################################################################
+'''
+Adaptive download throttling with a separate rate budget per host & request class
+(fbo.gov list queries, fbo.gov notice pages, darpa.mil listing pages, ...), see
+FBO_THROTTLE_* settings.
+
+Each (host, class) pair gets its own scrapy download slot. The delay of the slot
+follows the observed latency, the same way scrapy's AutoThrottle does it, so that it
+drops towards FBO_THROTTLE_MIN_DELAY while the server responds quickly. It is multiplied
+by FBO_THROTTLE_BACKOFF on 429 / 5xx responses and on download errors.
+'''
+import time
+import logging
+from urlparse import urlparse
+
+from scrapy import signals
+from scrapy.exceptions import NotConfigured
+
+from fbo_scraper.httpcache import request_cache_key
+
+logger = logging.getLogger(__name__)
+
+FBO_LIST_QUERY = "list"
+OTHER_PAGE = "page"
+
+
+def request_class(request):
+    '''
+    @return name of the class of the request: "list" for fbo.gov list queries (POST),
+    "notice" for notice pages, "darpa" for darpa.mil listing pages, "page" for anything else
+    '''
+    if request.method == "POST":
+        return FBO_LIST_QUERY
+    cache_key = request_cache_key(request)
+    if cache_key is not None:
+        return cache_key[0]
+    return OTHER_PAGE
+
+
+class SlotRate(object):
+    '''
+    Response counts & timing for a single download slot
+    '''
+    def __init__(self):
+        self.first_request_time = time.time()
+        self.last_response_time = None
+        self.responses = 0
+        self.errors = 0
+        self.total_latency = 0.0
+
+    def requests_per_second(self):
+        if self.last_response_time is None or self.last_response_time <= self.first_request_time:
+            return 0.0
+        return self.responses / (self.last_response_time - self.first_request_time)
+
+    def mean_latency(self):
+        return self.total_latency / self.responses if self.responses > 0 else 0.0
+
+
+class AdaptiveThrottleMiddleware(object):
+    '''
+    Downloader middleware assigning requests to per-(host, request class) download slots
+    and adapting the delay of each slot to the server's latency & errors
+    '''
+    backoff_statuses = (429, 500, 502, 503, 504)
+
+    def __init__(self, crawler):
+        settings = crawler.settings
+        if not settings.getbool("FBO_THROTTLE_ENABLED"):
+            raise NotConfigured
+        self.crawler = crawler
+        self.start_delay = settings.getfloat("FBO_THROTTLE_START_DELAY", settings.getfloat("DOWNLOAD_DELAY"))
+        self.min_delay = settings.getfloat("FBO_THROTTLE_MIN_DELAY", 0.5)
+        self.max_delay = settings.getfloat("FBO_THROTTLE_MAX_DELAY", 60.0)
+        self.target_concurrency = settings.getfloat("FBO_THROTTLE_TARGET_CONCURRENCY", 1.0)
+        self.backoff = settings.getfloat("FBO_THROTTLE_BACKOFF", 2.0)
+        self.debug = settings.getbool("FBO_THROTTLE_DEBUG")
+        # slot key ==> SlotRate
+        self.rates = {}
+        crawler.signals.connect(self.spider_opened, signal = signals.spider_opened)
+        crawler.signals.connect(self.spider_closed, signal = signals.spider_closed)
+        crawler.signals.connect(self.response_downloaded, signal = signals.response_downloaded)
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        return cls(crawler)
+
+    def spider_opened(self, spider):
+        # new slots start out with this delay
+        spider.download_delay = self.start_delay
+
+    def process_request(self, request, spider):
+        key = request.meta.get("download_slot")
+        if key is None:
+            url = urlparse(request.url)
+            # (urls like data: or file: have no host)
+            key = (url.hostname or url.scheme) + "/" + request_class(request)
+            request.meta["download_slot"] = key
+        if key not in self.rates:
+            self.rates[key] = SlotRate()
+
+    def process_exception(self, request, exception, spider):
+        key, slot = self._get_slot(request)
+        if slot is None:
+            return
+        self.rates[key].errors += 1
+        self._back_off(key, slot, None)
+
+    def response_downloaded(self, response, request, spider):
+        key, slot = self._get_slot(request)
+        latency = request.meta.get("download_latency")
+        if slot is None or latency is None:
+            return
+        rate = self.rates[key]
+        rate.responses += 1
+        rate.total_latency += latency
+        rate.last_response_time = time.time()
+        if response.status in self.backoff_statuses:
+            rate.errors += 1
+            self._back_off(key, slot, response)
+        else:
+            self._adjust_delay(key, slot, latency, response)
+
+    def _get_slot(self, request):
+        key = request.meta.get("download_slot")
+        if key not in self.rates:
+            return key, None
+        return key, self.crawler.engine.downloader.slots.get(key)
+
+    def _set_delay(self, key, slot, delay):
+        if self.debug and delay != slot.delay:
+            logger.info("Throttle: %s delay %.2f s ==> %.2f s", key, slot.delay, delay)
+        slot.delay = delay
+
+    def _adjust_delay(self, key, slot, latency, response):
+        # to have target_concurrency requests processed in parallel, send one every latency/target_concurrency
+        target_delay = latency / self.target_concurrency
+        # approach the target gradually, but follow it at once if the server slows down
+        new_delay = max(target_delay, (slot.delay + target_delay) / 2.0)
+        new_delay = min(max(self.min_delay, new_delay), self.max_delay)
+        # error pages & redirects are small & fast, they should not speed things up
+        if response.status != 200 and new_delay <= slot.delay:
+            return
+        self._set_delay(key, slot, new_delay)
+
+    def _back_off(self, key, slot, response):
+        new_delay = max(slot.delay, self.min_delay) * self.backoff
+        if response is not None and b"Retry-After" in response.headers:
+            try:
+                new_delay = max(new_delay, float(response.headers[b"Retry-After"]))
+            except ValueError:
+                pass  # an http date, ignore
+        self._set_delay(key, slot, min(new_delay, self.max_delay))
+
+    def spider_closed(self, spider):
+        stats = self.crawler.stats
+        for key in sorted(self.rates):
+            rate = self.rates[key]
+            slot = self.crawler.engine.downloader.slots.get(key)
+            delay = slot.delay if slot is not None else None
+            logger.info("Throttle: %s: %d responses, %d errors, %.2f requests/s, mean latency %.2f s, "
+                        "final delay %s", key, rate.responses, rate.errors, rate.requests_per_second(),
+                        rate.mean_latency(), "%.2f s" % delay if delay is not None else "n/a",
+                        extra = {"spider": spider})
+            stats.set_value("throttle/" + key + "/responses", rate.responses, spider = spider)
+            stats.set_value("throttle/" + key + "/errors", rate.errors, spider = spider)
+            stats.set_value("throttle/" + key + "/requests_per_second", rate.requests_per_second(), spider = spider)